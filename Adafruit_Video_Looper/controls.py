@@ -0,0 +1,79 @@
+# License: GNU GPLv2, see LICENSE.txt
+import threading
+from collections import deque
+from time import monotonic
+
+# Commands control sources can queue.
+SEEK = 'seek'                # move relative in the playlist, argument is the amount
+JUMP = 'jump'                # jump to a movie, argument is anything Playlist.set_next takes
+PAUSE = 'pause'              # pause/resume the current movie
+TOGGLE_STOP = 'toggle_stop'  # stop playback or start it again
+SEND_KEY = 'send_key'        # pass a key through to the player, argument is the key
+
+# Produced by drain() for a run of seeks and jumps, argument is a
+# (target, offset) tuple: jump to target (None for the current movie) and
+# then move offset movies from there.
+NAVIGATE = 'navigate'
+
+
+class ControlQueue:
+    """Thread-safe queue that the keyboard, GPIO and rotary handlers push
+    commands into and the main loop consumes, so the playlist and the player
+    are only ever changed from the main loop.
+    """
+
+    def __init__(self, on_put=None, navigate_delay=0):
+        """on_put is called (from the producing thread) after every command,
+        e.g. to wake up the main loop.  Seeks and jumps are held back until
+        none followed for navigate_delay seconds.
+        """
+        self._lock = threading.Lock()
+        self._commands = deque()
+        self._on_put = on_put
+        self._navigate_delay = navigate_delay
+        # (target, offset) of the seeks and jumps held back, see drain().
+        self._navigate = None
+        self._navigated_at = None
+
+    def put(self, command, argument=None):
+        """Queue a command."""
+        with self._lock:
+            if command in (SEEK, JUMP):
+                target, offset = self._navigate or (None, 0)
+                if command == SEEK:
+                    offset += argument
+                else:
+                    # An absolute jump makes everything before it irrelevant.
+                    target, offset = argument, 0
+                self._navigate = (target, offset)
+                self._navigated_at = monotonic()
+            else:
+                self._commands.append((command, argument))
+        if self._on_put is not None:
+            self._on_put()
+
+    def drain(self):
+        """Remove and return all pending commands in order.  Seeks and jumps
+        are merged into one NAVIGATE command so spinning the dial or
+        hammering skip restarts the player only once, on the final target.
+        It is held back until no seek or jump came for navigate_delay seconds
+        (see poll_timeout()), other commands queued meanwhile don't end the
+        wait and are returned right away.  A NAVIGATE that is due comes after
+        the other commands returned with it.
+        """
+        with self._lock:
+            commands = list(self._commands)
+            self._commands.clear()
+            if self._navigate is not None and monotonic() - self._navigated_at >= self._navigate_delay:
+                commands.append((NAVIGATE, self._navigate))
+                self._navigate = None
+        return commands
+
+    def poll_timeout(self):
+        """Return the seconds until a held back NAVIGATE is due, None if
+        there is none.
+        """
+        with self._lock:
+            if self._navigate is None:
+                return None
+            return max(0, self._navigated_at + self._navigate_delay - monotonic())
@@ -0,0 +1,179 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Fast file copying for copy mode.
+
+Files are copied by the kernel with copy_file_range or sendfile where
+possible, so the data never passes through Python.  Otherwise (or when the
+data has to be looked at, e.g. for hashing) large reusable buffers are used.
+Progress callbacks are rate limited, drawing the progress bar for every chunk
+used to slow the copy down more than the USB drive itself.  A Throttle caps
+the rate of copies running next to playback.
+"""
+import errno
+import os
+import threading
+from time import monotonic, sleep
+
+# Size of the copy buffer and of the pieces handed to the kernel at once.
+BUFFER_SIZE = 1 << 20
+KERNEL_CHUNK = 8 << 20
+
+# Errors meaning "not supported for these files", fall back to the next
+# method.
+_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def format_rate(rate):
+    """Return a rate in bytes per second as text."""
+    return '{0:.1f} MB/s'.format(rate / 1e6)
+
+
+def format_eta(seconds):
+    """Return a remaining time in seconds as text."""
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return '{0}:{1:02d}'.format(seconds // 60, seconds % 60)
+
+
+class Progress:
+    """Turns byte counts into rate limited calls of draw(copied, total, rate,
+    eta) with the throughput in bytes per second and the estimated seconds
+    left (None while unknown).  initial is the count a resumed copy starts
+    at, it doesn't count towards the throughput.  fps 0 (or less) draws on
+    every update.
+    """
+
+    def __init__(self, total, draw, fps=10, initial=0):
+        self._total = total
+        self._initial = initial
+        self._draw = draw
+        self._interval = 1.0 / fps if fps > 0 else 0
+        self._start = monotonic()
+        self._next = self._start
+
+    def update(self, copied, skipped=0):
+        """Set the number of bytes copied so far, skipped of which didn't
+        need copying (and don't count towards the throughput).  Only draws if
+        the last draw is long enough ago, or when done.
+        """
+        now = monotonic()
+        if now < self._next and copied < self._total:
+            return
+        self._next = now + self._interval
+        elapsed = now - self._start
+        rate = (copied - self._initial - skipped) / elapsed if elapsed > 0 else 0
+        eta = (self._total - copied) / rate if rate > 0 else None
+        self._draw(copied, self._total, rate, eta)
+
+
+class Throttle:
+    """Limits the average rate of some work, like copying bytes, to rate
+    units per second by sleeping in consume().  Can be shared by threads.
+    """
+
+    def __init__(self, rate):
+        self._rate = rate
+        self._start = None
+        self._amount = 0
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Account for amount units of work, sleeping as long as needed to
+        stay at the rate.
+        """
+        with self._lock:
+            now = monotonic()
+            if self._start is None or now - self._start - self._amount / self._rate > 1.0:
+                # Idle or slower than the rate for a while, don't make up for
+                # it with a burst.
+                self._start = now
+                self._amount = 0
+            self._amount += amount
+            delay = self._start + self._amount / self._rate - now
+        if delay > 0:
+            sleep(delay)
+
+
+class Copier:
+    """Copies files with a reusable buffer.  Not thread safe, use one per
+    thread.
+    """
+
+    def __init__(self, buffer_size=BUFFER_SIZE, kernel_chunk=KERNEL_CHUNK):
+        """kernel_chunk is how much the kernel copies before progress is
+        reported, make it smaller for a smoother Throttle.
+        """
+        self._buffer = bytearray(buffer_size)
+        self._kernel_chunk = kernel_chunk
+        self._view = memoryview(self._buffer)
+        # Cleared once the kernel refused, no need to try again for every
+        # file.
+        self._copy_file_range = hasattr(os, 'copy_file_range')
+        self._sendfile = hasattr(os, 'sendfile')
+
+    def copy(self, src, dst, progress=None):
+        """Copy the file src to dst.  progress is called with the number of
+        bytes copied so far.  Returns the size of the copied file.
+        """
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            position = self.copy_data(fsrc, fdst, 0, size, progress)
+        return position
+
+    def copy_data(self, fsrc, fdst, position, size, progress=None, hasher=None):
+        """Copy the data of the open file fsrc from position on into fdst at
+        the same position, until the end of fsrc.  If hasher is given the data
+        is fed to hasher.update() on the way, which needs the buffered copy.
+        Returns the position reached (the size of the copy).
+        """
+        if hasher is None and self._copy_file_range:
+            position = self._kernel_copy(fsrc, fdst, position, size, progress, True)
+        if hasher is None and self._sendfile and position < size:
+            position = self._kernel_copy(fsrc, fdst, position, size, progress, False)
+        fsrc.seek(position)
+        fdst.seek(position)
+        readinto = fsrc.readinto
+        write = fdst.write
+        view = self._view
+        while True:
+            count = readinto(self._buffer)
+            if not count:
+                break
+            chunk = view[:count]
+            write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            position += count
+            if progress is not None:
+                progress(position)
+        return position
+
+    def _kernel_copy(self, fsrc, fdst, position, size, progress, copy_file_range):
+        """Let the kernel copy from position on.  Returns the position reached,
+        which is short of size if the method isn't supported here.
+        """
+        in_fd = fsrc.fileno()
+        out_fd = fdst.fileno()
+        fdst.flush()
+        while position < size:
+            try:
+                if copy_file_range:
+                    count = os.copy_file_range(in_fd, out_fd, min(self._kernel_chunk, size - position), position, position)
+                else:
+                    os.lseek(out_fd, position, os.SEEK_SET)
+                    count = os.sendfile(out_fd, in_fd, position, min(self._kernel_chunk, size - position))
+            except OSError as err:
+                if err.errno not in _UNSUPPORTED:
+                    raise
+                if copy_file_range:
+                    self._copy_file_range = False
+                else:
+                    self._sendfile = False
+                break
+            if count == 0:
+                # The source shrank, let the buffered copy find its end.
+                break
+            position += count
+            if progress is not None:
+                progress(position)
+        return position
@@ -1,7 +1,7 @@
 # Copyright 2015 Adafruit Industries.
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
-import os
+from .watcher import DirectoryWatcher
 
 class DirectoryReader:
 
@@ -10,31 +10,49 @@ class DirectoryReader:
         directory on disk.
         """
         self._load_config(config)
-        self._filecount = self.count_files()
+        self._watcher = DirectoryWatcher(self._path, recursive=self._recursive,
+                                         debounce=self._debounce)
+        self._changes = None
 
     def _load_config(self, config):
         self._path = config.get('directory', 'path')
+        self._debounce = config.getfloat('directory', 'change_debounce', fallback=1.0)
+        self._recursive = config.getboolean('video_looper', 'scan_subfolders', fallback=False)
 
     def search_paths(self):
         """Return a list of paths to search for files."""
         return [self._path]
 
     def is_changed(self):
-        """Return true if the number of files in the paths have changed."""
-        current_count = self.count_files()
-        if current_count != self._filecount:
-            self._filecount = current_count
-            return True
-        else:
+        """Return true if files in the directory were added, removed or
+        modified.  changes() tells which.
+        """
+        changes = self._watcher.poll()
+        if changes is None:
             return False
+        self._changes = changes
+        return True
+
+    def changes(self):
+        """Return the Changes (added, removed and modified paths) found by the
+        last is_changed() that returned true.
+        """
+        return self._changes
+
+    def fileno(self):
+        """Return the inotify file descriptor so the main loop can wait for
+        directory changes instead of polling."""
+        return self._watcher.fileno()
+
+    def poll_timeout(self):
+        """Return when pending changes settle, or when to list the directory
+        again if inotify isn't available."""
+        return self._watcher.poll_timeout()
 
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
         return 'No files found in {0}'.format(self._path)
 
-    def count_files(self):
-        return len(os.listdir(self._path))
-
 
 def create_file_reader(config, screen):
     """Create new file reader based on reading a directory on disk."""
@@ -0,0 +1,104 @@
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import selectors
+import signal
+
+
+def open_pidfd(pid):
+    """Return a pidfd for the process that becomes readable once it exits, or
+    None if the running kernel or python version doesn't support pidfds.
+    """
+    if not hasattr(os, 'pidfd_open'):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except OSError:
+        return None
+
+
+def close_fd(fd):
+    """Close fd if it is set, ignoring errors."""
+    if fd is not None:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+class EventLoop:
+    """Lets the main loop block until something it cares about happens: a
+    player process exits, a file reader's file descriptor becomes readable, a
+    control input calls wake() or a timeout expires.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self.watches_children = self._watch_children()
+
+    def _watch_children(self):
+        """Route SIGCHLD (and any other signal) into the wakeup pipe so a
+        player process exiting wakes the loop even without pidfd support.
+        """
+        try:
+            signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+            signal.set_wakeup_fd(self._wake_w)
+        except ValueError:
+            # Signals can only be set up from the main thread.
+            return False
+        return True
+
+    def wake(self):
+        """Wake up a pending wait().  Safe to call from any thread."""
+        try:
+            os.write(self._wake_w, b'\0')
+        except (BlockingIOError, OSError):
+            # Pipe is full (a wakeup is already pending) or closed.
+            pass
+
+    def wait(self, fds=(), timeout=None):
+        """Block until one of the provided file descriptors is readable,
+        wake() is called, a signal arrives or timeout seconds have passed
+        (None blocks forever).  Returns the list of readable fds.
+        """
+        registered = []
+        for fd in set(fd for fd in fds if fd is not None):
+            try:
+                self._selector.register(fd, selectors.EVENT_READ)
+                registered.append(fd)
+            except OSError:
+                # fd was closed in the meantime (e.g. the player stopped
+                # from another thread), there is nothing to wait for.
+                timeout = 0
+        try:
+            ready = [key.fd for key, _ in self._selector.select(timeout)]
+        finally:
+            for fd in registered:
+                try:
+                    self._selector.unregister(fd)
+                except (KeyError, ValueError):
+                    pass
+        if self._wake_r in ready:
+            self._drain()
+            ready.remove(self._wake_r)
+        return ready
+
+    def _drain(self):
+        try:
+            while os.read(self._wake_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        """Release the wakeup pipe and stop routing signals into it."""
+        if self.watches_children:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            self.watches_children = False
+        self._selector.close()
+        close_fd(self._wake_r)
+        close_fd(self._wake_w)
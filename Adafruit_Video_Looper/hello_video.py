@@ -3,16 +3,21 @@
 # License: GNU GPLv2, see LICENSE.txt
 import os
 import subprocess
-import time
+
+from .events import open_pidfd, close_fd
+from .metrics import Metrics
 
 
 class HelloVideoPlayer:
 
-    def __init__(self, config):
+    def __init__(self, config, metrics=None):
         """Create an instance of a video player that runs hello_video.bin in the
         background.
         """
+        self._metrics = metrics if metrics is not None else Metrics()
         self._process = None
+        self._confirmed = False
+        self._pidfd = None
         self._load_config(config)
 
     def _load_config(self, config):
@@ -42,6 +47,10 @@ class HelloVideoPlayer:
         self._process = subprocess.Popen(args,
                                          stdout=open(os.devnull, 'wb'),
                                          close_fds=True)
+        self._metrics.mark('spawn')
+        self._confirmed = False
+        self._pidfd = open_pidfd(self._process.pid)
+
     def pause(self):
         #todo add pause to HelloVideoPlayer
         print("pausing is not supported in HelloVideoPlayer")
@@ -54,26 +63,41 @@ class HelloVideoPlayer:
         if self._process is None:
             return False
         self._process.poll()
+        if self._process.returncode is None and not self._confirmed:
+            self._confirmed = True
+            self._metrics.mark('running')
         return self._process.returncode is None
 
+    def fileno(self):
+        """Return a file descriptor that becomes readable when the player
+        process exits, or None if pidfds aren't supported (the main loop then
+        relies on SIGCHLD).
+        """
+        return self._pidfd
+
     def stop(self, block_timeout_sec=0):
         """Stop the video player.  block_timeout_sec is how many seconds to
         block waiting for the player to stop before moving on.
         """
+        self._metrics.mark('stop')
         # Stop the player if it's running.
         if self._process is not None and self._process.returncode is None:
+            self._metrics.mark('dark')
             # process.kill() doesn't seem to work reliably if USB drive is
             # removed, instead just run a kill -9 on it.
             subprocess.call(['kill', '-9', str(self._process.pid)])
         # If a blocking timeout was specified, wait up to that amount of time
-        # for the process to stop.
-        start = time.time()
-        while self._process is not None and self._process.returncode is None:
-            if (time.time() - start) >= block_timeout_sec:
-                break
-            time.sleep(0)
+        # for the process to stop, sleeping in the kernel instead of polling.
+        if self._process is not None:
+            try:
+                self._process.wait(timeout=block_timeout_sec)
+            except subprocess.TimeoutExpired:
+                pass
         # Let the process be garbage collected.
         self._process = None
+        close_fd(self._pidfd)
+        self._pidfd = None
+        self._metrics.mark('stopped')
 
     @staticmethod
     def can_loop_count():
@@ -82,4 +106,4 @@ class HelloVideoPlayer:
 
 def create_player(config, **kwargs):
     """Create new video player based on hello_video."""
-    return HelloVideoPlayer(config)
+    return HelloVideoPlayer(config, metrics=kwargs.get('metrics'))
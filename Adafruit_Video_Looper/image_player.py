@@ -3,11 +3,14 @@
 import os, pygame
 from time import monotonic
 
+from .metrics import Metrics
+
 class ImagePlayer:
 
-    def __init__(self, config, screen, bgimage):
+    def __init__(self, config, screen, bgimage, metrics=None):
         """Create an instance of an image player uses pygame to display static images.
         """
+        self._metrics = metrics if metrics is not None else Metrics()
         self._load_config(config)
         self._screen = screen
         self._loop = 0
@@ -78,6 +81,9 @@ class ImagePlayer:
             #future todo: maybe preload images and/or create pygame image dict
 
         self._startTime = monotonic()
+        # Displaying is synchronous, the image is on screen now.
+        self._metrics.mark('spawn')
+        self._metrics.mark('running')
 
     def pause(self):
         self._isPaused = not self._isPaused
@@ -97,10 +103,21 @@ class ImagePlayer:
         
         return playing
 
+    def poll_timeout(self):
+        """Return the seconds left until the current image has been shown
+        long enough, or None if it is shown until something else happens.
+        """
+        if self._loop <= -1 or self._isPaused:
+            return None
+        return max(0, self._startTime + self._duration*self._loop - monotonic())
+
     def stop(self, block_timeout_sec=0):
         """Stop the image display."""
+        self._metrics.mark('stop')
         self._blank_screen()
         self._startTime = self._startTime-self._duration*self._loop
+        self._metrics.mark('dark')
+        self._metrics.mark('stopped')
 
     def _blank_screen(self, flip=True):
         """Render a blank screen filled with the background color and optional the background image."""
@@ -117,4 +134,4 @@ class ImagePlayer:
 
 def create_player(config, **kwargs):
     """Create new image player."""
-    return ImagePlayer(config, screen=kwargs['screen'], bgimage=kwargs['bgimage'])
+    return ImagePlayer(config, screen=kwargs['screen'], bgimage=kwargs['bgimage'], metrics=kwargs.get('metrics'))
@@ -0,0 +1,114 @@
+# License: GNU GPLv2, see LICENSE.txt
+import ctypes
+import ctypes.util
+import os
+import struct
+
+# Event masks from <sys/inotify.h>.
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+
+# struct inotify_event: int wd, uint32 mask, uint32 cookie, uint32 len,
+# followed by len bytes of NUL padded name.
+_EVENT = struct.Struct('iIII')
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+def _raise_errno(path=None):
+    errno = ctypes.get_errno()
+    raise OSError(errno, os.strerror(errno), path)
+
+
+class InotifyWatch:
+    """Minimal ctypes wrapper around the Linux inotify API watching one or
+    more directories.  The file descriptor can be handed to select/epoll.
+    """
+
+    def __init__(self, path, mask):
+        libc = _get_libc()
+        self._mask = mask
+        self._paths = {}
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            _raise_errno()
+        try:
+            self.add(path)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def add(self, path):
+        """Watch another directory, e.g. a new subdirectory."""
+        wd = _get_libc().inotify_add_watch(self._fd, os.fsencode(path), self._mask | IN_ONLYDIR)
+        if wd < 0:
+            _raise_errno(path)
+        self._paths[wd] = path
+
+    def fileno(self):
+        return self._fd
+
+    def read_events(self):
+        """Drain all pending events.  Returns a list of (directory, name,
+        mask) tuples, name is '' for events about the watched directory
+        itself and directory is None for IN_Q_OVERFLOW.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return events
+            if not data:
+                return events
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if mask & IN_IGNORED:
+                    # The watch is gone (directory deleted or unmounted).
+                    directory = self._paths.pop(wd, None)
+                else:
+                    directory = self._paths.get(wd)
+                events.append((directory, name, mask))
+
+    def watches(self):
+        """Return the number of directories still watched."""
+        return len(self._paths)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def watch_directory(path, mask=IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO):
+    """Return an InotifyWatch for path, or None if inotify isn't available
+    (non-Linux system, missing directory, watch limit reached...).
+    """
+    try:
+        return InotifyWatch(path, mask)
+    except (OSError, AttributeError):
+        return None
@@ -0,0 +1,209 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Local cache of media files on slow drives.
+
+Copies of the files about to be played are made in a local directory by a
+background thread, ahead of the playlist, and played instead of the
+originals.  The cache holds up to a budget of bytes, the least recently
+played files are deleted to make room.  Cached files are named after the
+name, size and modification time of their source, so a changed source is
+cached again, and their modification time records when they were last
+played, so the order survives a restart without an index file.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from .copier import BUFFER_SIZE, Copier, Throttle
+
+
+class MediaCache:
+    """Keeps local copies of media files up to budget bytes, see prefetch()
+    and lookup().
+    """
+
+    def __init__(self, directory, budget, bandwidth_limit=0, name=None):
+        """Cache files in directory.  bandwidth_limit (bytes per second, 0
+        for none) limits how fast the cache is filled, to leave the drive to
+        files played from it meanwhile.  name maps a source path to the name
+        identifying the file, e.g. without the mount point of its drive, the
+        path itself by default.
+        """
+        self._directory = directory
+        self._name = name if name is not None else (lambda path: path)
+        self._budget = budget
+        self._throttle = Throttle(bandwidth_limit) if bandwidth_limit > 0 else None
+        # Small kernel copies, so the throttle can spread them evenly.
+        self._copier = Copier(kernel_chunk=BUFFER_SIZE) if self._throttle is not None else Copier()
+        self._lock = threading.Lock()
+        self._wanted = threading.Condition(self._lock)
+        self._window = None
+        # Cached file name -> size, least recently used first.
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_filled = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._thread = threading.Thread(target=self._fill_loop, name='cache', daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        found = []
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith('.part'):
+                    # Interrupted fill.
+                    os.remove(entry.path)
+                    continue
+                st = entry.stat()
+                found.append((st.st_mtime_ns, entry.name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._size += size
+
+    def _key(self, path):
+        """Return the cache file name and the size of the file at path, None
+        if it can't be read.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        digest = hashlib.blake2b('{0}\0{1}\0{2}'.format(self._name(path), st.st_size, st.st_mtime_ns).encode(),
+                                 digest_size=10).hexdigest()
+        return digest + os.path.splitext(path)[1].lower(), st.st_size
+
+    def lookup(self, path, record=True):
+        """Return the path of the cached copy of the file at path, or path if
+        there is none.  record counts the lookup as a play in the statistics
+        and the least recently used order.
+        """
+        key = self._key(path)
+        if key is None:
+            return path
+        name, size = key
+        with self._lock:
+            hit = name in self._entries
+            if record:
+                if hit:
+                    self._entries.move_to_end(name)
+                    self.hits += 1
+                    self.bytes_saved += size
+                else:
+                    self.misses += 1
+        if not hit:
+            return path
+        cached = os.path.join(self._directory, name)
+        if record:
+            try:
+                # The order is kept in the modification times.
+                os.utime(cached)
+            except OSError:
+                # Evicted meanwhile.
+                return path
+        return cached
+
+    def prefetch(self, paths):
+        """Cache the files at paths in the background, in this order.  Files
+        in the latest call are never evicted for each other.
+        """
+        with self._wanted:
+            self._window = list(paths)
+            self._wanted.notify()
+
+    def _fill_loop(self):
+        while True:
+            with self._wanted:
+                while self._window is None:
+                    self._wanted.wait()
+                window = self._window
+                self._window = None
+            self._fill(window)
+
+    def _fill(self, paths):
+        keys = [(path, self._key(path)) for path in paths]
+        protected = {key[0] for _, key in keys if key is not None}
+        for path, key in keys:
+            if self._window is not None:
+                # Newer wishes came in, follow those.
+                return
+            if key is None:
+                continue
+            name, size = key
+            with self._lock:
+                if name in self._entries:
+                    continue
+            if size > self._budget or not self._make_room(size, protected):
+                continue
+            part = os.path.join(self._directory, name + '.part')
+            try:
+                self._copier.copy(path, part, progress=self._throttled())
+                os.replace(part, os.path.join(self._directory, name))
+            except OSError as err:
+                print('Failed to cache {0}: {1}'.format(path, err))
+                try:
+                    os.remove(part)
+                except OSError:
+                    pass
+                continue
+            with self._lock:
+                self._entries[name] = size
+                self._size += size
+                self.bytes_filled += size
+            print('Cached {0} ({1:.1f} MB)'.format(path, size / 1e6))
+
+    def _throttled(self):
+        """Return a progress callback for a copy keeping to the fill
+        bandwidth limit, None if there is none.
+        """
+        if self._throttle is None:
+            return None
+        position = [0]
+
+        def update(copied):
+            self._throttle.consume(copied - position[0])
+            position[0] = copied
+        return update
+
+    def _make_room(self, size, protected):
+        """Evict the least recently used files, except for those named in
+        protected, until size bytes fit.  Returns false if they don't.
+        """
+        with self._lock:
+            total = self._size
+            victims = []
+            for name, entry_size in self._entries.items():
+                if total + size <= self._budget:
+                    break
+                if name not in protected:
+                    victims.append(name)
+                    total -= entry_size
+            if total + size > self._budget:
+                return False
+            for name in victims:
+                self._size -= self._entries.pop(name)
+        for name in victims:
+            try:
+                os.remove(os.path.join(self._directory, name))
+            except OSError:
+                pass
+        return True
+
+    def hit_rate(self):
+        """Return the share of plays served from the cache."""
+        plays = self.hits + self.misses
+        return self.hits / plays if plays else 0.0
+
+    def stats(self):
+        """Return the cache statistics by name."""
+        return {'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'cache_hit_rate': round(self.hit_rate(), 4),
+                'cache_bytes_saved': self.bytes_saved,
+                'cache_bytes_filled': self.bytes_filled,
+                'cache_bytes_used': self._size}
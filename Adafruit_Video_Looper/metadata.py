@@ -0,0 +1,321 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Read duration, resolution, codec and bitrate from the headers of video
+files without external tools.
+
+Only the container headers are read, with small seeks past the media data:
+the moov box of MP4/MOV/M4V files and the Info and Tracks elements of
+MKV/WebM files.  Results are cached on disk keyed by path, size and
+modification time, so rescanning a drive only probes new or changed files.
+"""
+import json
+import os
+import struct
+import sys
+import threading
+
+from .state import write_atomic
+
+# MP4 boxes holding other boxes on the way to the ones we read.
+_MP4_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+# Matroska element IDs.
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_TRACK_TYPE = 0x83
+_CODEC_ID = 0x86
+_VIDEO = 0xE0
+_PIXEL_WIDTH = 0xB0
+_PIXEL_HEIGHT = 0xBA
+_CLUSTER = 0x1F43B675
+
+# Elements larger than this are never read into memory.
+_MAX_READ = 1 << 20
+
+
+class ProbeError(Exception):
+    """The file isn't a supported container or its headers are damaged."""
+
+
+def _mp4_boxes(f, start, end):
+    """Yield (type, payload offset, payload size) of the boxes between start
+    and end, seeking past their contents.
+    """
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            raise ProbeError('invalid {0!r} box size'.format(kind))
+        yield kind, offset + header_size, size - header_size
+        offset += size
+
+
+def _read(f, offset, size, limit=_MAX_READ):
+    f.seek(offset)
+    return f.read(min(size, limit))
+
+
+def _probe_mp4(f, file_size):
+    info = {}
+    track = {}
+
+    def walk(start, end):
+        for kind, offset, size in _mp4_boxes(f, start, end):
+            if kind in _MP4_CONTAINERS:
+                if kind == b'trak':
+                    track.clear()
+                walk(offset, offset + size)
+                if kind == b'trak' and track.get('handler') == b'vide' and 'codec' not in info:
+                    info.update(width=track.get('width'), height=track.get('height'),
+                                codec=track.get('codec'))
+            elif kind == b'mvhd':
+                data = _read(f, offset, size, 32)
+                if data[0] == 1:
+                    timescale, duration = struct.unpack('>IQ', data[20:32])
+                else:
+                    timescale, duration = struct.unpack('>II', data[12:20])
+                if timescale:
+                    info['duration'] = duration / timescale
+            elif kind == b'tkhd':
+                data = _read(f, offset, size, 128)
+                # Width and height are 16.16 fixed point at the end.
+                width, height = struct.unpack('>II', data[-8:])
+                track['width'], track['height'] = width >> 16, height >> 16
+            elif kind == b'hdlr':
+                track['handler'] = _read(f, offset, size, 12)[8:12]
+            elif kind == b'stsd':
+                # First sample entry: size and codec fourcc.
+                data = _read(f, offset, size, 16)
+                track['codec'] = data[12:16].decode('latin-1').strip()
+
+    walk(0, file_size)
+    if 'duration' not in info:
+        raise ProbeError('no moov box')
+    return info
+
+
+def _ebml_vint(f, keep_marker):
+    """Read an EBML variable size integer.  Returns (value, length), value
+    is None for the reserved "unknown size".
+    """
+    first = f.read(1)
+    if not first:
+        raise ProbeError('unexpected end of file')
+    first = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        raise ProbeError('invalid EBML integer')
+    value = first if keep_marker else first & (mask - 1)
+    rest = f.read(length - 1)
+    for byte in rest:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = None
+    return value, length
+
+
+def _mkv_elements(f, start, end):
+    """Yield (id, payload offset, payload size) of the elements between
+    start and end.  size is None for elements of unknown size.
+    """
+    offset = start
+    while end is None or offset < end:
+        f.seek(offset)
+        try:
+            element, id_length = _ebml_vint(f, True)
+            size, size_length = _ebml_vint(f, False)
+        except ProbeError:
+            return
+        payload = offset + id_length + size_length
+        yield element, payload, size
+        if size is None:
+            return
+        offset = payload + size
+
+
+def _mkv_uint(f, offset, size):
+    return int.from_bytes(_read(f, offset, size, 8), 'big')
+
+
+def _probe_mkv(f, file_size):
+    elements = _mkv_elements(f, 0, file_size)
+    element, _, _ = next(elements, (None, 0, 0))
+    if element != _EBML:
+        raise ProbeError('not an EBML file')
+    for element, offset, size in elements:
+        if element == _SEGMENT:
+            segment = (offset, offset + size if size is not None else file_size)
+            break
+    else:
+        raise ProbeError('no segment')
+    info = {}
+    scale = 1000000
+    duration = None
+    for element, offset, size in _mkv_elements(f, *segment):
+        if element == _INFO:
+            for child, child_offset, child_size in _mkv_elements(f, offset, offset + size):
+                if child == _TIMECODE_SCALE:
+                    scale = _mkv_uint(f, child_offset, child_size)
+                elif child == _DURATION:
+                    data = _read(f, child_offset, child_size, 8)
+                    duration = struct.unpack('>f' if len(data) == 4 else '>d', data)[0]
+        elif element == _TRACKS:
+            for entry, entry_offset, entry_size in _mkv_elements(f, offset, offset + size):
+                if entry != _TRACK_ENTRY:
+                    continue
+                track = {}
+                for child, child_offset, child_size in _mkv_elements(f, entry_offset, entry_offset + entry_size):
+                    if child == _TRACK_TYPE:
+                        track['type'] = _mkv_uint(f, child_offset, child_size)
+                    elif child == _CODEC_ID:
+                        track['codec'] = _read(f, child_offset, child_size, 64).rstrip(b'\0').decode('latin-1')
+                    elif child == _VIDEO:
+                        for video, video_offset, video_size in _mkv_elements(f, child_offset, child_offset + child_size):
+                            if video == _PIXEL_WIDTH:
+                                track['width'] = _mkv_uint(f, video_offset, video_size)
+                            elif video == _PIXEL_HEIGHT:
+                                track['height'] = _mkv_uint(f, video_offset, video_size)
+                if track.get('type') == 1 and 'codec' not in info:
+                    info.update(width=track.get('width'), height=track.get('height'), codec=track.get('codec'))
+        elif element == _CLUSTER:
+            # Media data follows, the headers we need come before it.
+            break
+        if duration is not None and 'codec' in info:
+            break
+    if duration is None:
+        raise ProbeError('no duration in segment info')
+    info['duration'] = duration * scale / 1e9
+    return info
+
+
+def probe(path):
+    """Return a dict with the duration (seconds), width, height, codec and
+    bitrate (bits per second) of a video file.  Raises ProbeError for
+    unsupported or damaged files and OSError if it can't be read.
+    """
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        magic = f.read(12)
+        if magic[:4] == b'\x1a\x45\xdf\xa3':
+            info = _probe_mkv(f, file_size)
+        elif magic[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+            info = _probe_mp4(f, file_size)
+        else:
+            raise ProbeError('unsupported container')
+    if info['duration'] > 0:
+        info['bitrate'] = int(file_size * 8 / info['duration'])
+    return info
+
+
+class MetadataCache:
+    """Probe results persisted in a JSON file, keyed by path and checked
+    against the file's size and modification time.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._dirty = False
+        # Paths of the last scan, see retain().
+        self._retained = None
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                return entries
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            print('Ignoring unreadable metadata cache {0}: {1}'.format(self._path, err))
+        return {}
+
+    def get(self, path):
+        """Return the metadata dict of the file at path, probing it only if it
+        is new or changed since it was cached.  Returns None if the file can't
+        be probed.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = [st.st_size, st.st_mtime_ns]
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry.get('key') == key:
+            return entry.get('info')
+        try:
+            info = probe(path)
+        except (ProbeError, OSError, struct.error, ValueError) as err:
+            # Remember failures too, so broken files aren't probed again.
+            info = None
+            print('Could not read metadata of {0}: {1}'.format(path, err))
+        with self._lock:
+            self._entries[path] = {'key': key, 'info': info}
+            self._dirty = True
+        return info
+
+    def duration(self, movie):
+        """Duration source for timeline.DurationProvider."""
+        info = self.get(movie.target)
+        return info.get('duration') if info else None
+
+    def retain(self, paths):
+        """Drop the entries of files other than those at paths, e.g. the
+        movies found by the latest scan of the drives, on the next save().
+        """
+        retained = set(paths)
+        with self._lock:
+            self._retained = retained
+            if any(path not in retained for path in self._entries):
+                self._dirty = True
+
+    def save(self):
+        """Write the cache to disk if it changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            if self._retained is not None:
+                self._entries = {path: entry for path, entry in self._entries.items()
+                                 if path in self._retained}
+            data = json.dumps(self._entries, separators=(',', ':'))
+            self._dirty = False
+        try:
+            write_atomic(self._path, data)
+        except OSError as err:
+            print('Failed to write metadata cache {0}: {1}'.format(self._path, err))
+
+
+def create_metadata_cache(config):
+    """Create the metadata cache in the configured state directory."""
+    directory = config.get('video_looper', 'state_dir', fallback='/var/lib/video_looper')
+    return MetadataCache(os.path.join(directory, 'metadata.json'))
+
+
+if __name__ == '__main__':
+    # Print the metadata of the files given on the command line.
+    for path in sys.argv[1:]:
+        try:
+            print(path, json.dumps(probe(path)))
+        except (ProbeError, OSError) as err:
+            print(path, 'error:', err)
@@ -0,0 +1,217 @@
+# License: GNU GPLv2, see LICENSE.txt
+import json
+import os
+import threading
+import time
+from time import monotonic
+
+# Fixed points in the life of a transition:
+#   next     - Playlist.get_next returned the movie to play
+#   play     - player.play was called
+#   spawn    - the player process was spawned (or a standby resumed)
+#   running  - the player process was confirmed running
+#   stop     - player.stop was called
+#   stopped  - player.stop completed
+#   dark     - nothing is playing anymore (movie ended or was stopped)
+#   control  - a keypress, GPIO pin or rotary turn asked for a change
+#
+# Each stage is measured from the first mark of its start point to the next
+# mark of its end point.
+STAGES = (
+    ('next_to_play', 'next', 'play'),
+    ('play_to_spawn', 'play', 'spawn'),
+    ('spawn_to_running', 'spawn', 'running'),
+    ('stop', 'stop', 'stopped'),
+    ('gap', 'dark', 'running'),
+    ('control', 'control', 'running'),
+)
+
+START_POINTS = frozenset(start for _, start, _ in STAGES)
+
+# Histogram bucket upper bounds in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus style."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def cumulative(self):
+        """Return (upper bound, cumulative count) pairs."""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    """Collects timestamps at fixed points of every transition, aggregates
+    them into per-stage latency histograms and periodically writes them to a
+    Prometheus textfile or JSON file.
+    """
+
+    def __init__(self, path=None, format='prometheus', interval=60):
+        self._path = path
+        self._format = format
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._marks = {}
+        self._histograms = {name: Histogram() for name, _, _ in STAGES}
+        self._values = {}
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def mark(self, point):
+        """Record that point was reached now.  Completes every stage ending at
+        point that has been started.
+        """
+        now = monotonic()
+        with self._lock:
+            for name, start, end in STAGES:
+                if end == point and start in self._marks:
+                    self._histograms[name].observe(now - self._marks.pop(start))
+            # Keep the earliest mark so e.g. the gap is measured from the
+            # moment the screen went dark, not from the last retry.
+            if point in START_POINTS:
+                self._marks.setdefault(point, now)
+
+    def observe(self, stage, seconds):
+        """Add a measurement to a stage directly."""
+        with self._lock:
+            self._histograms.setdefault(stage, Histogram()).observe(seconds)
+
+    def set(self, name, value):
+        """Set the current value of a gauge, e.g. a counter kept elsewhere."""
+        with self._lock:
+            self._values[name] = value
+
+    def summary(self):
+        """Return count, mean and max seconds of every stage seen so far."""
+        with self._lock:
+            return {name: {'count': h.count,
+                           'mean': h.sum / h.count if h.count else 0.0,
+                           'max': h.max}
+                    for name, h in self._histograms.items() if h.count}
+
+    def start(self):
+        """Start writing the metrics file every interval seconds."""
+        if not self._path or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread and write the metrics one last time."""
+        self._stopped.set()
+        self.write()
+
+    def _write_loop(self):
+        while not self._stopped.wait(self._interval):
+            self.write()
+
+    def write(self):
+        """Write the metrics file atomically."""
+        if not self._path:
+            return
+        with self._lock:
+            if self._format == 'json':
+                data = self._render_json()
+            else:
+                data = self._render_prometheus()
+        tmp_path = self._path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path)
+        except OSError as err:
+            print('Failed to write metrics to {0}: {1}'.format(self._path, err))
+
+    def _render_prometheus(self):
+        lines = ['# HELP video_looper_stage_seconds Latency of playback transition stages.',
+                 '# TYPE video_looper_stage_seconds histogram']
+        for name, histogram in sorted(self._histograms.items()):
+            for bound, count in histogram.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('video_looper_stage_seconds_bucket{{stage="{0}",le="{1}"}} {2}'.format(name, le, count))
+            lines.append('video_looper_stage_seconds_sum{{stage="{0}"}} {1}'.format(name, histogram.sum))
+            lines.append('video_looper_stage_seconds_count{{stage="{0}"}} {1}'.format(name, histogram.count))
+        for name, value in sorted(self._values.items()):
+            lines.append('# TYPE video_looper_{0} gauge'.format(name))
+            lines.append('video_looper_{0} {1}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def _render_json(self):
+        stages = {}
+        for name, histogram in self._histograms.items():
+            stages[name] = {
+                'buckets': {('+Inf' if bound == float('inf') else repr(bound)): count
+                            for bound, count in histogram.cumulative()},
+                'sum': histogram.sum,
+                'count': histogram.count,
+            }
+        return json.dumps({'timestamp': time.time(), 'stages': stages, 'values': self._values}, indent=2)
+
+
+def _process_age():
+    """Return how many seconds ago this process was started, or 0 if that
+    can't be determined (non-Linux system).
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name may contain spaces, skip past its closing paren.
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupReport:
+    """Breaks the time from process start to the first frame down by phase."""
+
+    def __init__(self):
+        self._origin = monotonic() - _process_age()
+        self._last = self._origin
+        self.phases = []
+
+    def phase(self, name):
+        """Record that the phase called name ended now."""
+        now = monotonic()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def total(self):
+        return self._last - self._origin
+
+    def export(self, metrics):
+        """Add the phase durations to metrics as startup_<phase> stages."""
+        for name, seconds in self.phases:
+            metrics.observe('startup_' + name, seconds)
+        metrics.observe('startup_total', self.total())
+
+    def __str__(self):
+        return 'Startup took {0:.3f}s: {1}'.format(
+            self.total(), ', '.join('{0} {1:.3f}s'.format(name, seconds) for name, seconds in self.phases))
+
+
+def create_metrics(config):
+    """Create the metrics collector from the [metrics] config section."""
+    return Metrics(path=config.get('metrics', 'path', fallback=''),
+                   format=config.get('metrics', 'format', fallback='prometheus'),
+                   interval=config.getfloat('metrics', 'interval', fallback=60))
@@ -1,22 +1,62 @@
 # Copyright 2015 Adafruit Industries.
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
+import heapq
 import random
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
 from os.path import basename
 from typing import Optional, Union
 
 random.seed()
 
+class _Generation:
+    """Counter shared by all movies of a playlist.  Bumping it resets every
+    playcount at once.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+
 class Movie:
     """Representation of a movie"""
 
-    def __init__(self, target:str , title: Optional[str] = None, repeats: int = 1):
+    # Playlists of archives can have 100k entries, keep them small.
+    __slots__ = ('target', 'filename', 'title', 'repeats', 'weight', 'duration', 'attributes',
+                 '_playcount', '_generation', '_seen')
+
+    def __init__(self, target:str , title: Optional[str] = None, repeats: int = 1, weight: int = 1,
+                 duration: Optional[float] = None, attributes: Optional[dict] = None):
         """Create a playlist from the provided list of movies."""
         self.target = target
         self.filename = basename(target)
         self.title = title
         self.repeats = int(repeats)
-        self.playcount = 0
+        # How many times the movie comes up per cycle in random playback.
+        self.weight = max(1, int(weight))
+        # Length in seconds if known, see timeline.DurationProvider.
+        self.duration = duration
+        # key="value" pairs from the playlist file, None if there are none.
+        self.attributes = attributes
+        self._playcount = 0
+        self._generation = None
+        self._seen = 0
+
+    @property
+    def playcount(self):
+        # A playcount set before the playlist's last reset is stale.
+        if self._generation is not None and self._seen != self._generation.value:
+            return 0
+        return self._playcount
+
+    @playcount.setter
+    def playcount(self, value):
+        self._playcount = value
+        if self._generation is not None:
+            self._seen = self._generation.value
 
     def was_played(self):
         if self.repeats > 1:
@@ -47,14 +87,149 @@ class Movie:
     def __repr__(self):
         return repr((self.target, self.filename, self.title, self.repeats, self.playcount))
 
+class ShuffleBag:
+    """Random playback order.  Every cycle plays each movie weight times in a
+    random order, so nothing repeats or gets starved within a cycle.
+
+    The order is generated from a seed, so saving the seed and the position
+    is enough to continue the same cycle after a restart.
+    """
+    __slots__ = ('_weights', '_seed', '_order', '_position')
+
+    def __init__(self, weights, seed=None, position=0):
+        self._weights = weights
+        self._shuffle(seed)
+        self._position = min(max(0, position), len(self._order))
+
+    def _shuffle(self, seed=None, last=None):
+        self._seed = random.randrange(2**32) if seed is None else seed
+        rng = random.Random(self._seed)
+        if all(weight == 1 for weight in self._weights):
+            order = list(range(len(self._weights)))
+            rng.shuffle(order)
+        else:
+            # Spread the copies of weighted movies evenly over the cycle:
+            # copy k of a movie with weight w lands in slot [k/w, (k+1)/w).
+            keys = [((k + rng.random()) / weight, i)
+                    for i, weight in enumerate(self._weights) for k in range(weight)]
+            keys.sort()
+            order = [i for _, i in keys]
+        self._spread(order, last, rng)
+        self._order = array('l', order)
+        self._position = 0
+
+    @staticmethod
+    def _spread(order, last, rng):
+        """Rearrange order if it has back-to-back repeats, including one with
+        last, the final movie of the previous cycle.  Each place then gets
+        the movie with the most copies left that differs from the one before
+        (ties broken by rng), which avoids every repeat that can be avoided:
+        all of them if no movie has more copies than the others plus one.
+        """
+        previous = last
+        for index in order:
+            if index == previous:
+                break
+            previous = index
+        else:
+            return
+        # Copies left (negated for the min-heap), random tie breaker, index.
+        heap = [(-count, rng.random(), index) for index, count in Counter(order).items()]
+        heapq.heapify(heap)
+        previous = last
+        for i in range(len(order)):
+            count, tie, index = heapq.heappop(heap)
+            if index == previous and heap:
+                # Take the runner-up, the most frequent movie waits a turn.
+                count, tie, index = heapq.heapreplace(heap, (count, tie, index))
+            order[i] = index
+            previous = index
+            if count < -1:
+                heapq.heappush(heap, (count + 1, rng.random(), index))
+
+    def next(self):
+        """Return the index of the next movie, starting a new cycle after the
+        last one.
+        """
+        if self._position >= len(self._order):
+            self._shuffle()
+        index = self._order[self._position]
+        self._position += 1
+        # Shuffle the next cycle right away so peek() and state() already
+        # cover it.
+        if self._position >= len(self._order):
+            self._shuffle(last=index)
+        return index
+
+    def peek(self, count=1):
+        """Return the indexes of up to count movies next() returns next from
+        the current cycle.
+        """
+        return list(self._order[self._position:self._position + count])
+
+    def state(self):
+        """Return the seed and position needed to restore this order, or None
+        if it can't be recreated from a seed.
+        """
+        if self._seed is None:
+            return None
+        return {'seed': self._seed, 'position': self._position, 'size': len(self._order)}
+
+    def update(self, weights, remap, added):
+        """Carry the rest of the current cycle over to a changed playlist.
+        remap maps old to new indexes (None for removed movies), added are the
+        indexes of new movies, which are shuffled into the rest of the cycle.
+        The result can't be recreated from a seed, so state() returns None
+        until the next cycle starts.
+        """
+        last = remap(self._order[self._position - 1]) if self._position > 0 else None
+        order = [index for index in map(remap, self._order[self._position:]) if index is not None]
+        for index in added:
+            for _ in range(weights[index]):
+                order.insert(random.randint(0, len(order)), index)
+        self._spread(order, last, random)
+        self._weights = weights
+        self._order = array('l', order)
+        self._position = 0
+        self._seed = None
+
+
 class Playlist:
     """Representation of a playlist of movies."""
 
-    def __init__(self, movies):
-        """Create a playlist from the provided list of movies."""
+    def __init__(self, movies, sorted_by_target=False):
+        """Create a playlist from the provided list of movies.  If
+        sorted_by_target is true the movies are sorted by path and movies
+        added later are inserted in order.
+        """
         self._movies = movies
+        self.sorted_by_target = sorted_by_target
         self._index = None
         self._next = None
+        self._resume_index = None
+        # Index of the first movie with a given target path, so jumps and
+        # resuming don't scan the whole playlist.  Both indexes are built on
+        # first use and dropped when movies are added or removed.  Playlists
+        # sorted by target use a binary search instead.
+        self._by_target = None
+        self._by_filename = None
+        self._generation = _Generation()
+        self._bag = None
+        for movie in movies:
+            movie._generation = self._generation
+
+    def _sorted_position(self, target):
+        i = bisect_left(self._movies, Movie(target))
+        if i < len(self._movies) and self._movies[i].target == target:
+            return i
+        return None
+
+    def _target_index(self):
+        if self._by_target is None:
+            self._by_target = {}
+            for i, movie in enumerate(self._movies):
+                self._by_target.setdefault(movie.target, i)
+        return self._by_target
 
     def get_next(self, is_random, resume = False) -> Movie:
         """Get the next movie in the playlist. Will loop to start of playlist
@@ -66,23 +241,20 @@ class Playlist:
         
         # Check if next movie is set and jump directly there:
         if self._next is not None:
-            next=self._next
+            self._index = self._next
             self._next = None # reset next
-            self._index=self._movies.index(next)
-            return next
+            return self._movies[self._index]
         
-        # Start Random movie
+        # Continue the shuffled order
         if is_random:
-            self._index = random.randrange(0, self.length())
+            if self._bag is None:
+                self._bag = ShuffleBag([movie.weight for movie in self._movies])
+            self._index = self._bag.next()
         else:
             # Start at the first movie or resume and increment through them in order.
             if self._index is None:
-                if resume:
-                    try:
-                        with open('playlist_index.txt', 'r') as f:
-                            self._index = int(f.read())
-                    except FileNotFoundError:
-                        self._index = 0
+                if resume and self._resume_index is not None:
+                    self._index = self._resume_index
                 else:
                     self._index = 0
             else:
@@ -92,38 +264,183 @@ class Playlist:
             if self._index >= self.length():
                 self._index = 0
 
-        if resume:
-            with open('playlist_index.txt','w') as f:
-                f.write(str(self._index))
-
         return self._movies[self._index]
+
+    def resume_from(self, index):
+        """Make the first get_next(resume=True) in sequential playback start
+        at index instead of the first movie.
+        """
+        self._resume_index = index
+
+    def shuffle_state(self):
+        """Return the state of the random order for restore_shuffle, or None
+        before the first random get_next.
+        """
+        return self._bag.state() if self._bag is not None else None
+
+    def restore_shuffle(self, state):
+        """Continue the random order saved with shuffle_state.  Ignored if
+        the playlist changed since then.
+        """
+        weights = [movie.weight for movie in self._movies]
+        try:
+            if state['size'] != sum(weights):
+                return
+            self._bag = ShuffleBag(weights, seed=state['seed'], position=state['position'])
+        except (KeyError, TypeError):
+            pass
+
+    def get_index(self):
+        """Return the index of the current movie, or None before the first
+        get_next.
+        """
+        return self._index
+
+    def find(self, target):
+        """Return the index of the movie with the given target path, or
+        None if it isn't in the playlist.
+        """
+        if self.sorted_by_target:
+            return self._sorted_position(target)
+        return self._target_index().get(target)
     
     # sets next by filename or Movie object or index
     def set_next(self, thing: Union[Movie, str, int]):
         if isinstance(thing, Movie):
-            if (thing in self._movies):
-                self._next(thing)
+            index = self.find(thing.target)
+            if index is not None:
+                self._next = index
         elif isinstance(thing, str):
-            if thing in self._movies:
-                self._next = self._movies[self._movies.index(thing)]
-            elif thing[0:1] in ("+","-"):
-                self._next = self._movies[(self._index+int(thing))%self.length()]
+            if self._by_filename is None:
+                self._by_filename = {}
+                for i, movie in enumerate(self._movies):
+                    self._by_filename.setdefault(movie.filename, i)
+            if thing in self._by_filename:
+                self._next = self._by_filename[thing]
+            elif thing[0:1] in ("+","-") and self._index is not None:
+                self._next = (self._index+int(thing))%self.length()
         elif isinstance(thing, int):
-            if thing >= 0 and thing <= self.length():
-                self._next = self._movies[thing]
+            if thing >= 0 and thing < self.length():
+                self._next = thing
         else:
             self._next = None
         self.clear_all_playcounts()
-        self._movies[self._index].finish_playing() #set the current to max playcount so it will not get played again
+        if self._index is not None:
+            self._movies[self._index].finish_playing() #set the current to max playcount so it will not get played again
        
-    # sets next relative to current index
+    def peek(self, count=1, is_random=False):
+        """Return up to count movies get_next will return next, without
+        advancing the playlist.  In random playback only the rest of the
+        current cycle is known.
+        """
+        if len(self._movies) == 0 or self._index is None:
+            return []
+        upcoming = []
+        index = self._index
+        if self._next is not None:
+            index = self._next
+            upcoming.append(self._movies[index])
+        if is_random:
+            if self._bag is not None:
+                upcoming.extend(self._movies[i] for i in self._bag.peek(count - len(upcoming)))
+            return upcoming
+        while len(upcoming) < count:
+            index = (index + 1) % self.length()
+            upcoming.append(self._movies[index])
+        return upcoming
+
+    # sets next relative to current index, or to the next movie if one is already set
     def seek(self, amount:int):
-        self.set_next((self._index+amount)%self.length())
+        index = self._next if self._next is not None else self._index
+        if index is None:
+            index = 0
+        self.set_next((index+amount)%self.length())
+
+    def update(self, removed=(), added=()):
+        """Remove the movies with the target paths in removed and add the
+        movies in added, in order if the playlist is sorted by target and at
+        the end otherwise.  Playback continues after the current movie, or
+        after the place it had if it was removed.  Apart from moving list
+        items the work depends on the number of changes, not the playlist
+        size (except for remapping the rest of a random cycle).
+        """
+        removed = set(removed)
+        if not removed:
+            gone = []
+        elif self.sorted_by_target or len(self._target_index()) == len(self._movies):
+            gone = sorted(index for index in map(self.find, removed) if index is not None)
+        else:
+            # The same file is in the playlist more than once.
+            gone = [i for i, movie in enumerate(self._movies) if movie.target in removed]
+        size = len(self._movies)
+        gone_movies = [self._movies[i] for i in gone]
+        for i in reversed(gone):
+            del self._movies[i]
+        if self.sorted_by_target:
+            added = sorted(added)
+            points = [bisect_right(self._movies, movie) for movie in added]
+        else:
+            added = list(added)
+            points = [len(self._movies)] * len(added)
+        for offset, (point, movie) in enumerate(zip(points, added)):
+            self._movies.insert(point + offset, movie)
+            movie._generation = self._generation
+        if not gone and not added:
+            return
+
+        def remap(index, keep_place=False):
+            """Return the new index of the movie at index, None if it was
+            removed.  With keep_place the index of the movie before the place
+            it had, so the one after it plays next (wrapping around).
+            """
+            if index is None or not self._movies:
+                return None
+            shift = bisect_left(gone, index)
+            index -= shift
+            if shift < len(gone) and gone[shift] == index + shift:
+                if not keep_place:
+                    return None
+                # Movies added in its place that sort before it were passed
+                # already, the others follow it.
+                before = bisect_left(points, index)
+                if self.sorted_by_target:
+                    before = bisect_left(added, gone_movies[shift], before, bisect_right(points, index))
+                return (index + before - 1) % len(self._movies)
+            return index + bisect_right(points, index)
+
+        if self._bag is not None:
+            # remap for every old index, built from ranges so a big cycle
+            # doesn't take a function call per movie.
+            moved = []
+            start = 0
+            for count, point in enumerate(points + [len(self._movies) - len(added)]):
+                moved.extend(range(start + count, point + count))
+                start = point
+            mapping = [None] * size
+            start = 0
+            for count, i in enumerate(gone + [size]):
+                mapping[start:i] = moved[start - count:i - count]
+                start = i + 1
+            self._bag.update([movie.weight for movie in self._movies], mapping.__getitem__,
+                             [point + offset for offset, point in enumerate(points)])
+        self._index = remap(self._index, keep_place=True)
+        self._next = remap(self._next)
+        if self._resume_index is not None:
+            resume_index = remap(self._resume_index)
+            if resume_index is None:
+                before = remap(self._resume_index, keep_place=True)
+                resume_index = (before + 1) % len(self._movies) if before is not None else 0
+            self._resume_index = resume_index
+        self._by_target = None
+        self._by_filename = None
+
+    def movies(self):
+        """Return the movies in playlist order."""
+        return self._movies
 
     def length(self):
         """Return the number of movies in the playlist."""
         return len(self._movies)
 
     def clear_all_playcounts(self):
-        for movie in self._movies:
-            movie.clear_playcount()
\ No newline at end of file
+        self._generation.value += 1
@@ -3,23 +3,62 @@
 # License: GNU GPLv2, see LICENSE.txt
 import os
 import shutil
+import signal
 import subprocess
 import tempfile
-import time
 import datetime
 
 from .alsa_config import parse_hw_device
+from .events import open_pidfd, close_fd
+from .metrics import Metrics
+
+# Video layers used in pre-roll mode.  Every warm standby process is started on
+# the layer below the one before it, so it stays hidden behind the movie that
+# is currently playing until that one exits.  The counter resets whenever the
+# player is started cold.
+PREROLL_TOP_LAYER = 10000
+PREROLL_BOTTOM_LAYER = 1
+
+# Up to how many seconds into a movie a paused standby process (waiting at its
+# first frame) may take over instead of starting a new process at the position.
+WARM_START_TOLERANCE = 1
+
+
+class _Standby:
+    """A paused omxplayer process waiting to take over playback."""
+
+    def __init__(self, key, movie, process):
+        self.key = key
+        self.movie = movie
+        self.process = process
+
+    def is_alive(self):
+        self.process.poll()
+        return self.process.returncode is None
+
 
 class OMXPlayer:
 
-    def __init__(self, config):
+    def __init__(self, config, metrics=None):
         """Create an instance of a video player that runs omxplayer in the
         background.
         """
+        self._metrics = metrics if metrics is not None else Metrics()
         self._process = None
+        self._confirmed = False
+        self._pidfd = None
         self._temp_directory = None
         self._load_config(config)
-        self._start_time = datetime.datetime.now()
+        # Pre-roll state: paused standby processes in the order they will
+        # play, hints for movies that still need one and the layer to use for
+        # the next process.
+        self._standby = []
+        self._upcoming = []
+        self._current_end = None
+        self._layer = PREROLL_TOP_LAYER
+        # When and at which position in the movie the current process started.
+        self._started = None
+        self._offset = 0
 
     def __del__(self):
         if self._temp_directory:
@@ -49,43 +88,29 @@ class OMXPlayer:
                 self._subtitle_header = '00:00:00,00 --> {:d}:{:02d}:{:02d},00\n'.format(h, m, s)
             else:
                 self._subtitle_header = '00:00:00,00 --> 99:59:59,00\n'
+        # How many seconds before the current movie ends the next one is
+        # started (paused, behind the current one) and how many of those
+        # standby processes may exist at once.
+        self._preroll = config.getboolean('omxplayer', 'preroll', fallback=False)
+        self.preroll_time = config.getfloat('omxplayer', 'preroll_time', fallback=5)
+        self.standby_players = config.getint('omxplayer', 'standby_players', fallback=1) if self._preroll else 0
 
     def supported_extensions(self):
         """Return list of supported file extensions."""
         return self._extensions
 
-    def extract_video_length(self, movie):
-        """Extract the length of the movie from the filename."""
-        # Filename example:
-        # 01-12-23_Name.mp4
-        filename = os.path.basename(movie.target)
-        length_str = filename.split('_')[0]  # Assuming the length is before the first underscore
-        hours, minutes, seconds = map(int, length_str.split('-'))
-        # return length in seconds
-        return hours * 3600 + minutes * 60 + seconds
-
-    def assemble_args(self, movie, loop=None, vol=0):
-        """Assemble the list of arguments for the omxplayer command."""
+    def assemble_args(self, movie, loop=None, vol=0, position=0):
+        """Assemble the list of arguments for the omxplayer command.  position
+        is the number of seconds into the movie to start at.
+        """
         # Assemble list of arguments.
         args = ['omxplayer']
         args.extend(['-o', self._sound])  # Add sound arguments.
-
-        # Get the length of the video in seconds
-        video_length_in_seconds = self.extract_video_length(movie)
-
-        # Get the elapsed playback time in seconds
-        elapsed_time_in_seconds = self.get_elapsed_time_in_seconds()
-
-        # If the elapsed time is longer than the video length, calculate the remainder
-        if elapsed_time_in_seconds >= video_length_in_seconds:
-            elapsed_time_in_seconds = elapsed_time_in_seconds % video_length_in_seconds
-
-        # Convert the elapsed time to 00:00:00 format
-        hours, remainder = divmod(elapsed_time_in_seconds, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        elapsed_time = '{:02}:{:02}:{:02}'.format(hours, minutes, seconds)
-
-        args.extend(['-l', elapsed_time])  # Add starting position.
+        if position:
+            # Convert the position to 00:00:00 format
+            hours, remainder = divmod(int(position), 3600)
+            minutes, seconds = divmod(remainder, 60)
+            args.extend(['-l', '{:02}:{:02}:{:02}'.format(hours, minutes, seconds)])  # Add starting position.
         args.extend(self._extra_args)   
         if vol != 0:
             args.extend(['--vol', str(vol)])
@@ -102,16 +127,142 @@ class OMXPlayer:
         args.append(movie.target)       # Add movie file path.
         return args
     
-    def play(self, movie, loop=None, vol=0):
-        """Play the provided movie file, optionally looping it repeatedly."""
-        self.stop(3)  # Up to 3 second delay to let the old player stop.
-        args = self.assemble_args(movie, loop, vol)
-        # Run omxplayer process and direct standard output to /dev/null.
-        # Establish input pipe for commands
-        self._process = subprocess.Popen(args,
-                                        stdout=open(os.devnull, 'wb'),
-                                        stdin=subprocess.PIPE,
-                                        close_fds=True)
+    def _start_process(self, args, layer=None):
+        """Run omxplayer and direct standard output to /dev/null.  Establish
+        input pipe for commands.
+        """
+        if layer is not None:
+            args = args[:-1] + ['--layer', str(layer)] + args[-1:]
+        # In pre-roll mode several players run at once, give each its own
+        # process group so it can be killed without touching the others.
+        return subprocess.Popen(args,
+                                stdout=open(os.devnull, 'wb'),
+                                stdin=subprocess.PIPE,
+                                close_fds=True,
+                                start_new_session=self._preroll)
+
+    def play(self, movie, loop=None, vol=0, position=None):
+        """Play the provided movie file, optionally looping it repeatedly.
+        position is the number of seconds into the movie to start at (the
+        looper passes it when resuming or following the live timeline).
+        """
+        key = (movie.target, loop, vol)
+        now = datetime.datetime.now()
+        # Standby processes wait at the start of their movie, close enough if
+        # the timeline is only a little past it.
+        if (position or 0) <= WARM_START_TOLERANCE and self._standby and self._standby[0].key == key and self._standby[0].is_alive():
+            # Warm start: let the paused standby process continue and get rid
+            # of the old one so the standby's layer becomes visible.
+            standby = self._standby.pop(0)
+            self._send(standby.process, 'p')
+            self._kill(self._process)
+            self._process = standby.process
+            close_fd(self._pidfd)
+        else:
+            self.stop(3)  # Up to 3 second delay to let the old player stop.
+            self._layer = PREROLL_TOP_LAYER
+            args = self.assemble_args(movie, loop, vol, position=position)
+            self._process = self._start_process(args, self._next_layer() if self._preroll else None)
+        self._metrics.mark('spawn')
+        self._confirmed = False
+        self._pidfd = open_pidfd(self._process.pid)
+        self._offset = int(position or 0)
+        self._started = now
+        self._current_end = self._expected_end(movie, loop, now, self._offset)
+
+    def get_position(self):
+        """Return roughly how many seconds into the current movie playback is."""
+        if self._started is None:
+            return 0
+        return self._offset + (datetime.datetime.now() - self._started).total_seconds()
+
+    def preroll(self, movies, vol=0):
+        """Hint which movies will be played next (in order) so their player
+        processes can be started ahead of time.  Standby processes that no
+        longer match the hint are stopped.
+        """
+        movies = movies[:self.standby_players]
+        keys = [(movie.target, None, vol) for movie in movies]
+        keep = 0
+        while keep < min(len(keys), len(self._standby)) and self._standby[keep].key == keys[keep]:
+            keep += 1
+        for standby in self._standby[keep:]:
+            self._kill(standby.process)
+        self._standby = self._standby[:keep]
+        self._upcoming = [(key, movie) for key, movie in zip(keys[keep:], movies[keep:])]
+        self._start_due_standbys()
+
+    def _expected_end(self, movie, loop, start, offset=0):
+        """Return when a movie started at start (offset seconds into it) will
+        end, or None if it loops forever or its duration is unknown.
+        """
+        if loop is not None and loop <= -1 or not movie.duration:
+            return None
+        return start + datetime.timedelta(seconds=max(0, movie.duration - offset))
+
+    def _next_layer(self):
+        layer = self._layer
+        self._layer -= 1
+        return layer
+
+    def _standby_start_time(self):
+        """Return when the first pending standby process should be started
+        and when it is expected to take over, or (None, None) if nothing is
+        pending or can't be started.
+        """
+        if not self._upcoming or self._process is None or self._layer < PREROLL_BOTTOM_LAYER:
+            return None, None
+        handover = self._current_end
+        for standby in self._standby:
+            if handover is None:
+                break
+            handover = self._expected_end(standby.movie, None, handover)
+        if handover is None:
+            # Length unknown, start it right away.
+            return datetime.datetime.now(), None
+        return handover - datetime.timedelta(seconds=self.preroll_time), handover
+
+    def _start_due_standbys(self):
+        """Start the pending standby processes whose pre-roll time has come."""
+        while True:
+            start, handover = self._standby_start_time()
+            if start is None or start > datetime.datetime.now():
+                return
+            key, movie = self._upcoming.pop(0)
+            args = self.assemble_args(movie, key[1], key[2])
+            process = self._start_process(args, self._next_layer())
+            # Pause right away, the process keeps its first frame ready on a
+            # layer hidden behind the current movie.
+            self._send(process, 'p')
+            self._standby.append(_Standby(key, movie, process))
+
+    def poll_timeout(self):
+        """Return the seconds until the next standby process is due."""
+        start, _ = self._standby_start_time()
+        if start is None:
+            return None
+        return max(0, (start - datetime.datetime.now()).total_seconds())
+
+    def _send(self, process, key):
+        try:
+            process.stdin.write(key.encode())
+            process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            pass
+
+    def _kill(self, process):
+        """Kill a player process if it is still running."""
+        if process is None or process.poll() is not None:
+            return
+        if self._preroll:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        else:
+            # There are a couple processes used by omxplayer, so kill both
+            # with a pkill command.
+            subprocess.call(['pkill', '-9', 'omxplayer'])
     
     def pause(self):
         self.sendKey("p")
@@ -126,48 +277,51 @@ class OMXPlayer:
         if self._process is None:
             return False
         self._process.poll()
+        if self._process.returncode is None:
+            if not self._confirmed:
+                self._confirmed = True
+                self._metrics.mark('running')
+            self._start_due_standbys()
         return self._process.returncode is None
 
+    def fileno(self):
+        """Return a file descriptor that becomes readable when the player
+        process exits, or None if pidfds aren't supported (the main loop then
+        relies on SIGCHLD).
+        """
+        return self._pidfd
+
     def stop(self, block_timeout_sec=0):
         """Stop the video player.  block_timeout_sec is how many seconds to
         block waiting for the player to stop before moving on.
         """
-        # Stop the player if it's running.
-        if self._process is not None and self._process.returncode is None:
-            # There are a couple processes used by omxplayer, so kill both
-            # with a pkill command.
-            subprocess.call(['pkill', '-9', 'omxplayer'])
+        self._metrics.mark('stop')
+        if self._process is not None and self._process.poll() is None:
+            self._metrics.mark('dark')
+        # Stop the player and any standby processes if they are running.
+        self._kill(self._process)
+        for standby in self._standby:
+            self._kill(standby.process)
+        self._standby = []
+        self._upcoming = []
         # If a blocking timeout was specified, wait up to that amount of time
-        # for the process to stop.
-        start = time.time()
-        while self._process is not None and self._process.returncode is None:
-            if (time.time() - start) >= block_timeout_sec:
-                break
-            time.sleep(0)
+        # for the process to stop, sleeping in the kernel instead of polling.
+        if self._process is not None:
+            try:
+                self._process.wait(timeout=block_timeout_sec)
+            except subprocess.TimeoutExpired:
+                pass
         # Let the process be garbage collected.
         self._process = None
+        close_fd(self._pidfd)
+        self._pidfd = None
+        self._metrics.mark('stopped')
 
     @staticmethod
     def can_loop_count():
         return False
-    
-    def get_elapsed_time_in_seconds(self):
-        elapsed_time = datetime.datetime.now() - self._start_time
-        return elapsed_time.seconds
-
-    def test_get_elapsed_time(self):
-        """Return the elapsed time since the movie started in the format 00:00:00."""
-        if self._start_time is None:
-            print('Start time is None')
-            return '00:00:00'
-        elapsed_time = datetime.datetime.now() - self._start_time
-        # hours, remainder = divmod(elapsed_time.seconds, 3600)
-        # minutes, seconds = divmod(remainder, 60)
-        # return '{:02}:{:02}:{:02}'.format(hours, minutes + 20, seconds)
-        # return elapsed_time as an integer in seconds
-        return elapsed_time.seconds + 1200
 
 
 def create_player(config, **kwargs):
     """Create new video player based on omxplayer."""
-    return OMXPlayer(config)
+    return OMXPlayer(config, metrics=kwargs.get('metrics'))
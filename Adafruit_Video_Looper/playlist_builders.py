@@ -1,28 +1,110 @@
 import os
 import re
+import threading
 import urllib.parse
 
 from .model import Playlist, Movie
 
+# #EXTINF:<duration> key="value" key2="value2",<title>
+_EXTINF = re.compile(r'^#EXTINF:\s*(-?\d+(?:\.\d+)?)((?:\s+[\w-]+="[^"]*")*)\s*,(.*)$')
+_ATTRIBUTE = re.compile(r'([\w-]+)="([^"]*)"')
+
+# Parsed playlists by path, with the (size, mtime) they were parsed at,
+# least recently used first.  Enough for a schedule with a playlist per block.
+_cache = {}
+_cache_lock = threading.Lock()
+CACHE_SIZE = 16
 
-def build_playlist_m3u(playlist_path: str):
-    playlist_dirname = os.path.dirname(playlist_path)
-    movies = []
 
+def parse_m3u(playlist_path: str):
+    """Parse an M3U/M3U8 playlist line by line, yielding a (path, title,
+    duration, attributes) tuple for every entry.  duration is None if the
+    playlist doesn't give one, attributes is a dict of the key="value" pairs
+    of the #EXTINF line (None if there are none).
+    """
+    playlist_dirname = os.path.dirname(playlist_path)
     title = None
+    duration = None
+    attributes = None
 
-    with open(playlist_path) as f:
+    # M3U8 is UTF-8 by definition, plain M3U files mostly are too nowadays.
+    with open(playlist_path, encoding='utf-8-sig', errors='replace') as f:
         for line in f:
+            line = line.strip()
+            if not line:
+                continue
             if line.startswith('#'):
                 if line.startswith('#EXTINF'):
-                    matches = re.match(r'^#\w+:\d+(?:\s*\w+\=\".*\")*,(.*)$', line)
+                    matches = _EXTINF.match(line)
                     if matches:
-                        title = matches[1]
+                        # -1 or 0 means the duration is unknown.
+                        duration = float(matches[1]) if float(matches[1]) > 0 else None
+                        attributes = dict(_ATTRIBUTE.findall(matches[2])) or None
+                        title = matches[3].strip() or None
             else:
-                path = urllib.parse.unquote(line.rstrip())
+                path = urllib.parse.unquote(line)
                 if not os.path.isabs(path):
                     path = os.path.join(playlist_dirname, path)
-                movies.append(Movie(path, title))
+                yield path, title, duration, attributes
                 title = None
+                duration = None
+                attributes = None
+
+
+def load_m3u(playlist_path: str):
+    """Return the list of parse_m3u entries of a playlist.  The result is
+    cached and only parsed again if the file's size or modification time
+    changed.
+    """
+    st = os.stat(playlist_path)
+    key = (st.st_size, st.st_mtime_ns)
+    with _cache_lock:
+        cached = _cache.pop(playlist_path, None)
+        if cached is not None and cached[0] == key:
+            _cache[playlist_path] = cached
+            return cached[1]
+    entries = list(parse_m3u(playlist_path))
+    with _cache_lock:
+        _cache[playlist_path] = (key, entries)
+        while len(_cache) > CACHE_SIZE:
+            del _cache[next(iter(_cache))]
+    return entries
 
+
+def clear_cache():
+    """Forget all parsed playlists, e.g. when the drives changed."""
+    with _cache_lock:
+        _cache.clear()
+
+
+def find_missing(paths):
+    """Return the set of paths that don't exist.  Only the given paths are
+    looked at, each once, not the rest of their directories.
+    """
+    missing = set()
+    for path in set(paths):
+        try:
+            os.stat(path)
+        except OSError:
+            missing.add(path)
+    return missing
+
+
+def build_playlist_m3u(playlist_path: str, log=None):
+    """Build a playlist from an M3U/M3U8 file.  Entries whose file doesn't
+    exist are left out and reported through log.
+    """
+    entries = load_m3u(playlist_path)
+    missing = find_missing(path for path, _, _, _ in entries)
+    if missing and log is not None:
+        examples = ', '.join(sorted(missing)[:3])
+        log('Playlist {0}: {1} missing file{2} skipped ({3}{4}).'.format(
+            playlist_path, len(missing), 's' if len(missing) > 1 else '', examples, ', ...' if len(missing) > 3 else ''))
+    movies = []
+    for path, title, duration, attributes in entries:
+        if path in missing:
+            continue
+        weight = attributes.get('weight', '1') if attributes else '1'
+        movies.append(Movie(path, title, weight=weight if weight.isdigit() else 1,
+                            duration=duration, attributes=attributes))
     return Playlist(movies)
@@ -17,11 +17,8 @@ RELAY_UP_PIN = 17  # Use GPIO 17 (Pin 11) or any other available pin
 RELAY_DOWN_PIN = 27  # Use GPIO 17 (Pin 11) or any other available pin
 RELAY_SOURCE_PIN = 22  # Use GPIO 17 (Pin 11) or any other available pin
 
-# Initialize I2C bus
-bus = smbus.SMBus(1)  # Use bus 1 (check your specific Pi model)
-
-# Set up GPIO for Relays
-GPIO.setmode(GPIO.BCM)  # Use Broadcom pin numbering
+# I2C bus number (check your specific Pi model)
+I2C_BUS = 1
 
 # Channel list with rotary encoder position and frequency
 # (channel, rotary_position, modulator frequency)
@@ -51,11 +48,17 @@ CHANNEL_LIST = [
 ]
 
 class ChannelSwitcher:
-    def __init__(self, on_channel_change=None):
+    def __init__(self, on_channel_change=None, state=None):
+        # Initialize I2C bus and set up GPIO for Relays here rather than at
+        # import time, so merely importing this module touches no hardware.
+        self.bus = smbus.SMBus(I2C_BUS)
+        GPIO.setmode(GPIO.BCM)  # Use Broadcom pin numbering
         self.previous_channel = 0
         self.previous_frequency = 0
         self.current_source = 'hdmi'
         self.on_channel_change = on_channel_change
+        # Optional StateStore to keep the values in, instead of a pickle file.
+        self.state = state
         self.initialize_relays()
 
         # Start a thread to execute the relay commands
@@ -141,7 +144,7 @@ class ChannelSwitcher:
             self.previous_channel = channel
 
     def read_remote_rotary_encoder(self):
-        return int(bus.read_byte(I2C_ADDRESS))
+        return int(self.bus.read_byte(I2C_ADDRESS))
 
     def relay_source_hdmi(self):
         print("Switching to HDMI")
@@ -185,17 +188,25 @@ class ChannelSwitcher:
             # Add a delay before processing the next item
             time.sleep(0.03)  # Adjust the delay as needed
 
-    # Save previous_frequency and previous_source to a file
+    # Save previous_frequency and previous_source to the state store (or a file)
     def save_previous_values(self, previous_frequency, current_source):
+        if self.state is not None:
+            self.state.set('rotary', {'frequency': previous_frequency, 'source': current_source})
+            return
         with open('previous_values.pkl', 'wb') as f:
             pickle.dump((previous_frequency, current_source), f)
 
-    # Load previous_frequency and previous_source from a file
+    # Load previous_frequency and previous_source from the state store (or a file)
     def load_previous_values(self):
+        if self.state is not None:
+            saved = self.state.get('rotary')
+            if saved is not None:
+                return saved['frequency'], saved['source']
+        # Fall back to the pickle file older versions wrote.
         try:
             with open('previous_values.pkl', 'rb') as f:
                 return pickle.load(f)
-        except FileNotFoundError:
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
             return 0, None  # Return 0 and None if file does not exist
 
     def initialize_relays(self):
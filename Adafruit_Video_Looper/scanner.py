@@ -0,0 +1,72 @@
+# License: GNU GPLv2, see LICENSE.txt
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MediaScanner:
+    """Finds media files by extension in one or more directories.
+
+    Uses os.scandir, so deciding whether an entry is a file or a directory
+    needs no extra stat call, and returns the DirEntry objects so their
+    cached stat data can be reused.  Several directories (one per mounted
+    drive) are scanned concurrently, which overlaps the I/O waits of
+    different drives.
+    """
+
+    def __init__(self, extensions, recursive=False, threads=4):
+        """extensions is a list of file extensions without the dot."""
+        # Matched against lower case names, built once instead of a regex per
+        # file.
+        self._suffixes = tuple('.' + extension.lower().lstrip('.') for extension in extensions if extension)
+        self._recursive = recursive
+        self._threads = max(1, threads)
+
+    def matches(self, path):
+        """Return true if path has one of the extensions and isn't hidden."""
+        name = os.path.basename(path)
+        return name[0:1] != '.' and name.lower().endswith(self._suffixes)
+
+    def scan(self, path):
+        """Return the DirEntry objects of all matching files in path (and its
+        subdirectories if recursive), in no particular order.  Hidden files
+        and directories are skipped, a missing path yields nothing.
+        """
+        found = []
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name[0:1] == '.':
+                            continue
+                        try:
+                            if entry.is_file():
+                                if entry.name.lower().endswith(self._suffixes):
+                                    found.append(entry)
+                            elif self._recursive and entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return found
+
+    def scan_all(self, paths):
+        """Scan several paths, concurrently if there is more than one.
+        Returns a list with the scan result of every path in the same order.
+        """
+        paths = list(paths)
+        if len(paths) <= 1 or self._threads == 1:
+            return [self.scan(path) for path in paths]
+        with ThreadPoolExecutor(max_workers=min(len(paths), self._threads)) as pool:
+            return list(pool.map(self.scan, paths))
+
+
+def create_scanner(config, extensions):
+    """Create a media scanner for extensions using the scan settings of the
+    [video_looper] config section.
+    """
+    return MediaScanner(extensions,
+                        recursive=config.getboolean('video_looper', 'scan_subfolders', fallback=False),
+                        threads=config.getint('video_looper', 'scan_threads', fallback=4))
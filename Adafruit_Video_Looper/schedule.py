@@ -0,0 +1,128 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Daypart schedule mapping time windows of the week to playlists.
+
+A schedule file has one block per line:
+
+    # days      start  end    playlist
+    mon-fri     06:00  11:00  breakfast.m3u
+    sat,sun     08:00  12:00  brunch.m3u
+    *           18:00  02:00  evening.m3u
+
+Days are mon..sun, ranges like mon-fri, lists like sat,sun or * for every
+day.  A block ending at or before its start runs past midnight.  When blocks
+overlap the one listed first wins.  The playlist is resolved like the
+[playlist] path setting, "all" plays all files.  Outside of all blocks the
+configured default playlist plays.
+"""
+import re
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DAY = 24 * 3600
+WEEK = 7 * DAY
+
+_LINE = re.compile(r'^(\S+)\s+(\d{1,2}):(\d{2})\s+(\d{1,2}):(\d{2})\s+(.+)$')
+
+
+def _parse_days(spec):
+    if spec == '*':
+        return list(range(7))
+    days = []
+    for part in spec.lower().split(','):
+        first, _, last = part.partition('-')
+        if first not in DAYS or (last and last not in DAYS):
+            raise ValueError('unknown day {0!r}'.format(part))
+        start = DAYS.index(first)
+        end = DAYS.index(last) if last else start
+        days.extend(day % 7 for day in range(start, end + 1 if end >= start else end + 8))
+    return days
+
+
+class Schedule:
+    """Weekly schedule compiled into a sorted interval index.  Finding the
+    active block is a binary search over the block boundaries.
+    """
+
+    def __init__(self, rules):
+        """rules is a list of (days, start, end, playlist) tuples with days a
+        list of weekday numbers (0 is Monday) and start and end in seconds
+        since midnight, in priority order.
+        """
+        # Expand every rule into (start, end, priority, playlist) intervals
+        # in seconds since Monday midnight, splitting the ones that wrap
+        # around the end of the week.
+        intervals = []
+        for priority, (days, start, end, playlist) in enumerate(rules):
+            length = (end - start) % DAY or DAY
+            for day in days:
+                first = day * DAY + start
+                last = first + length
+                if last <= WEEK:
+                    intervals.append((first, last, priority, playlist))
+                else:
+                    intervals.append((first, WEEK, priority, playlist))
+                    intervals.append((0, last - WEEK, priority, playlist))
+        # Paint the intervals onto the elementary segments between all
+        # boundaries, the highest priority wins.
+        bounds = sorted({0, WEEK}.union(*((first, last) for first, last, _, _ in intervals)))
+        owners = [None] * (len(bounds) - 1)
+        for first, last, priority, playlist in sorted(intervals, key=lambda i: i[2], reverse=True):
+            for i in range(bisect_left(bounds, first), bisect_left(bounds, last)):
+                owners[i] = playlist
+        # Merge neighbouring segments playing the same playlist.
+        self._starts = []
+        self._playlists = []
+        for start, owner in zip(bounds, owners):
+            if self._playlists and self._playlists[-1] == owner:
+                continue
+            self._starts.append(start)
+            self._playlists.append(owner)
+
+    def __len__(self):
+        return sum(1 for playlist in self._playlists if playlist is not None)
+
+    @staticmethod
+    def _week_seconds(when):
+        return when.weekday() * DAY + when.hour * 3600 + when.minute * 60 + when.second + when.microsecond / 1e6
+
+    def lookup(self, when=None):
+        """Return a (playlist, seconds_left, next_playlist) tuple: the
+        playlist of the block active at when (now by default, None outside of
+        all blocks), the seconds until the next block starts and its playlist.
+        """
+        t = self._week_seconds(when or datetime.now())
+        count = len(self._starts)
+        i = bisect_right(self._starts, t) - 1
+        following = (i + 1) % count
+        # Merging doesn't look across the end of the week, skip the first
+        # segment if it continues the last one.
+        if following == 0 and count > 1 and self._playlists[0] == self._playlists[i]:
+            following = 1
+        seconds_left = (self._starts[following] - t) % WEEK or WEEK
+        return self._playlists[i], seconds_left, self._playlists[following]
+
+
+def load_schedule(path):
+    """Parse a schedule file.  Raises ValueError for malformed lines."""
+    rules = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            match = _LINE.match(line)
+            if match is None:
+                raise ValueError('{0}:{1}: expected "days start end playlist"'.format(path, number))
+            days, start_h, start_m, end_h, end_m, playlist = match.groups()
+            try:
+                days = _parse_days(days)
+            except ValueError as err:
+                raise ValueError('{0}:{1}: {2}'.format(path, number, err))
+            start = int(start_h) * 3600 + int(start_m) * 60
+            end = int(end_h) * 3600 + int(end_m) * 60
+            if start > DAY or end > DAY:
+                raise ValueError('{0}:{1}: time past 24:00'.format(path, number))
+            playlist = playlist.strip()
+            rules.append((days, start, end, '' if playlist == 'all' else playlist))
+    return Schedule(rules)
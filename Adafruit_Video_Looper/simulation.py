@@ -0,0 +1,254 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Headless simulation backend for running and benchmarking the video looper
+on a regular Linux box without a Raspberry Pi attached.
+
+Call install() before importing video_looper to replace RPi.GPIO and smbus
+with fakes and point pygame at its dummy video driver.  Setting both
+video_player and file_reader to "simulation" in the config selects the
+simulated player and the scripted file reader defined below.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import types
+from time import monotonic
+
+from .metrics import Metrics
+from .watcher import Changes
+
+
+class FakeGPIO(types.ModuleType):
+    """Stand-in for the RPi.GPIO module.  Records pin setup and output and lets
+    tests fire edge callbacks with trigger().
+    """
+    BOARD = 10
+    BCM = 11
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    PUD_UP = 22
+    PUD_DOWN = 21
+    FALLING = 32
+    RISING = 31
+    BOTH = 33
+
+    def __init__(self):
+        super().__init__('RPi.GPIO')
+        self.mode = None
+        self.pins = {}
+        self.callbacks = {}
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        self.pins[pin] = initial if initial is not None else self.LOW
+
+    def output(self, pin, value):
+        self.pins[pin] = value
+
+    def input(self, pin):
+        return self.pins.get(pin, self.HIGH)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = callback
+
+    def trigger(self, pin):
+        """Simulate an edge on pin, calling its callback like RPi.GPIO does."""
+        callback = self.callbacks.get(pin)
+        if callback is not None:
+            callback(pin)
+
+    def cleanup(self):
+        self.pins.clear()
+        self.callbacks.clear()
+
+
+class FakeSMBus:
+    """Stand-in for smbus.SMBus.  read_byte returns the value set with
+    set_byte, after a short delay that stands in for the I2C transfer so
+    polling loops don't spin.
+    """
+
+    def __init__(self, bus=1, read_delay=0.05):
+        self._values = {}
+        self._read_delay = read_delay
+        self._changed = threading.Event()
+
+    def set_byte(self, address, value):
+        self._values[address] = value
+        self._changed.set()
+
+    def read_byte(self, address):
+        self._changed.wait(self._read_delay)
+        self._changed.clear()
+        return self._values.get(address, 0)
+
+
+def install():
+    """Register fake RPi.GPIO and smbus modules and configure pygame for a
+    headless display.  Returns the fake GPIO module.
+    """
+    gpio = FakeGPIO()
+    rpi = types.ModuleType('RPi')
+    rpi.GPIO = gpio
+    smbus = types.ModuleType('smbus')
+    smbus.SMBus = FakeSMBus
+    sys.modules['RPi'] = rpi
+    sys.modules['RPi.GPIO'] = gpio
+    sys.modules['smbus'] = smbus
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    return gpio
+
+
+class SimulatedPlayer:
+    """Video player that doesn't display anything.  Each movie takes
+    startup_time seconds to be confirmed running, plays for duration seconds
+    and stopping takes exit_time seconds.
+    """
+
+    def __init__(self, config, metrics=None):
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._load_config(config)
+        self._started = None
+        self._running_at = None
+        self._ends_at = None
+        self._confirmed = False
+        self._paused = False
+        self.play_count = 0
+
+    def _load_config(self, config):
+        self._extensions = config.get('simulation', 'extensions', fallback='mp4') \
+                                 .translate(str.maketrans('', '', ' \t\r\n.')) \
+                                 .split(',')
+        self._startup_time = config.getfloat('simulation', 'startup_time', fallback=0.05)
+        self._duration = config.getfloat('simulation', 'duration', fallback=1.0)
+        self._exit_time = config.getfloat('simulation', 'exit_time', fallback=0.01)
+
+    def supported_extensions(self):
+        """Return list of supported file extensions."""
+        return self._extensions
+
+    def play(self, movie, loop=None, **kwargs):
+        """Pretend to start a player process for movie."""
+        self.stop(3)
+        now = monotonic()
+        self._metrics.mark('spawn')
+        self._confirmed = False
+        self._paused = False
+        self._running_at = now + self._startup_time
+        if loop is not None and loop <= -1:
+            self._ends_at = None
+        else:
+            self._ends_at = self._running_at + self._duration
+        self._started = now
+        self.play_count += 1
+
+    def pause(self):
+        self._paused = not self._paused
+
+    def sendKey(self, key: str):
+        pass
+
+    def is_playing(self):
+        """Return true while the simulated movie has not ended."""
+        if self._started is None:
+            return False
+        now = monotonic()
+        if not self._confirmed and now >= self._running_at:
+            self._confirmed = True
+            self._metrics.mark('running')
+        if self._ends_at is None or self._paused:
+            return True
+        return now < self._ends_at
+
+    def poll_timeout(self):
+        """Return the seconds until the simulated player changes state."""
+        if self._started is None:
+            return None
+        if not self._confirmed:
+            return max(0, self._running_at - monotonic())
+        if self._ends_at is None or self._paused:
+            return None
+        return max(0, self._ends_at - monotonic())
+
+    def stop(self, block_timeout_sec=0):
+        """Pretend to stop the player, taking up to exit_time seconds."""
+        self._metrics.mark('stop')
+        if self.is_playing():
+            self._metrics.mark('dark')
+            if block_timeout_sec > 0:
+                threading.Event().wait(min(self._exit_time, block_timeout_sec))
+        self._started = None
+        self._metrics.mark('stopped')
+
+    @staticmethod
+    def can_loop_count():
+        return False
+
+
+class ScriptedReader:
+    """File reader serving file_count empty movie files from a temporary
+    directory.  Every change_interval seconds (0 disables) a new file is
+    added and the reader reports it as a change.
+    """
+
+    def __init__(self, config):
+        self._file_count = config.getint('simulation', 'file_count', fallback=100)
+        self._change_interval = config.getfloat('simulation', 'change_interval', fallback=0)
+        extension = config.get('simulation', 'extensions', fallback='mp4').split(',')[0].strip()
+        self._extension = extension
+        self._path = tempfile.mkdtemp(prefix='video_looper_sim_')
+        for i in range(self._file_count):
+            self._add_file(i)
+        self._next_change = monotonic() + self._change_interval if self._change_interval > 0 else None
+        self._changes = None
+
+    def __del__(self):
+        shutil.rmtree(self._path, ignore_errors=True)
+
+    def _add_file(self, i):
+        path = os.path.join(self._path, 'movie{0:06d}.{1}'.format(i, self._extension))
+        open(path, 'w').close()
+        return path
+
+    def search_paths(self):
+        """Return a list of paths to search for files."""
+        return [self._path]
+
+    def is_changed(self):
+        """Return true when the script adds a file."""
+        if self._next_change is None or monotonic() < self._next_change:
+            return False
+        self._changes = Changes(added=[self._add_file(self._file_count)])
+        self._file_count += 1
+        self._next_change += self._change_interval
+        return True
+
+    def changes(self):
+        """Return the file added by the last change."""
+        return self._changes
+
+    def poll_timeout(self):
+        """Return the seconds until the next scripted change."""
+        if self._next_change is None:
+            return None
+        return max(0, self._next_change - monotonic())
+
+    def idle_message(self):
+        """Return a message to display when idle and no files are found."""
+        return 'Simulated reader has no files.'
+
+
+def create_player(config, **kwargs):
+    """Create new simulated video player."""
+    return SimulatedPlayer(config, metrics=kwargs.get('metrics'))
+
+
+def create_file_reader(config, screen):
+    """Create new scripted file reader."""
+    return ScriptedReader(config)
@@ -0,0 +1,126 @@
+# License: GNU GPLv2, see LICENSE.txt
+import json
+import os
+import threading
+
+
+def write_atomic(path, data):
+    """Replace the file at path with data so that a crash or power loss
+    leaves either the old or the new content, never a torn file.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # Make the rename itself durable.
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class StateStore:
+    """Small persistent key/value store for runtime state like the playlist
+    resume point or the rotary switcher position.
+
+    Reads and writes only touch memory.  A background thread writes the state
+    behind at most every flush_interval seconds and only if something changed,
+    which bounds the number of fsyncs hitting the SD card.  Every write goes to
+    a temporary file that is fsynced and then atomically renamed over the old
+    one, so a power loss mid-write leaves either the old or the new state on
+    disk, never a torn file.
+    """
+
+    FILENAME = 'state.json'
+
+    def __init__(self, directory, flush_interval=10):
+        self._path = os.path.join(directory, self.FILENAME)
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._state = self._load()
+        self._tracked = {}
+        self._dirty = False
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                state = json.load(f)
+            if isinstance(state, dict):
+                return state
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            print('Ignoring unreadable state file {0}: {1}'.format(self._path, err))
+        return {}
+
+    def get(self, key, default=None):
+        """Return the value stored for key."""
+        with self._lock:
+            return self._state.get(key, default)
+
+    def set(self, key, value):
+        """Store a JSON serializable value for key.  It is written to disk with
+        the next flush.
+        """
+        with self._lock:
+            if self._state.get(key) != value:
+                self._state[key] = value
+                self._dirty = True
+
+    def track(self, key, getter):
+        """Store the value returned by getter for key, calling it again before
+        every flush.  Used for values that change continuously, like the
+        position inside the current movie.  Pass None to stop tracking.
+        """
+        with self._lock:
+            if getter is None:
+                self._tracked.pop(key, None)
+            else:
+                self._tracked[key] = getter
+
+    def flush(self):
+        """Write the state to disk now if it changed."""
+        with self._write_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            for key, getter in self._tracked.items():
+                value = getter()
+                if self._state.get(key) != value:
+                    self._state[key] = value
+                    self._dirty = True
+            if not self._dirty:
+                return
+            data = json.dumps(self._state, sort_keys=True)
+            self._dirty = False
+        try:
+            write_atomic(self._path, data)
+        except OSError as err:
+            print('Failed to write state file {0}: {1}'.format(self._path, err))
+            with self._lock:
+                self._dirty = True
+
+    def _flush_loop(self):
+        while not self._closed.wait(self._flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the background thread and write the state one last time."""
+        self._closed.set()
+        self.flush()
+
+
+def create_state_store(config):
+    """Create the state store from the [video_looper] config section."""
+    return StateStore(config.get('video_looper', 'state_dir', fallback='/var/lib/video_looper'),
+                      flush_interval=config.getfloat('video_looper', 'state_flush_interval', fallback=10))
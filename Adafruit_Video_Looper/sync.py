@@ -0,0 +1,468 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Incremental copying for copy mode.
+
+A manifest on the Pi remembers for every copied file the size, modification
+time and a fingerprint of the source it came from, so plugging in the same
+drive again only copies what is new or changed.  Files are copied to a hidden
+.part file that is renamed into place once complete.  The .part file's name
+carries the identity of its source, so a copy interrupted by pulling the drive
+continues where it stopped when the same file is offered again.
+
+Optionally the data is hashed on its way through the copy and checked against
+the checksums listed on the drive, a copy that doesn't match is thrown away.
+
+Files from several drives are copied in parallel by update_parallel, one
+worker per drive.  For a staged replace, a new set of files is built in a staging directory and
+swapped in by pointing a symlink at it (see swap_directory).
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .copier import BUFFER_SIZE, Copier
+from .state import write_atomic
+
+# Interrupted copies continue from the last multiple of this, which was
+# fsynced, so a power loss can't leave garbage in the resumed part.
+CHECKPOINT = 64 << 20
+
+# Bytes read from the start, middle and end of a file for its fingerprint.
+FINGERPRINT_SAMPLE = 64 << 10
+
+# Hash algorithm of a checksum by the length of its hex digest.
+CHECKSUM_ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+
+# Used when verifying without a checksum to compare with.
+DEFAULT_ALGORITHM = 'sha256'
+
+
+class ChecksumError(Exception):
+    """The data copied doesn't match the checksum listed for it."""
+
+    def __init__(self, rel, expected, actual):
+        super().__init__('{0}: expected {1}, got {2}'.format(rel, expected, actual))
+        self.rel = rel
+        self.expected = expected
+        self.actual = actual
+
+
+def fingerprint(path, size):
+    """Return a fingerprint of the file at path from its size and samples of
+    its content.  Cheap enough to compute for every file on a drive, unlike a
+    full checksum.
+    """
+    digest = hashlib.blake2b(str(size).encode(), digest_size=8)
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - FINGERPRINT_SAMPLE // 2), max(0, size - FINGERPRINT_SAMPLE)}):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_SAMPLE))
+    return digest.hexdigest()
+
+
+def read_checksums(path):
+    """Read a checksum file in the format of sha256sum, md5sum and friends
+    ("<hex digest>  <file name>" per line) and return a dict of file name
+    (relative to the directory of the checksum file) to "algorithm:digest".
+    The algorithm is told by the length of the digest.
+    """
+    checksums = {}
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            digest, _, name = line.rstrip('\r\n').partition(' ')
+            algorithm = CHECKSUM_ALGORITHMS.get(len(digest))
+            if algorithm is None or not name:
+                continue
+            # A space or '*' (binary mode) separates digest and name.
+            name = os.path.normpath(name[1:] if name[0] in ' *' else name)
+            checksums[name] = '{0}:{1}'.format(algorithm, digest.lower())
+    return checksums
+
+
+def _fsync_directory(directory):
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _point_link(link, directory):
+    """Atomically make the symlink link point to directory, replacing
+    whatever link was.
+    """
+    temporary = link + '.swap'
+    if os.path.lexists(temporary):
+        os.remove(temporary)
+    os.symlink(os.path.basename(directory), temporary)
+    os.replace(temporary, link)
+    _fsync_directory(os.path.dirname(link) or '.')
+
+
+def swap_directory(link, staging):
+    """Atomically make the directory link (a symlink) point to the directory
+    staging, which is renamed to the next free "<link>.<number>" set
+    directory.  A real directory at link is turned into such a set first.
+    Takes the same time no matter how many files there are.  Returns the
+    set directory link pointed to before, None if there was none.  If this
+    is interrupted, recover_link() makes link valid again.
+    """
+    if os.path.islink(link):
+        previous = os.path.realpath(link)
+    elif os.path.isdir(link):
+        # First swap, the directory becomes a set the link points to.  A
+        # directory can't be replaced by a symlink atomically, link is
+        # missing until it points to the renamed directory.
+        previous = _next_set(link)
+        os.rename(link, previous)
+        _point_link(link, previous)
+    else:
+        previous = None
+    current = _next_set(link)
+    os.rename(staging, current)
+    _point_link(link, current)
+    return previous
+
+
+def recover_link(link):
+    """Point link back at a set directory if a swap_directory was
+    interrupted while it was missing or dangling.  Only complete directories
+    become sets, so the newest one is used.  Returns true if link was
+    repaired.
+    """
+    if os.path.isdir(link):
+        return False
+    sets = set_directories(link)
+    if not sets:
+        return False
+    newest = max(sets, key=lambda path: int(path.rpartition('.')[2]))
+    print('Recovering {0} from interrupted swap, using {1}'.format(link, newest))
+    _point_link(link, newest)
+    return True
+
+
+def files_missing_from(directory, other):
+    """Return the paths (relative to directory) of the files in directory
+    that other doesn't have.  Hidden files, like manifests and part files,
+    are left out.  Used to tell if a staged set drops movies of the live one.
+    """
+    missing = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [name for name in dirs if name[0:1] != '.']
+        for name in names:
+            if name[0:1] == '.':
+                continue
+            rel = os.path.relpath(os.path.join(root, name), directory)
+            if not os.path.lexists(os.path.join(other, rel)):
+                missing.append(rel)
+    return sorted(missing)
+
+
+def set_directories(link):
+    """Return the set directories of link, see swap_directory."""
+    return [path for path in glob.glob(glob.escape(link) + '.*')
+            if path.rpartition('.')[2].isdigit() and os.path.isdir(path)]
+
+
+def _next_set(link):
+    numbers = [int(path.rpartition('.')[2]) for path in set_directories(link)]
+    return '{0}.{1}'.format(link, max(numbers, default=0) + 1)
+
+
+class SyncManifest:
+    """Source size, mtime and fingerprint of every file copied into the
+    target directory, keyed by the path relative to it.
+    """
+
+    def __init__(self, path, target):
+        self._path = path
+        self._target = target
+        self._dirty = False
+        self._files = self._load()
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                data = json.load(f)
+            # A manifest of another target directory says nothing about this one.
+            if isinstance(data, dict) and data.get('target') == self._target:
+                return data.get('files', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as err:
+            print('Ignoring unreadable sync manifest {0}: {1}'.format(self._path, err))
+        return {}
+
+    def get(self, rel):
+        return self._files.get(rel)
+
+    def set(self, rel, entry):
+        self._files[rel] = entry
+        self._dirty = True
+
+    def remove(self, rel):
+        if self._files.pop(rel, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        """Write the manifest to disk if it changed."""
+        if not self._dirty:
+            return
+        try:
+            write_atomic(self._path, json.dumps({'target': self._target, 'files': self._files},
+                                                separators=(',', ':')))
+            self._dirty = False
+        except OSError as err:
+            print('Failed to write sync manifest {0}: {1}'.format(self._path, err))
+
+
+class Synchronizer:
+    """Brings files in the target directory up to date with source files,
+    copying only what changed.  With verify the copied data is hashed as it
+    is copied and the checksum is kept in the manifest.
+    """
+
+    def __init__(self, target, manifest, copier=None, verify=False):
+        self._target = target
+        self._manifest = manifest
+        self._copier = copier or Copier()
+        self._verify = verify
+
+    def _part_path(self, dst, size, mtime_ns, digest):
+        directory, name = os.path.split(dst)
+        return os.path.join(directory, '.{0}.{1}-{2}-{3}.part'.format(name, size, mtime_ns, digest))
+
+    @property
+    def target(self):
+        """The directory files are copied into."""
+        return self._target
+
+    def _parts(self, dst):
+        """Return the part files of all versions of dst."""
+        directory, name = os.path.split(dst)
+        return glob.glob(os.path.join(glob.escape(directory), glob.escape('.' + name) + '.*.part'))
+
+    def checksum(self, rel):
+        """Return the checksum ("algorithm:digest") of the copied file rel,
+        None if it wasn't verified.
+        """
+        entry = self._manifest.get(rel)
+        return entry.get('checksum') if entry is not None else None
+
+    def update(self, src, rel, progress=None, expected=None, copier=None):
+        """Make the file rel in the target directory a copy of src.  progress
+        is called as progress(total, initial) and returns the callable the
+        copy reports its position to (initial is where a resumed copy
+        starts).  expected is the checksum ("algorithm:digest") the data
+        should have when verifying, a file copied before without it is copied
+        again.  Returns true if data was copied, false if the file was up to
+        date.  Raises ChecksumError if the copy doesn't match expected, the
+        file is removed from the target directory then.  copier replaces the
+        Synchronizer's own, for calls from several threads at once.
+        """
+        copier = copier or self._copier
+        st = os.stat(src)
+        dst = os.path.join(self._target, rel)
+        try:
+            target_size = os.path.getsize(dst)
+        except OSError:
+            target_size = None
+        entry = self._manifest.get(rel)
+        if self._verify and expected is not None and entry is not None and entry.get('checksum') != expected:
+            entry = None
+            target_size = None
+        if entry is not None and target_size == entry['size'] == st.st_size:
+            if entry['mtime_ns'] == st.st_mtime_ns:
+                return False
+            # Same size but touched (e.g. copied onto the drive again), only
+            # copy if the content differs.
+            digest = fingerprint(src, st.st_size)
+            if entry['fingerprint'] == digest:
+                entry['mtime_ns'] = st.st_mtime_ns
+                self._manifest.set(rel, entry)
+                return False
+        else:
+            digest = fingerprint(src, st.st_size)
+            if target_size == st.st_size and entry is None and not self._verify \
+                    and fingerprint(dst, target_size) == digest:
+                # Copied before the manifest knew about it.
+                self._manifest.set(rel, {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'fingerprint': digest})
+                return False
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        part = self._part_path(dst, st.st_size, st.st_mtime_ns, digest)
+        # Parts of other versions of the file can't be continued.
+        for stale in self._parts(dst):
+            if stale != part:
+                os.remove(stale)
+        offset = 0
+        if os.path.exists(part):
+            offset = os.path.getsize(part) // CHECKPOINT * CHECKPOINT
+            print('Resuming copy of {0} at {1} MB'.format(rel, offset >> 20))
+        report = progress(st.st_size, offset) if progress is not None else None
+        hasher = None
+        if self._verify:
+            hasher = hashlib.new(expected.partition(':')[0] if expected else DEFAULT_ALGORITHM)
+        with open(src, 'rb') as fsrc, open(part, 'r+b' if offset else 'wb') as fdst:
+            fdst.truncate(offset)
+            if hasher is not None and offset:
+                # The hash state of the interrupted copy is gone, hash what it
+                # copied already.
+                fdst.seek(0)
+                while fdst.tell() < offset:
+                    hasher.update(fdst.read(min(BUFFER_SIZE, offset - fdst.tell())))
+            checkpoint = [offset + CHECKPOINT]
+
+            def copied(position):
+                # Make the data so far durable every CHECKPOINT bytes.
+                if position >= checkpoint[0]:
+                    fdst.flush()
+                    os.fsync(fdst.fileno())
+                    checkpoint[0] = position // CHECKPOINT * CHECKPOINT + CHECKPOINT
+                if report is not None:
+                    report(position)
+
+            copier.copy_data(fsrc, fdst, offset, st.st_size, copied, hasher)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'fingerprint': digest}
+        if hasher is not None:
+            entry['checksum'] = '{0}:{1}'.format(hasher.name, hasher.hexdigest())
+            if expected is not None and entry['checksum'] != expected:
+                # Neither the bad copy nor an older version of the file is
+                # what should be played.
+                self.remove(rel)
+                raise ChecksumError(rel, expected, entry['checksum'])
+        os.replace(part, dst)
+        _fsync_directory(os.path.dirname(dst))
+        self._manifest.set(rel, entry)
+        return True
+
+    def link(self, rel, directory):
+        """Hard link the file rel of directory into the target directory if
+        it doesn't have it yet, e.g. to start a new set with the files of the
+        current one instead of copying them again.
+        """
+        src = os.path.join(directory, rel)
+        dst = os.path.join(self._target, rel)
+        if os.path.lexists(dst) or not os.path.isfile(src):
+            return
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            os.link(src, dst)
+        except OSError:
+            # E.g. on another filesystem, update() copies it.
+            pass
+
+    def remove(self, rel):
+        """Delete the file rel, and any unfinished copy of it, from the target
+        directory.
+        """
+        dst = os.path.join(self._target, rel)
+        for path in [dst] + self._parts(dst):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._manifest.remove(rel)
+
+    def save(self):
+        """Write the manifest to disk if it changed."""
+        self._manifest.save()
+
+
+class Tally:
+    """Counts of a batch of files updated by several workers, safe to read
+    while they run.
+    """
+
+    def __init__(self, files, total):
+        self.files = files
+        self.total = total
+        # Files finished, and bytes done without copying them now (up to
+        # date or copied by an earlier, interrupted run).
+        self.done = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._finished = 0
+        self._positions = {}
+
+    def begin(self, worker, initial):
+        with self._lock:
+            self.skipped += initial
+            self._positions[worker] = initial
+
+    def advance(self, worker, position):
+        self._positions[worker] = position
+
+    def finish(self, worker, size, copied):
+        with self._lock:
+            self._positions.pop(worker, None)
+            self._finished += size
+            self.done += 1
+            if not copied:
+                self.skipped += size
+
+    def copied(self):
+        """Return the bytes done, of finished and running files."""
+        with self._lock:
+            return self._finished + sum(self._positions.values())
+
+
+def update_parallel(synchronizer, groups, threads=1, writers=0, tally=None, throttle=None,
+                    copier_factory=Copier, poll=None, poll_interval=0.1):
+    """Update files with synchronizer, one worker per group and at most
+    threads workers at once.  groups are lists of (source path, rel, size,
+    expected checksum) tuples, e.g. one per source drive so every drive is
+    read by one stream.  writers (if not 0) limits how many files are written
+    to the target directory at once.  Progress goes to tally, throttle limits
+    the total rate.  poll is called every poll_interval seconds while waiting,
+    e.g. to draw the progress.  Returns a dict of rel to the result of
+    Synchronizer.update, or the ChecksumError or OSError it raised.
+    """
+    limit = threading.BoundedSemaphore(writers) if writers else None
+    results = {}
+
+    def work(worker, group):
+        copier = copier_factory()
+        for src, rel, size, expected in group:
+
+            def progress(total, initial):
+                position = [initial]
+                if tally is not None:
+                    tally.begin(worker, initial)
+
+                def update(copied):
+                    if throttle is not None:
+                        throttle.consume(copied - position[0])
+                    position[0] = copied
+                    if tally is not None:
+                        tally.advance(worker, copied)
+                return update
+
+            if limit is not None:
+                limit.acquire()
+            try:
+                result = synchronizer.update(src, rel, progress, expected, copier)
+            except (ChecksumError, OSError) as err:
+                result = err
+            finally:
+                if limit is not None:
+                    limit.release()
+            if tally is not None:
+                tally.finish(worker, size, result is True)
+            results[rel] = result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(groups))), thread_name_prefix='copy') as executor:
+        futures = [executor.submit(work, worker, group) for worker, group in enumerate(groups)]
+        while True:
+            pending = wait(futures, poll_interval if poll is not None else None).not_done
+            if poll is not None:
+                poll()
+            if not pending:
+                break
+    for future in futures:
+        future.result()
+    return results
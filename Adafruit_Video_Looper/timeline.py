@@ -0,0 +1,140 @@
+# License: GNU GPLv2, see LICENSE.txt
+"""Virtual live channel timeline.
+
+Playback is tied to a fixed wall clock epoch as if the playlist had been
+broadcast in a loop ever since.  Which movie plays at any moment and how far
+into it follows from the epoch and the movie durations alone, so restarts,
+reboots and several units playing the same playlist all land on the same
+movie and position.
+"""
+import re
+import time
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from os.path import basename
+
+# Filenames like 01-12-23_Name.mp4 carry their duration (1h 12m 23s).
+_FILENAME_DURATION = re.compile(r'^(\d+)-(\d+)-(\d+)_')
+
+
+class Timeline:
+    """Prefix sums of the playlist durations.  Finding the movie playing at a
+    given time is a binary search over them.
+    """
+
+    def __init__(self, durations, epoch=0.0):
+        """durations are the movie lengths in seconds in playlist order, 0 for
+        movies that should be skipped.  epoch is the wall clock time (seconds
+        since the Unix epoch) the first movie started at.
+        """
+        self._epoch = epoch
+        self._ends = array('d')
+        total = 0.0
+        for duration in durations:
+            total += duration
+            self._ends.append(total)
+        self.length = total
+
+    def locate(self, when=None):
+        """Return the (index, offset) of the movie playing at when (seconds
+        since the Unix epoch, defaults to now) and the seconds into it, or None
+        if the playlist has no known duration.
+        """
+        if self.length <= 0:
+            return None
+        t = ((time.time() if when is None else when) - self._epoch) % self.length
+        index = bisect_right(self._ends, t)
+        # Guard against rounding right at the end of the loop.
+        if index >= len(self._ends):
+            return 0, 0.0
+        return index, t - (self._ends[index - 1] if index else 0.0)
+
+
+def movie_duration(movie):
+    """Duration source: the duration stored on the movie (e.g. from the
+    playlist file).
+    """
+    return movie.duration
+
+
+def filename_duration(movie):
+    """Duration source: an HH-MM-SS_ prefix in the filename."""
+    match = _FILENAME_DURATION.match(basename(movie.target))
+    if match is None:
+        return None
+    hours, minutes, seconds = map(int, match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+SOURCES = {
+    'movie': movie_duration,
+    'filename': filename_duration,
+}
+
+
+class DurationProvider:
+    """Looks up movie durations by asking each configured source in turn.
+    The first known duration is stored on the movie.
+    """
+
+    def __init__(self, sources, caches=()):
+        """caches are objects with save() and retain() methods backing the
+        sources, like the metadata cache.
+        """
+        self._sources = sources
+        self._caches = caches
+
+    def __call__(self, movie):
+        """Return the duration of movie in seconds, or None if unknown."""
+        if movie.duration is not None:
+            return movie.duration
+        for source in self._sources:
+            duration = source(movie)
+            if duration:
+                movie.duration = duration
+                return duration
+        return None
+
+    def retain(self, movies):
+        """Forget what the caches know about files other than those of
+        movies, the next time they are saved.
+        """
+        paths = {movie.target for movie in movies}
+        for cache in self._caches:
+            cache.retain(paths)
+
+    def save(self):
+        """Persist what the sources learned, e.g. newly probed files."""
+        for cache in self._caches:
+            cache.save()
+
+
+def create_duration_provider(config):
+    """Create the duration provider from the duration_sources setting in the
+    [video_looper] config section.
+    """
+    names = config.get('video_looper', 'duration_sources', fallback='movie, filename') \
+                  .translate(str.maketrans('', '', ' \t\r\n')) \
+                  .split(',')
+    sources = []
+    caches = []
+    for name in names:
+        if name == 'metadata':
+            # Probes the container headers, only load it when asked for.
+            from .metadata import create_metadata_cache
+            cache = create_metadata_cache(config)
+            sources.append(cache.duration)
+            caches.append(cache)
+        elif name in SOURCES:
+            sources.append(SOURCES[name])
+        else:
+            raise ValueError('Unknown duration source: {0} Expected one of {1}, metadata.'.format(name, ', '.join(SOURCES)))
+    return DurationProvider(sources, caches)
+
+
+def parse_epoch(value):
+    """Return the seconds since the Unix epoch of a local time like
+    2024-01-01 00:00:00.
+    """
+    return datetime.strptime(value.strip(), '%Y-%m-%d %H:%M:%S').timestamp()
@@ -1,7 +1,6 @@
 # Copyright 2015 Adafruit Industries.
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
-import glob
 
 from .usb_drive_mounter import USBDriveMounter
 
@@ -15,20 +14,24 @@ class USBDriveReader:
         """
         self._load_config(config)
         self._mounter = USBDriveMounter(root=self._mount_path,
-                                        readonly=self._readonly)
+                                        readonly=self._readonly,
+                                        options=self._mount_options,
+                                        settle_time=self._settle_time)
         self._mounter.start_monitor()
 
 
     def _load_config(self, config):
         self._mount_path = config.get('usb_drive', 'mount_path')
         self._readonly = config.getboolean('usb_drive', 'readonly')
+        self._mount_options = config.get('usb_drive', 'mount_options', fallback='noatime')
+        self._settle_time = config.getfloat('usb_drive', 'settle_time', fallback=0.5)
 
     def search_paths(self):
         """Return a list of paths to search for files. Will return a list of all
         mounted USB drives.
         """
         self._mounter.mount_all()
-        return glob.glob(self._mount_path + '*')
+        return self._mounter.paths()
 
     def is_changed(self):
         """Return true if the file search paths have changed, like when a new
@@ -36,6 +39,15 @@ class USBDriveReader:
         """
         return self._mounter.poll_changes()
 
+    def fileno(self):
+        """Return the udev monitor file descriptor so the main loop can wait
+        for drive changes instead of polling."""
+        return self._mounter.fileno()
+
+    def poll_timeout(self):
+        """Return when pending drive events settle."""
+        return self._mounter.poll_timeout()
+
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
         return 'Insert USB drive with compatible movies.'
@@ -0,0 +1,52 @@
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import re
+
+from .media_cache import MediaCache
+from .usb_drive import USBDriveReader
+
+
+class USBDriveReaderCache(USBDriveReader):
+
+    def __init__(self, config):
+        """Create an instance of a file reader that plays movies from USB
+        drives like the usb_drive reader, but keeps copies of the upcoming and
+        recently played movies on the SD card and plays those instead.
+        """
+        super().__init__(config)
+        # The same drive can come back at another mount point.
+        self._mount_point = re.compile('^' + re.escape(self._mount_path) + '[0-9]+/')
+        self._cache = MediaCache(self._cache_path, self._cache_size, self._fill_bandwidth,
+                                 name=lambda path: self._mount_point.sub('', path, count=1))
+
+    def _load_config(self, config):
+        super()._load_config(config)
+        state_dir = config.get('video_looper', 'state_dir', fallback='/var/lib/video_looper')
+        self._cache_path = config.get('usb_cache', 'path', fallback=os.path.join(state_dir, 'cache'))
+        self._cache_size = config.getfloat('usb_cache', 'size', fallback=4000) * 1e6
+        self._fill_bandwidth = config.getfloat('usb_cache', 'fill_bandwidth', fallback=0) * 1e6
+        self.prefetch_depth = config.getint('usb_cache', 'prefetch', fallback=3)
+
+    def resolve(self, path, record=True):
+        """Return the path to play the file at path from: its cached copy if
+        there is one, path otherwise.  record counts it as played, see
+        stats().
+        """
+        return self._cache.lookup(path, record)
+
+    def prefetch(self, paths):
+        """Cache the files at paths, which will be played next, in the
+        background.
+        """
+        self._cache.prefetch(paths[:self.prefetch_depth])
+
+    def stats(self):
+        """Return the cache statistics by name."""
+        return self._cache.stats()
+
+
+def create_file_reader(config, screen):
+    """Create new file reader based on mounting USB drives, with a local
+    cache.
+    """
+    return USBDriveReaderCache(config)
@@ -4,11 +4,31 @@
 import glob
 import os
 import shutil
-import re
+import threading
 import pygame
 import time
+from .copier import BUFFER_SIZE, Copier, Progress, Throttle, format_eta, format_rate
+from .scanner import create_scanner
+from .sync import (ChecksumError, SyncManifest, Synchronizer, Tally, files_missing_from,
+                   read_checksums, recover_link, set_directories, swap_directory, update_parallel)
 from .usb_drive_mounter import USBDriveMounter
 
+# How often (in seconds) the progress overlay of a background copy is redrawn,
+# which is also how soon the end of the copy is noticed.
+INGEST_REDRAW_INTERVAL = 1.0
+
+# How often the progress of a copy from several drives is checked when
+# progress_fps doesn't limit the redraws.
+UNLIMITED_POLL_INTERVAL = 0.02
+
+# Name of the sync manifest inside a set directory of a staged replace.
+STAGED_MANIFEST = '.sync.json'
+
+
+def _remove_directories(paths):
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+
 
 class USBDriveReaderCopy(object):
 
@@ -22,11 +42,27 @@ class USBDriveReaderCopy(object):
         self._load_config(config)
         self._pygame_init(config)
         self._mounter = USBDriveMounter(root=self._mount_path,
-                                        readonly=self._readonly)
+                                        readonly=self._readonly,
+                                        options=self._mount_options,
+                                        settle_time=self._settle_time)
         self._mounter.start_monitor()
-
+        self._copier = self._create_copier()
+        # background copy thread, its Tally (see _draw_ingest_overlay),
+        # if it changed the movies and if drives changed meanwhile
+        self._ingest = None
+        self._ingest_status = None
+        self._ingest_updated = False
+        self._drives_changed = False
+
+        # A swap interrupted while the target link was missing.
+        recover_link(self._target_path)
         if not os.path.exists(self._target_path):
             os.makedirs(self._target_path)
+        self._synchronizer = self._create_synchronizer(self._target_path)
+        if self._staged:
+            # Sets left over by a swap whose cleanup didn't finish.
+            live = os.path.realpath(self._target_path)
+            self._remove_in_background([path for path in set_directories(self._target_path) if path != live])
         #subprocess.call(['mkdir', self._target_path])
 
     def _pygame_init(self, config):
@@ -34,6 +70,7 @@ class USBDriveReaderCopy(object):
         self._fgcolor = (149,193,26)
         self._bordercolor = (255,255,255)
         self._fontcolor = (255,255,255)
+        pygame.font.init()
         self._font = pygame.font.Font(None, 40)
 
         #positions and sizes:
@@ -48,72 +85,365 @@ class USBDriveReaderCopy(object):
                                          (self.screenheight / 2) - (self.pheight / 2),
                                          self.pwidth,
                                          self.pheight)
+        # throughput and time left, below the progress bar
+        self.statsrect    =  pygame.Rect(0,
+                                         (self.screenheight / 2) + (self.pheight / 2) + 3*self.borderthickness,
+                                         self.screenwidth,
+                                         self._font.get_linesize())
+        # background copy progress, in the bottom left corner
+        self._small_font = pygame.font.Font(None, 28)
+        self.overlayrect  =  pygame.Rect(self.screenwidth * 0.02,
+                                         self.screenheight * 0.98 - self._small_font.get_linesize(),
+                                         self.screenwidth * 0.3,
+                                         self._small_font.get_linesize())
 
 
     def _load_config(self, config):
         self._mount_path = config.get('usb_drive', 'mount_path')
         self._readonly = config.getboolean('usb_drive', 'readonly')
+        self._mount_options = config.get('usb_drive', 'mount_options', fallback='noatime')
+        self._settle_time = config.getfloat('usb_drive', 'settle_time', fallback=0.5)
         self._target_path = config.get('directory', 'path')
         self._copy_mode = config.get('copymode', 'mode')
         self._copyloader = config.getboolean('copymode', 'copyloader')
         self._password = config.get('copymode', 'password')
+        self._progress_fps = config.getfloat('copymode', 'progress_fps', fallback=10)
+        self._state_dir = config.get('video_looper', 'state_dir', fallback='/var/lib/video_looper')
+        self._verify = config.getboolean('copymode', 'verify', fallback=False)
+        self._checksum_file = config.get('copymode', 'checksum_file', fallback='SHA256SUMS')
+        self._background = config.getboolean('copymode', 'background', fallback=False)
+        self._bandwidth_limit = config.getfloat('copymode', 'bandwidth_limit', fallback=0) * 1e6
+        self._staged = config.getboolean('copymode', 'staged', fallback=False)
+        self._copy_threads = config.getint('copymode', 'copy_threads', fallback=4)
+        self._target_writers = config.getint('copymode', 'target_writers', fallback=2)
+
+        extensions = config.get(self._config.get('video_looper', 'video_player'), 'extensions') \
+                           .translate(str.maketrans('','', ' \t\r\n.')) \
+                           .split(',')
+        self._scanner = create_scanner(config, extensions)
+
+    def _create_synchronizer(self, directory):
+        """Return a Synchronizer copying into directory.  It remembers what
+        was copied, so unchanged files aren't copied again.  When staging, the
+        manifest is kept in the directory, so it is swapped together with the
+        files it describes.
+        """
+        if self._staged:
+            manifest_path = os.path.join(directory, STAGED_MANIFEST)
+        else:
+            manifest_path = os.path.join(self._state_dir, 'sync.json')
+        manifest = SyncManifest(manifest_path, self._target_path)
+        return Synchronizer(directory, manifest, self._copier, self._verify)
 
-        self._extensions = '|'.join(config.get(self._config.get('video_looper', 'video_player'), 'extensions') \
-                                 .translate(str.maketrans('','', ' \t\r\n.')) \
-                                 .split(','))
-
-    def _copy_files(self, paths):
-        self._clear_screen()
+    def _remove_in_background(self, paths):
+        """Delete the directories at paths on a thread, large sets take a
+        while.
+        """
+        if paths:
+            threading.Thread(target=_remove_directories, args=(paths,), name='cleanup', daemon=True).start()
+
+    def _create_copier(self):
+        """Return a Copier for one copy thread."""
+        if self._background and self._bandwidth_limit > 0:
+            # Small kernel copies, so the throttle can spread them evenly.
+            return Copier(kernel_chunk=BUFFER_SIZE)
+        return Copier()
+
+    def _drive_order(self, path):
+        """Sort key putting drives in the order of their mount point numbers.
+        If several drives have a file of the same name, the first one wins.
+        """
+        suffix = path[len(self._mount_path):]
+        return (0, int(suffix), path) if suffix.isdigit() else (1, 0, path)
 
-        copy_mode = self._copy_mode
-        copy_mode_info = "(from config)"
-        for path in paths:
+    def _drive_mode(self, path):
+        """Return the copy mode for the drive at path and where it comes from,
+        or None if the drive lacks the password file.
+        """
+        #check password
+        if not self._password == "":
+            if not self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), self._password)):
+                return None
+
+        #override copymode?
+        replace = self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'replace'))
+        add = self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'add'))
+        if replace and not add:
+            return "replace", "(overridden)"
+        if add and not replace:
+            return "add", "(overridden)"
+        return self._copy_mode, "(from config)"
+
+    def _copy_files(self, paths, background=False):
+        """Copy the movies from the drives at paths, all drives at once.  In
+        the background nothing is drawn except for the overlay (see
+        _draw_ingest_overlay) and the bandwidth is limited.
+        """
+        drives = []
+        modes = []
+        for path in sorted(paths, key=self._drive_order):
             if not os.path.exists(path) or not os.path.isdir(path):
                 continue
-
-            #check password
-            if not self._password == "":
-                if not self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), self._password)):
-                    continue
-
-            #override copymode?
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'replace')):
-                copy_mode = "replace"
-                copy_mode_info = "(overridden)"
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'add')):
-                copy_mode = "add"
-                copy_mode_info = "(overridden)"
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'replace')) \
-                    and self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'add')):
-                copy_mode = self._copy_mode
-                copy_mode_info = "(from config)"
-
-            #inform about copymode
+            mode = self._drive_mode(path)
+            if mode is not None:
+                drives.append(path)
+                modes.append(mode)
+        if not drives:
+            # Nothing to copy, leave the screen alone.
+            return
+        if not background:
+            self._clear_screen()
+        # The drives are copied together, if one of them replaces the movies
+        # they are replaced by those of all drives.
+        copy_mode, copy_mode_info = next((mode for mode in modes if mode[0] == "replace"), modes[0])
+
+        #inform about copymode
+        if background:
+            print('Copying from {0} in the background, mode: {1} {2}'.format(', '.join(drives), copy_mode, copy_mode_info))
+        else:
             self._draw_info_text("Mode: " + copy_mode + " " + copy_mode_info)
 
-            if copy_mode == "replace":
-                # iterate over target path for deleting:
-                for x in os.listdir(self._target_path):
-                    if x[0] is not '.' and re.search('\.({0})$'.format(self._extensions), x, flags=re.IGNORECASE):
-                        os.remove('{0}/{1}'.format(self._target_path.rstrip('/'), x))
-
-            # iterate over source path for copying:
-            for x in os.listdir(path):
-                if x[0] is not '.' and re.search('\.({0})$'.format(self._extensions), x, flags=re.IGNORECASE):
-                    #copy file
-                    self._copy_with_progress('{0}/{1}'.format(path.rstrip('/'), x), '{0}/{1}'.format(self._target_path.rstrip('/'), x))
-
-            #copy loader image
-            if self._copyloader:
+        # results of the last copy, one line per file
+        log = None
+        if self._verify:
+            try:
+                log = open(os.path.join(self._state_dir, 'verify.log'), 'w')
+            except OSError as err:
+                print('Failed to open verify log: {0}'.format(err))
+        try:
+            if copy_mode == "replace" and self._staged:
+                if self._stage_files(drives, log, background):
+                    self._ingest_updated = True
+            else:
+                changed, failed, errors = self._sync_files(drives, copy_mode == "replace", log, background)
+                if changed or failed:
+                    self._ingest_updated = True
+        except OSError as err:
+            print('Copying from {0} failed: {1}'.format(', '.join(drives), err))
+        finally:
+            self._synchronizer.save()
+            if log is not None:
+                log.close()
+
+        #copy loader image, from the first drive that has one
+        if self._copyloader:
+            for path in drives:
                 loader_file_path = '{0}/{1}'.format(path.rstrip('/'), 'loader.png')
-                if os.path.exists(loader_file_path):
+                if not os.path.exists(loader_file_path):
+                    continue
+                if background:
+                    self._copier.copy(loader_file_path, '/home/pi/loader.png')
+                else:
                     self._clear_screen()
                     self._draw_info_text("Copying splashscreen file...")
                     time.sleep(2)
                     self._copy_with_progress(loader_file_path,'/home/pi/loader.png')
-                    
-    def _draw_copy_progress(self, copied, total):
-        perc = 100 * copied / total
+                break
+
+    def _stage_files(self, drives, log, background):
+        """Replace the movies with those on the drives by building the new
+        set in a staging directory next to the target directory, which is
+        swapped in once it is complete and verified.  Movies that didn't
+        change are hard linked from the current set instead of copied.  An
+        interrupted staging continues the next time.  Returns true if the
+        movies were swapped.
+        """
+        staging = self._target_path + '.staging'
+        live = os.path.realpath(self._target_path)
+        if not os.path.isdir(staging):
+            os.makedirs(staging)
+            try:
+                shutil.copyfile(os.path.join(live, STAGED_MANIFEST), os.path.join(staging, STAGED_MANIFEST))
+            except FileNotFoundError:
+                pass
+        synchronizer = self._create_synchronizer(staging)
+        try:
+            changed, failed, errors = self._sync_files(drives, True, log, background, synchronizer, link_from=live)
+        finally:
+            synchronizer.save()
+        if failed or errors:
+            print('Keeping the current movies, {0} files failed'.format(failed + errors))
+            return False
+        # Movies only deleted from the drives change the set as well.
+        if not changed and not files_missing_from(live, staging):
+            # Nothing new, the staging directory only links the current files.
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+        previous = swap_directory(self._target_path, staging)
+        self._synchronizer = self._create_synchronizer(self._target_path)
+        if previous is not None:
+            self._remove_in_background([previous])
+        print('Switched to the new movies from {0}'.format(', '.join(drives)))
+        return True
+
+    def _collect_sources(self, drives):
+        """Return the movies on the drives as a dict of path relative to the
+        drive -> (source path, size, drive), and their checksums from the
+        drives' checksum files as a dict of relative path -> checksum.  A file
+        on several drives is taken from the first one.
+        """
+        sources = {}
+        checksums = {}
+        for path in drives:
+            try:
+                found = [(os.path.relpath(entry.path, path), entry.path, entry.stat().st_size)
+                         for entry in self._scanner.scan(path)]
+                checksum_path = os.path.join(path, self._checksum_file)
+                drive_checksums = {}
+                if self._verify and os.path.isfile(checksum_path):
+                    drive_checksums = read_checksums(checksum_path)
+            except OSError as err:
+                print('Reading {0} failed: {1}'.format(path, err))
+                continue
+            for rel, src, size in found:
+                if rel in sources:
+                    print('{0} is on {1} and {2}, copying it from {1}'.format(rel, sources[rel][2], path))
+                    continue
+                sources[rel] = (src, size, path)
+                if rel in drive_checksums:
+                    checksums[rel] = drive_checksums[rel]
+        return sources, checksums
+
+    def _sync_files(self, drives, replace, log=None, background=False, synchronizer=None, link_from=None):
+        """Copy the new and changed movies from the drives into the target
+        directory (of synchronizer if given), keeping the folder structure if
+        subfolders are scanned.  Every drive is read by its own thread.  When
+        replacing, movies that aren't on the drives are deleted (in the
+        background only after copying, the old library keeps playing until
+        then).  Files already in the directory link_from are hard linked
+        first.  When verifying, the result for every file is written to log.
+        Returns the number of files changed, the number of files that failed
+        verification and the number of files that couldn't be copied.
+        """
+        synchronizer = synchronizer or self._synchronizer
+        sources, checksums = self._collect_sources(drives)
+        removed = 0
+        if replace and not background:
+            removed = self._remove_others(sources, synchronizer)
+
+        # One group of files per source device, so drives on separate ports
+        # are read at the same time but every drive by one stream.
+        devices = {}
+        groups = {}
+        for rel in sorted(sources):
+            src, size, path = sources[rel]
+            if path not in devices:
+                try:
+                    devices[path] = os.stat(path).st_dev
+                except OSError:
+                    devices[path] = path
+            if link_from is not None:
+                synchronizer.link(rel, link_from)
+            groups.setdefault(devices[path], []).append((src, rel, size, checksums.get(rel)))
+
+        tally = Tally(len(sources), sum(size for _, size, _ in sources.values()))
+        throttle = None
+        poll = None
+        if background:
+            self._ingest_status = tally
+            if self._bandwidth_limit > 0:
+                throttle = Throttle(self._bandwidth_limit)
+        else:
+            self._clear_screen(False)
+            # Redraw the progress bar at most progress_fps times a second.
+            progress = Progress(tally.total, self._draw_copy_progress, self._progress_fps)
+
+            def poll():
+                progress.update(tally.copied(), tally.skipped)
+
+        poll_interval = 1.0 / self._progress_fps if self._progress_fps > 0 else UNLIMITED_POLL_INTERVAL
+        results = update_parallel(synchronizer, list(groups.values()), self._copy_threads, self._target_writers,
+                                  tally, throttle, self._create_copier, poll, poll_interval)
+
+        copied = 0
+        failed = 0
+        errors = 0
+        for rel in sorted(results):
+            result = results[rel]
+            checksum = '-'
+            if isinstance(result, ChecksumError):
+                # The file is left out of the target directory and so out of
+                # the playlist.
+                print('Checksum mismatch, not playing {0}'.format(result))
+                failed += 1
+                checksum = '{0} (expected {1})'.format(result.actual, result.expected)
+                result = 'MISMATCH'
+            elif isinstance(result, OSError):
+                # Most likely the drive was pulled, a later copy continues
+                # where this one stopped.
+                print('Copying {0} failed: {1}'.format(sources[rel][0], result))
+                errors += 1
+                result = 'ERROR'
+            elif result:
+                copied += 1
+                checksum = synchronizer.checksum(rel) or '-'
+                result = 'ok' if checksums.get(rel) is not None else 'unverified'
+            else:
+                checksum = synchronizer.checksum(rel) or '-'
+                result = 'unchanged'
+            if log is not None:
+                log.write('{0} {1} {2} {3}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S'), result,
+                                                      sources[rel][0], checksum))
+        if replace and background:
+            removed = self._remove_others(sources, synchronizer)
+        print('Copied {0} of {1} files from {2}, the others were up to date'.format(copied, len(sources), ', '.join(drives)))
+        if failed and not background:
+            self._clear_screen()
+            self._draw_info_text('{0} files failed verification'.format(failed))
+            time.sleep(2)
+        return copied + removed, failed, errors
+
+    def _remove_others(self, sources, synchronizer):
+        """Delete the movies in the target directory of synchronizer that
+        aren't in sources (relative path -> source path).  Returns how many
+        were deleted.
+        """
+        removed = 0
+        for entry in self._scanner.scan(synchronizer.target):
+            rel = os.path.relpath(entry.path, synchronizer.target)
+            if rel not in sources:
+                synchronizer.remove(rel)
+                removed += 1
+        return removed
+
+    def _run_ingest(self, paths):
+        """Copy from the drives at paths on the background thread."""
+        try:
+            # Leave the CPU to playback.
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        try:
+            self._copy_files(paths, background=True)
+        except Exception as err:
+            print('Background copy failed: {0}'.format(err))
+
+    def _start_ingest(self, paths):
+        if not paths:
+            return
+        self._ingest_status = None
+        self._ingest_updated = False
+        self._ingest = threading.Thread(target=self._run_ingest, args=(paths,), name='ingest', daemon=True)
+        self._ingest.start()
+
+    def _draw_ingest_overlay(self, clear=False):
+        """Draw the progress of the background copy in a corner of the
+        screen, visible around and between the movies.
+        """
+        self._screen.fill(self._bgcolor, self.overlayrect)
+        tally = self._ingest_status
+        if not clear and tally is not None:
+            perc = 100 * tally.copied() / tally.total if tally.total else 100.
+            bar = self.overlayrect.copy()
+            bar.width = bar.width * perc / 100
+            pygame.draw.rect(self._screen, self._fgcolor, bar)
+            label = self._small_font.render('Copying {0}/{1}: {2}%'.format(tally.done, tally.files, int(perc)),
+                                            True, self._fontcolor)
+            self._screen.blit(label, (self.overlayrect.left + self.borderthickness, self.overlayrect.top))
+        pygame.display.update(self.overlayrect)
+
+    def _draw_copy_progress(self, copied, total, rate=None, eta=None):
+        perc = 100 * copied / total if total else 100.
         assert (isinstance(perc, float))
         assert (0. <= perc <= 100.)
 
@@ -129,8 +459,16 @@ class USBDriveReaderCopy(object):
         pygame.draw.rect(self._screen, self._fgcolor, progressrect)
         #progress_text
         self.draw_progress_text(str(int(round(perc)))+"%")
+        #throughput and eta
+        self._screen.fill(self._bgcolor, self.statsrect)
+        if rate:
+            stats = format_rate(rate)
+            if eta is not None:
+                stats += ", " + format_eta(eta) + " left"
+            label = self._font.render(stats, True, self._fontcolor, self._bgcolor)
+            self._screen.blit(label, (self.screenwidth / 2 - label.get_width() / 2, self.statsrect.top))
 
-        pygame.display.update(self.borderrect)
+        pygame.display.update([self.borderrect, self.statsrect])
 
     def _draw_info_text(self, message):
         label1 = self._font.render(message, True, self._fontcolor, self._bgcolor)
@@ -179,22 +517,12 @@ class USBDriveReaderCopy(object):
         if not follow_symlinks and os.path.islink(src):
             os.symlink(os.readlink(src), dst)
         else:
+            # Redraw the progress bar at most progress_fps times a second.
             size = os.stat(src).st_size
-            with open(src, 'rb') as fsrc:
-                with open(dst, 'wb') as fdst:
-                    self._copyfileobj(fsrc, fdst, callback=self._draw_copy_progress, total=size)
+            progress = Progress(size, self._draw_copy_progress, self._progress_fps)
+            self._copier.copy(src, dst, progress=progress.update)
         return dst
 
-    def _copyfileobj(self, fsrc, fdst, callback, total, length=16 * 1024):
-        copied = 0
-        while True:
-            buf = fsrc.read(length)
-            if not buf:
-                break
-            fdst.write(buf)
-            copied += len(buf)
-            callback(copied, total=total)
-
     def _copy_with_progress(self, src, dst, *, follow_symlinks=True):
         if os.path.isdir(dst):
             dst = os.path.join(dst, os.path.basename(src))
@@ -210,20 +538,54 @@ class USBDriveReaderCopy(object):
         """Return a list of paths to search for files. Will return a list of all
         mounted USB drives.
         """
-        if(self._mounter.has_nodes()):
-            self._mounter.mount_all()
-            self._copy_files(glob.glob(self._mount_path + '*'))
+        if(self._mounter.has_nodes()) and self._ingest is None:
+            # Only copy from drives that weren't mounted yet.
+            if self._background:
+                self._start_ingest(self._mounter.mount_all())
+            else:
+                self._copy_files(self._mounter.mount_all())
 
         return [self._target_path]
 
     def is_changed(self):
         """Return true if the file search paths have changed, like when a new
-        USB drive is inserted.
+        USB drive is inserted.  In the background mode a new drive is copied
+        while the current movies keep playing, and the change is only
+        reported once the copy is complete.
         """
-        if self._mounter.poll_changes() and self._mounter.has_nodes():
-            return True
-        else:
+        drives_changed = self._mounter.poll_changes()
+        if self._ingest is not None:
+            if self._ingest.is_alive():
+                # Drives changed meanwhile are handled after the copy.
+                self._drives_changed = self._drives_changed or drives_changed
+                self._draw_ingest_overlay()
+                return False
+            self._ingest = None
+            self._draw_ingest_overlay(clear=True)
+            updated = self._ingest_updated
+            if drives_changed or self._drives_changed:
+                self._drives_changed = False
+                self._start_ingest(self._mounter.mount_all())
+            # Nothing to switch over to if all files were up to date.
+            return updated
+        if drives_changed and self._background:
+            self._start_ingest(self._mounter.mount_all())
             return False
+        return drives_changed and self._mounter.has_nodes()
+
+    def fileno(self):
+        """Return the udev monitor file descriptor so the main loop can wait
+        for drive changes instead of polling."""
+        return self._mounter.fileno()
+
+    def poll_timeout(self):
+        """Return when pending drive events settle, or the background copy
+        overlay is due to be redrawn.
+        """
+        timeout = self._mounter.poll_timeout()
+        if self._ingest is not None:
+            timeout = min(timeout, INGEST_REDRAW_INTERVAL) if timeout is not None else INGEST_REDRAW_INTERVAL
+        return timeout
 
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
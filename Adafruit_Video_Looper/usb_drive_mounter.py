@@ -2,74 +2,235 @@
 # Author: Tony DiCola
 # License: GNU GPLv2, see LICENSE.txt
 import glob
+import os
+import re
+import select
 import subprocess
-import time
+from time import monotonic
 
 import pyudev
 
 
+def _identity(device):
+    """Return what identifies a partition across reinsertions: the filesystem
+    UUID, or the drive serial number and partition number.
+    """
+    uuid = device.get('ID_FS_UUID')
+    if uuid:
+        return uuid
+    serial = device.get('ID_SERIAL')
+    if serial:
+        return '{0}-{1}'.format(serial, device.get('ID_PART_ENTRY_NUMBER', ''))
+    return device.device_node
+
+
+def _mounted():
+    """Return a dict of mount point to device node of all mounted
+    filesystems.
+    """
+    mounts = {}
+    try:
+        with open('/proc/self/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2:
+                    # Spaces and the like are octal escaped.
+                    path = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[1])
+                    mounts[path] = fields[0]
+    except OSError:
+        pass
+    return mounts
+
+
 class USBDriveMounter:
     """Service for automatically mounting attached USB drives."""
 
-    def __init__(self, root='/mnt/usbdrive', readonly=True):
+    def __init__(self, root='/mnt/usbdrive', readonly=True, options='noatime', settle_time=0.5):
         """Create an instance of the USB drive mounter service.  Root is an
         optional parameter which specifies the location and file name prefix for
         mounted drives (a number will be appended to each mounted drive file
         name).  Readonly is a boolean that indicates if the drives should be
-        mounted as read-only or not (default false, writable).
+        mounted as read-only or not (default false, writable).  Options are
+        extra mount options, comma separated.  Drive events are collected for
+        settle_time seconds after the last one and reported as one change.
         """
         self._root = root
         self._readonly = readonly
+        self._options = [option.strip() for option in options.split(',') if option.strip()]
         self._context = pyudev.Context()
+        # Mounted partitions: identity -> (device node, mount point).
+        self._mounts = {}
+        # Slot number a partition was mounted at, so a drive gets the same
+        # mount point when it is plugged in again.
+        self._slots = {}
+        self._cleaned_up = False
+        self._settle_time = settle_time
+        self._monitor = None
+        # Attached partitions (identity -> device node) kept up to date from
+        # monitor events once the monitor is started, and the set last
+        # reported as changed.
+        self._devices = None
+        self._reported = None
+        self._settle_at = None
+
+    def _partitions(self):
+        """Return a dict of identity -> device node of the attached USB drive
+        partitions.
+        """
+        if self._devices is not None:
+            return dict(self._devices)
+        return {_identity(x): x.device_node
+                for x in self._context.list_devices(subsystem='block', DEVTYPE='partition')
+                if 'ID_BUS' in x and x['ID_BUS'] == 'usb'}
+
+    def _unmount(self, path):
+        subprocess.call(['umount', '-l', path])
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+    def _free_slot(self, identity):
+        """Return the slot the drive had before if it is free, the lowest free
+        one otherwise.
+        """
+        used = {self._slots[mounted] for mounted in self._mounts}
+        slot = self._slots.get(identity)
+        if slot is None or slot in used:
+            slot = 0
+            while slot in used:
+                slot += 1
+            self._slots[identity] = slot
+        return slot
+
+    def _clean_up(self, partitions):
+        """Take over drives still mounted by a previous run and remove the
+        other leftover mount points.
+        """
+        mounted = _mounted()
+        nodes = {node: identity for identity, node in partitions.items()}
+        for path in glob.glob(self._root + '*'):
+            identity = nodes.get(mounted.get(path))
+            suffix = path[len(self._root):]
+            if identity is not None and identity not in self._mounts and suffix.isdigit():
+                self._mounts[identity] = (partitions[identity], path)
+                self._slots[identity] = int(suffix)
+            elif path in mounted:
+                self._unmount(path)
+            else:
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    pass
 
     def remove_all(self):
         """Unmount and remove mount points for all mounted drives."""
         for path in glob.glob(self._root + '*'):
-            subprocess.call(['umount', '-l', path])
-            subprocess.call(['rm', '-r', path])
+            self._unmount(path)
+        self._mounts.clear()
 
     def mount_all(self):
-        """Mount all attached USB drives.  Readonly is a boolean that specifies
-        if the drives should be mounted read only (defaults to true).
+        """Mount newly attached USB drives and unmount removed ones.  Drives
+        that stay attached are left alone, so playback from them continues.
+        Returns the mount points of the drives mounted by this call.
         """
-        self.remove_all()
-        # Enumerate USB drive partitions by path like /dev/sda1, etc.
-        nodes = [x.device_node for x in self._context.list_devices(subsystem='block', DEVTYPE='partition')
-                 if 'ID_BUS' in x and x['ID_BUS'] == 'usb']
-        # Mount each drive under the mount root.
-        for i, node in enumerate(nodes):
-            path = self._root + str(i)
-            subprocess.call(['mkdir', path])
+        partitions = self._partitions()
+        added = []
+        if not self._cleaned_up:
+            self._cleaned_up = True
+            self._clean_up(partitions)
+            added.extend(path for _, path in self._mounts.values())
+        for identity, (node, path) in list(self._mounts.items()):
+            if partitions.get(identity) != node:
+                print('Unmounting {0} from {1}'.format(node, path))
+                self._unmount(path)
+                del self._mounts[identity]
+        options = list(self._options)
+        if self._readonly:
+            options.append('ro')
+        for identity, node in sorted(partitions.items(), key=lambda item: item[1]):
+            if identity in self._mounts:
+                continue
+            path = self._root + str(self._free_slot(identity))
+            os.makedirs(path, exist_ok=True)
             args = ['mount']
-            if self._readonly:
-                args.append('-r')
+            if options:
+                args.extend(['-o', ','.join(options)])
             args.extend([node, path])
-            subprocess.check_call(args)
+            if subprocess.call(args) != 0:
+                print('Failed to mount {0} at {1}'.format(node, path))
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    pass
+                continue
+            self._mounts[identity] = (node, path)
+            added.append(path)
+        return added
 
-        return nodes
+    def paths(self):
+        """Return the mount points of all mounted drives, in slot order."""
+        return sorted((path for _, path in self._mounts.values()),
+                      key=lambda path: int(path[len(self._root):]))
 
     def has_nodes(self):
-        nodes = [x.device_node for x in self._context.list_devices(subsystem='block', DEVTYPE='partition')
-                 if 'ID_BUS' in x and x['ID_BUS'] == 'usb']
-        return nodes != []
+        """Return true if a USB drive partition is attached."""
+        return len(self._partitions()) > 0
 
     def start_monitor(self):
-        """Initialize monitoring of USB drive changes."""
+        """Initialize monitoring of USB drive changes.  From now on the
+        attached partitions are tracked from the monitor events instead of
+        being enumerated every time.
+        """
         self._monitor = pyudev.Monitor.from_netlink(self._context)
         self._monitor.filter_by('block', 'partition')
         self._monitor.start()
+        # Started first, so no event between listing and monitoring is lost.
+        self._devices = self._partitions()
+        self._reported = dict(self._devices)
+
+    def fileno(self):
+        """Return the udev monitor file descriptor, readable when a drive
+        event is pending."""
+        return self._monitor.fileno()
+
+    def poll_timeout(self):
+        """Return the seconds until pending drive events settle, None if there
+        are none.
+        """
+        if self._settle_at is None:
+            return None
+        return max(0.0, self._settle_at - monotonic())
+
+    def _handle(self, device):
+        node = device.device_node
+        # A partition reformatted or reinserted under the same node replaces
+        # the old entry.
+        for identity in [identity for identity, known in self._devices.items() if known == node]:
+            del self._devices[identity]
+        if device.action != 'remove':
+            self._devices[_identity(device)] = node
 
     def poll_changes(self):
-        """Check for changes to USB drives.  Returns true if there was a USB 
-        drive change, otherwise false.
+        """Check for changes to USB drives.  Returns true once the drive
+        events settled and the attached partitions differ from the last time
+        true was returned, otherwise false.
         """
-        # Look for a drive change.
-        device = self._monitor.poll(0)
-        # If a USB drive changed (added/remove) remount all drives.
-        if device is not None and device['ID_BUS'] == 'usb':
-            return True
-        # Else nothing changed.
-        return False
+        # Drain all pending events.
+        while True:
+            device = self._monitor.poll(0)
+            if device is None:
+                break
+            if device.get('ID_BUS') == 'usb':
+                self._handle(device)
+                self._settle_at = monotonic() + self._settle_time
+        if self._settle_at is None or monotonic() < self._settle_at:
+            return False
+        self._settle_at = None
+        if self._devices == self._reported:
+            return False
+        self._reported = dict(self._devices)
+        return True
 
 
 if __name__ == '__main__':
@@ -80,7 +241,8 @@ if __name__ == '__main__':
     drive_mounter.start_monitor()
     print ('Listening for USB drive changes (press Ctrl-C to quit)...')
     while True:
+        # Sleep until a drive event arrives or pending events settle.
+        select.select([drive_mounter], [], [], drive_mounter.poll_timeout())
         if drive_mounter.poll_changes():
             print ('USB drives changed!')
             drive_mounter.mount_all()
-        time.sleep(0)
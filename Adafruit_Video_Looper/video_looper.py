@@ -13,13 +13,18 @@ import time
 import pygame
 import json
 import threading
-from datetime import datetime
-import RPi.GPIO as GPIO
+from datetime import datetime, timedelta
 
 from .alsa_config import parse_hw_device
+from .controls import ControlQueue, NAVIGATE, PAUSE, SEEK, JUMP, SEND_KEY, TOGGLE_STOP
+from .events import EventLoop
+from .metrics import StartupReport, create_metrics
 from .model import Playlist, Movie
-from .playlist_builders import build_playlist_m3u
-from .rotary import ChannelSwitcher
+from .playlist_builders import build_playlist_m3u, clear_cache as clear_playlist_cache
+from .scanner import create_scanner
+from .schedule import load_schedule
+from .state import create_state_store
+from .timeline import Timeline, create_duration_provider, parse_epoch
 
 # Basic video looper architecure:
 #
@@ -44,12 +49,45 @@ from .rotary import ChannelSwitcher
 # - Future file readers and video players can be provided and referenced in the
 #   config to extend the video player use to read from different file sources
 #   or use different video players.
+#
+# - The main loop blocks in an EventLoop instead of polling.  Players and file
+#   readers can optionally define fileno() returning a file descriptor that
+#   becomes readable when they need attention (player process exited, udev or
+#   inotify event pending) and/or poll_timeout() returning the seconds until
+#   they should be checked again (None to wait for events only).  Sources that
+#   define neither are polled every LEGACY_POLL_INTERVAL seconds like before.
+#
+# - File readers can optionally define changes() returning the paths added,
+#   removed and modified since is_changed() last returned true (see
+#   watcher.Changes).  Changes that only concern movie files are then applied
+#   to the playlist in place without interrupting playback, instead of
+#   rebuilding the whole playlist.
+#
+# - File readers can optionally define resolve(path, record) returning the
+#   path a movie should actually be played from (e.g. a local copy), and
+#   prefetch_depth with prefetch(paths) to be told which movies come next, see
+#   usb_drive_cache.py.  Such readers also define stats() returning values
+#   exported as metrics gauges.
+LEGACY_POLL_INTERVAL = 0.002
+
+# Settings in movie filenames.
+REPEAT_TAG = re.compile('_repeat_([0-9]*)x', flags=re.IGNORECASE)
+WEIGHT_TAG = re.compile('_weight_([0-9]+)', flags=re.IGNORECASE)
+
+# How often (in seconds) the active schedule block is looked up again, to catch
+# wall clock changes like NTP corrections or daylight saving time.
+SCHEDULE_RECHECK_INTERVAL = 60
+
 class VideoLooper:
 
     def __init__(self, config_path):
         """Create an instance of the main video looper application class. Must
         pass path to a valid video looper ini configuration file.
         """
+        # Time every startup phase up to the first frame, starting with the
+        # interpreter and imports.
+        self._startup = StartupReport()
+        self._startup.phase('imports')
         # Load the configuration.
         self._config = configparser.ConfigParser()
         if len(self._config.read(config_path)) == 0:
@@ -78,18 +116,55 @@ class VideoLooper:
         self._fgcolor = list(map(int, self._config.get('video_looper', 'fgcolor')
                                              .translate(str.maketrans('','', ','))
                                              .split()))
-        # Initialize pygame and display a blank screen.
+        self._startup.phase('config')
+        # Initialize pygame and display a blank screen.  Fonts are only loaded
+        # once some text is rendered.
         pygame.display.init()
-        pygame.font.init()
         pygame.mouse.set_visible(False)
         self._screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN | pygame.NOFRAME)
         self._size = (pygame.display.Info().current_w, pygame.display.Info().current_h)
+        self._fonts = {}
         self._bgimage = self._load_bgimage() #a tupple with pyimage, xpos, ypos
         self._blank_screen()
+        self._startup.phase('display')
+        # Transition and control latency instrumentation.
+        self._metrics = create_metrics(self._config)
+        # Resume point and other state that has to survive a restart.
+        self._state = create_state_store(self._config)
+        self._migrate_legacy_state()
+        self._playing_movie = None
+        self._play_started = 0
+        self._play_offset = 0
+        # Position reported while nothing plays or playback is paused, see
+        # _freeze_position, when the current pause started and the seconds
+        # spent paused before.
+        self._frozen_position = None
+        self._paused_at = None
+        self._paused_for = 0
+        self._resume_position = None
+        if self._resume_playlist:
+            self._state.track('position', self._playback_position)
         # Load configured video player and file reader modules.
         self._player = self._load_player()
+        self._startup.phase('player')
         self._reader = self._load_file_reader()
+        self._startup.phase('reader')
         self._playlist = None
+        # Daypart schedule switching between playlists at fixed times.
+        self._schedule_path = self._config.get('playlist', 'schedule', fallback='')
+        self._schedule_prepare_time = self._config.getfloat('playlist', 'schedule_prepare_time', fallback=30)
+        self._schedule = None
+        self._block = None
+        self._next_block = None
+        self._block_deadline = None
+        self._schedule_check_at = None
+        self._prepared_block = None
+        # Live channel: tie the playback position to a fixed wall clock epoch.
+        self._live_mode = self._config.get('video_looper', 'live_mode', fallback='movie').lower()
+        assert self._live_mode in ('off', 'movie', 'playlist'), 'Unknown live_mode configuration value: {0} Expected off, movie or playlist.'.format(self._live_mode)
+        self._live_epoch = parse_epoch(self._config.get('video_looper', 'live_epoch', fallback='2024-01-01 00:00:00'))
+        self._durations = create_duration_provider(self._config)
+        self._reset_timeline()
         # Load ALSA hardware configuration.
         self._alsa_hw_device = parse_hw_device(self._config.get('alsa', 'hw_device'))
         self._alsa_hw_vol_control = self._config.get('alsa', 'hw_vol_control')
@@ -101,14 +176,18 @@ class VideoLooper:
         # default value to 0 millibels (omxplayer)
         self._sound_vol = 0
         # Set other static internal state.
-        self._extensions = '|'.join(self._player.supported_extensions())
-        self._small_font = pygame.font.Font(None, 50)
-        self._medium_font   = pygame.font.Font(None, 96)
-        self._big_font   = pygame.font.Font(None, 250)
+        self._scanner = create_scanner(self._config, self._player.supported_extensions())
         self._running    = True
         self._playbackStopped = False
         #used for not waiting the first time
         self._firstStart = True
+        # Lets the main loop sleep until the player, the file reader or a
+        # control input needs attention.
+        self._events = EventLoop()
+        # Keyboard, GPIO and rotary handlers run on their own threads and only
+        # queue commands, the main loop applies them.
+        self._commands = ControlQueue(on_put=self._events.wake,
+                                      navigate_delay=self._config.getfloat('control', 'navigate_debounce', fallback=0.3))
 
         # start keyboard handler thread:
         # Event handling for key press, if keyboard control is enabled
@@ -117,19 +196,25 @@ class VideoLooper:
             self._keyboard_thread.start()
 
         # Lets initialize the channel switcher on its own thread but delay its start until the vidoe playlist is created
-        self._channel_switcher = ChannelSwitcher(self._handle_rotary_channel_switcher)
-        self._channel_switcher_thread = threading.Thread(target=self._channel_switcher.start, daemon=True)    
-
+        # The rotary module talks to I2C and GPIO hardware, only load it if enabled.
+        self._channel_switcher_thread = None
+        if self._config.getboolean('rotary', 'enabled', fallback=False):
+            from .rotary import ChannelSwitcher
+            self._channel_switcher = ChannelSwitcher(self._handle_rotary_channel_switcher, state=self._state)
+            self._channel_switcher_thread = threading.Thread(target=self._channel_switcher.start, daemon=True)
+
+        self._gpio = None
         pinMapSetting = self._config.get('control', 'gpio_pin_map', raw=True)
         if pinMapSetting:
             try:
-                self._pinMap = json.loads("{"+pinMapSetting+"}")
+                self._pinMap = self._parse_pin_map(pinMapSetting)
                 self._gpio_setup()
             except Exception as err:
                 self._pinMap = None
-                self._print("gpio_pin_map setting is not valid and/or error with GPIO setup")
+                self._print("gpio_pin_map setting is not valid and/or error with GPIO setup: {0}".format(err))
         else:
             self._pinMap = None
+        self._startup.phase('controls')
 
     def _print(self, message):
         """Print message to standard output if console output is enabled."""
@@ -140,7 +225,7 @@ class VideoLooper:
     def _load_player(self):
         """Load the configured video player and return an instance of it."""
         module = self._config.get('video_looper', 'video_player')
-        return importlib.import_module('.' + module, 'Adafruit_Video_Looper').create_player(self._config, screen=self._screen, bgimage=self._bgimage)
+        return importlib.import_module('.' + module, 'Adafruit_Video_Looper').create_player(self._config, screen=self._screen, bgimage=self._bgimage, metrics=self._metrics)
 
     def _load_file_reader(self):
         """Load the configured file reader and return an instance of it."""
@@ -189,44 +274,59 @@ class VideoLooper:
         except ValueError:
             return False
 
-    def _build_playlist(self):
+    def _resolve_path(self, path):
+        """Return path if it is absolute, otherwise the first existing file
+        named path in the file reader's search paths or None.
+        """
+        if os.path.isabs(path):
+            return path if os.path.isfile(path) else None
+        for search_path in self._reader.search_paths():
+            maybe_path = os.path.join(search_path, path)
+            if os.path.isfile(maybe_path):
+                return maybe_path
+        return None
+
+    def _block_playlist_path(self, block):
+        """Return the playlist path to use for a schedule block, the
+        configured one outside of all blocks.
+        """
+        if block is not None:
+            return block
+        return self._config.get('playlist', 'path', fallback='')
+
+    def _build_playlist(self, playlist_path=None):
         """Try to build a playlist (object) from a playlist (file).
-        Falls back to an auto-generated playlist with all files.
+        Falls back to an auto-generated playlist with all files.  Without
+        playlist_path the playlist of the active schedule block or the
+        configured one is used.
         """
-        if self._config.has_option('playlist', 'path'):
-            playlist_path = self._config.get('playlist', 'path')
-            if playlist_path != "":
-                if os.path.isabs(playlist_path):
-                    if not os.path.isfile(playlist_path):
-                        self._print('Playlist path {0} does not exist.'.format(playlist_path))
-                        return self._build_playlist_from_all_files()
-                        #raise RuntimeError('Playlist path {0} does not exist.'.format(playlist_path))
-                else:
-                    paths = self._reader.search_paths()
-                    
-                    if not paths:
-                        return Playlist([])
-                    
-                    for path in paths:
-                        maybe_playlist_path = os.path.join(path, playlist_path)
-                        if os.path.isfile(maybe_playlist_path):
-                            playlist_path = maybe_playlist_path
-                            self._print('Playlist path resolved to {0}.'.format(playlist_path))
-                            break
-                    else:
-                        self._print('Playlist path {0} does not resolve to any file.'.format(playlist_path))
-                        return self._build_playlist_from_all_files()
-                        #raise RuntimeError('Playlist path {0} does not resolve to any file.'.format(playlist_path))
+        if playlist_path is None:
+            playlist_path = self._block_playlist_path(self._block)
+        if playlist_path != "":
+            if os.path.isabs(playlist_path):
+                if not os.path.isfile(playlist_path):
+                    self._print('Playlist path {0} does not exist.'.format(playlist_path))
+                    return self._build_playlist_from_all_files()
+                    #raise RuntimeError('Playlist path {0} does not exist.'.format(playlist_path))
+            else:
+                if not self._reader.search_paths():
+                    return Playlist([])
 
-                basepath, extension = os.path.splitext(playlist_path)
-                if extension == '.m3u' or extension == '.m3u8':
-                    return build_playlist_m3u(playlist_path)
-                else:
-                    self._print('Unrecognized playlist format {0}.'.format(extension))
+                resolved_path = self._resolve_path(playlist_path)
+                if resolved_path is None:
+                    self._print('Playlist path {0} does not resolve to any file.'.format(playlist_path))
                     return self._build_playlist_from_all_files()
-                    #raise RuntimeError('Unrecognized playlist format {0}.'.format(extension))
+                    #raise RuntimeError('Playlist path {0} does not resolve to any file.'.format(playlist_path))
+                playlist_path = resolved_path
+                self._print('Playlist path resolved to {0}.'.format(playlist_path))
+
+            basepath, extension = os.path.splitext(playlist_path)
+            if extension == '.m3u' or extension == '.m3u8':
+                return build_playlist_m3u(playlist_path, log=self._print)
             else:
+                self._print('Unrecognized playlist format {0}.'.format(extension))
                 return self._build_playlist_from_all_files()
+                #raise RuntimeError('Unrecognized playlist format {0}.'.format(extension))
         else:
             return self._build_playlist_from_all_files()
 
@@ -236,23 +336,12 @@ class VideoLooper:
         """
         # Get list of paths to search from the file reader.
         paths = self._reader.search_paths()
-        # Enumerate all movie files inside those paths.
+        # Enumerate all movie files inside those paths, scanning several
+        # drives at the same time.
         movies = []
-        for path in paths:
-            # Skip paths that don't exist or are files.
-            if not os.path.exists(path) or not os.path.isdir(path):
-                continue
-
-            for x in os.listdir(path):
-                # Ignore hidden files (useful when file loaded on usb key from an OSX computer
-                if x[0] != '.' and re.search('\.({0})$'.format(self._extensions), x, flags=re.IGNORECASE):
-                    repeatsetting = re.search('_repeat_([0-9]*)x', x, flags=re.IGNORECASE)
-                    if (repeatsetting is not None):
-                        repeat = repeatsetting.group(1)
-                    else:
-                        repeat = 1
-                    basename, extension = os.path.splitext(x)
-                    movies.append(Movie('{0}/{1}'.format(path.rstrip('/'), x), basename, repeat))
+        for path, entries in zip(paths, self._scanner.scan_all(paths)):
+            for entry in entries:
+                movies.append(self._movie_from_file(entry.path))
 
             # Get the ALSA hardware volume from the file in the usb key
             if self._alsa_hw_vol_file:
@@ -270,8 +359,50 @@ class VideoLooper:
                         sound_vol_string = sound_file.readline()
                         if self._is_number(sound_vol_string):
                             self._sound_vol = int(float(sound_vol_string))
+        # Metadata of movies no longer on any drive isn't kept.
+        self._durations.retain(movies)
         # Create a playlist with the sorted list of movies.
-        return Playlist(sorted(movies))
+        return Playlist(sorted(movies), sorted_by_target=True)
+
+    def _movie_from_file(self, path):
+        """Create the movie for a file found in the search paths, with the
+        settings given in its filename.
+        """
+        x = os.path.basename(path)
+        repeatsetting = REPEAT_TAG.search(x)
+        if (repeatsetting is not None):
+            repeat = repeatsetting.group(1)
+        else:
+            repeat = 1
+        weightsetting = WEIGHT_TAG.search(x)
+        weight = weightsetting.group(1) if weightsetting is not None else 1
+        basename, extension = os.path.splitext(x)
+        return Movie(path, basename, repeat, weight)
+
+    def _apply_changes(self, changes):
+        """Apply the files added, removed and modified according to the file
+        reader to the playlist in place, without interrupting the movie being
+        played.  Returns false if the playlist has to be rebuilt instead.
+        """
+        paths = changes.added + changes.removed + changes.modified
+        # Playlist, schedule and volume files change more than single movies.
+        if not all(self._scanner.matches(path) for path in paths):
+            return False
+        # Files of a playlist file that were missing may have appeared.
+        if not self._playlist.sorted_by_target and changes.added:
+            return False
+        added = [self._movie_from_file(path) for path in changes.added]
+        self._playlist.update(removed=changes.removed, added=added)
+        if self._playlist.sorted_by_target:
+            # Durations of scanned files were looked up, not given.
+            for path in changes.modified:
+                index = self._playlist.find(path)
+                if index is not None:
+                    self._playlist.movies()[index].duration = None
+        self._timeline = None
+        self._print('Playlist updated in place: {0} added, {1} removed, {2} modified.'.format(
+            len(changes.added), len(changes.removed), len(changes.modified)))
+        return True
 
     def _blank_screen(self):
         """Render a blank screen filled with the background color and optional the background image."""
@@ -280,6 +411,26 @@ class VideoLooper:
             self._screen.blit(self._bgimage[0], (self._bgimage[1], self._bgimage[2]))
         pygame.display.flip()
 
+    def _get_font(self, size):
+        """Return the default font in the given size, loading it on first use."""
+        font = self._fonts.get(size)
+        if font is None:
+            pygame.font.init()
+            font = self._fonts[size] = pygame.font.Font(None, size)
+        return font
+
+    @property
+    def _small_font(self):
+        return self._get_font(50)
+
+    @property
+    def _medium_font(self):
+        return self._get_font(96)
+
+    @property
+    def _big_font(self):
+        return self._get_font(250)
+
     def _render_text(self, message, font=None):
         """Draw the provided message and return as pygame surface of it rendered
         with the configured foreground and background color.
@@ -430,76 +581,115 @@ class VideoLooper:
             subprocess.check_call(cmd)
 
     def _handle_rotary_channel_switcher(self, channel, direction):
+        self._metrics.mark('control')
         if self._running and direction == 'up':
             print(f"going UP to channel: {channel}")
-            self._playlist.seek(1)
-            self._player.stop(3)
-            self._playbackStopped = False
+            self._commands.put(SEEK, 1)
 
         elif self._running and direction == 'down':
             print(f"going DOWN to channel: {channel}")
-            self._playlist.seek(-1)
-            self._player.stop(3)
-            self._playbackStopped = False       
+            self._commands.put(SEEK, -1)
 
     def _handle_keyboard_shortcuts(self):
         while self._running:
             event = pygame.event.wait()
             if event.type == pygame.KEYDOWN:
+                self._metrics.mark('control')
                 # If pressed key is ESC quit program
                 if event.key == pygame.K_ESCAPE:
                     self._print("ESC was pressed. quitting...")
                     self.quit()
                 if event.key == pygame.K_k:
                     self._print("k was pressed. skipping...")
-                    self._playlist.seek(1)
-                    self._player.stop(3)
-                    self._playbackStopped = False
+                    self._commands.put(SEEK, 1)
                 if event.key == pygame.K_s:
-                    if self._playbackStopped:
-                        self._print("s was pressed. starting...")
-                        self._playbackStopped = False
-                    else:
-                        self._print("s was pressed. stopping...")
-                        self._playbackStopped = True
-                        self._player.stop(3)
+                    self._print("s was pressed. stopping/starting...")
+                    self._commands.put(TOGGLE_STOP)
                 # space is pause/resume the playing video
                 if event.key == pygame.K_SPACE:
                     self._print("Pause/Resume pressed")
-                    self._player.pause()
+                    self._commands.put(PAUSE)
                 if event.key == pygame.K_p:
                     self._print("p was pressed. shutting down...")
                     self.quit(True)
                 if event.key == pygame.K_b:
                     self._print("b was pressed. jumping back...")
-                    self._playlist.seek(-1)
-                    self._player.stop(3)
-                    self._playbackStopped = False
+                    self._commands.put(SEEK, -1)
                 if event.key == pygame.K_o:
                     self._print("o was pressed. next chapter...")
-                    self._player.sendKey("o")
+                    self._commands.put(SEND_KEY, "o")
                 if event.key == pygame.K_i:
                     self._print("i was pressed. previous chapter...")
-                    self._player.sendKey("i")
+                    self._commands.put(SEND_KEY, "i")
     
+    def _parse_pin_map(self, setting):
+        """Parse the gpio_pin_map setting and check every action, so the
+        GPIO callbacks can't fail on a bad value.
+        """
+        pin_map = json.loads("{"+setting+"}")
+        for pin, action in pin_map.items():
+            int(pin)
+            if isinstance(action, bool) or not isinstance(action, (int, str)) or action == '':
+                raise ValueError('pin {0}: unsupported action {1!r}'.format(pin, action))
+            if isinstance(action, str) and action[0:1] in ("+", "-"):
+                try:
+                    int(action)
+                except ValueError:
+                    raise ValueError('pin {0}: {1!r} is not a number of movies to skip'.format(pin, action))
+        return pin_map
+
     def _handle_gpio_control(self, pin):
         if self._pinMap == None:
             return
         
         action = self._pinMap[str(pin)]
+        self._metrics.mark('control')
 
         self._print(f'pin {pin} triggered: {action}')
         
         if action in ['K_ESCAPE', 'K_k', 'K_s', 'K_SPACE', 'K_p', 'K_b', 'K_o', 'K_i']:
             pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=getattr(pygame, action, None)))
+        elif isinstance(action, str) and action[0:1] in ("+", "-"):
+            self._commands.put(SEEK, int(action))
         else:
-            self._playlist.set_next(action)
-            self._player.stop(3)
-            self._playbackStopped = False
+            self._commands.put(JUMP, action)
+
+    def _handle_commands(self):
+        """Apply the commands queued by the control handlers.  Runs on the
+        main loop only, so the playlist and player are never changed from
+        several threads at once.
+        """
+        for command, argument in self._commands.drain():
+            if command == NAVIGATE:
+                if self._playlist is None or self._playlist.length() == 0:
+                    continue
+                self._navigated = True
+                target, offset = argument
+                if target is not None:
+                    self._playlist.set_next(target)
+                if offset != 0:
+                    self._playlist.seek(offset)
+                self._player.stop(3)
+                self._playbackStopped = False
+            elif command == TOGGLE_STOP:
+                if self._playbackStopped:
+                    self._print("starting playback")
+                    self._playbackStopped = False
+                else:
+                    self._print("stopping playback")
+                    self._playbackStopped = True
+                    self._player.stop(3)
+            elif command == PAUSE:
+                self._player.pause()
+                self._toggle_pause_position()
+            elif command == SEND_KEY:
+                self._player.sendKey(argument)
     
     def _gpio_setup(self):
         if self._pinMap == None:
             return
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
         GPIO.setmode(GPIO.BOARD)
         for pin in self._pinMap:
             GPIO.setup(int(pin), GPIO.IN, pull_up_down=GPIO.PUD_UP)
@@ -507,29 +697,129 @@ class VideoLooper:
             self._print("pin {} action set to: {}".format(pin, self._pinMap[pin]))
 
         
+    def _reset_timeline(self):
+        """Forget the live timeline of the previous playlist."""
+        self._timeline = None
+        self._live_position = None
+        self._navigated = False
+
+    def _load_schedule(self):
+        """Load the configured schedule file (it may be on a USB drive) and
+        find the active block.
+        """
+        self._schedule = None
+        self._block = None
+        self._prepared_block = None
+        self._reset_timeline()
+        if not self._schedule_path:
+            return
+        path = self._resolve_path(self._schedule_path)
+        if path is None:
+            self._print('Schedule {0} not found, playing the default playlist.'.format(self._schedule_path))
+            return
+        try:
+            self._schedule = load_schedule(path)
+        except (OSError, ValueError) as err:
+            self._print('Ignoring schedule: {0}'.format(err))
+            return
+        self._print('Loaded schedule {0} with {1} blocks.'.format(path, len(self._schedule)))
+        self._update_schedule()
+
+    def _update_schedule(self, at_deadline=False):
+        """Look up the active schedule block and set the monotonic deadlines
+        for the next switch.  Returns true if the active block changed.
+        """
+        when = datetime.now()
+        skew = 0
+        block, seconds_left, self._next_block = self._schedule.lookup(when)
+        if at_deadline and seconds_left < 1:
+            # The wall clock is a little behind the monotonic deadline, use
+            # the block starting right now.
+            skew = seconds_left
+            block, seconds_left, self._next_block = self._schedule.lookup(when + timedelta(seconds=skew))
+        now = time.monotonic()
+        self._block_deadline = now + skew + seconds_left
+        self._schedule_check_at = now + min(skew + seconds_left, SCHEDULE_RECHECK_INTERVAL)
+        if block == self._block:
+            return False
+        self._block = block
+        return True
+
+    def _schedule_prepare_at(self):
+        """Return when to build the playlist of the next schedule block, or
+        None if there is nothing to prepare.
+        """
+        if self._schedule is None or self._prepared_block is not None or self._next_block == self._block:
+            return None
+        return self._block_deadline - self._schedule_prepare_time
+
+    def _schedule_due(self):
+        """Return true if the main loop has to switch to another schedule
+        block now.  Builds the next block's playlist ahead of time so the
+        switch itself only has to start the player.
+        """
+        if self._schedule is None:
+            return False
+        now = time.monotonic()
+        prepare_at = self._schedule_prepare_at()
+        if prepare_at is not None and now >= prepare_at:
+            self._print('Preparing playlist for the next schedule block.')
+            self._prepared_block = (self._next_block, self._build_playlist(self._block_playlist_path(self._next_block)))
+        if now < self._schedule_check_at:
+            return False
+        return self._update_schedule(at_deadline=now >= self._block_deadline)
+
+    def _switch_schedule_block(self):
+        """Replace the playlist with the one of the now active block."""
+        self._print('Switching to schedule block {0}.'.format(self._block_playlist_path(self._block) or 'all files'))
+        if self._prepared_block is not None and self._prepared_block[0] == self._block:
+            self._playlist = self._prepared_block[1]
+        else:
+            self._playlist = self._build_playlist()
+        self._prepared_block = None
+        self._reset_timeline()
+        if self._playlist.length() == 0:
+            self._idle_message()
+
     def run(self):
         """Main program loop.  Will never return!"""
         # Get playlist of movies to play from file reader.
+        self._load_schedule()
         self._playlist = self._build_playlist()
+        self._restore_resume_point()
+        self._startup.phase('playlist')
         self._prepare_to_run_playlist(self._playlist)
         self._set_hardware_volume()
-        movie = self._playlist.get_next(self._is_random, self._resume_playlist)
+        self._startup.phase('countdown')
+        movie = self._get_next_movie()
         # Main loop to play videos in the playlist and listen for file changes.
 
         # Start rotary encoder channel switcher thread after our playlist has been created
-        self._channel_switcher_thread.start()
+        if self._channel_switcher_thread is not None:
+            self._channel_switcher_thread.start()
+        self._metrics.start()
 
         while self._running:
+            # Apply queued keyboard, GPIO and rotary commands.
+            self._handle_commands()
+            # Switch to the next schedule block right at its start, even in
+            # the middle of a movie.
+            if self._schedule_due():
+                self._player.stop(3)
+                self._switch_schedule_block()
+                movie = self._get_next_movie()
             # Load and play a new movie if nothing is playing.
             if not self._player.is_playing() and not self._playbackStopped:
+                self._metrics.mark('dark')
                 if movie is not None: #just to avoid errors
 
-                    if movie.playcount >= movie.repeats:
+                    # On a live playlist the timeline decides what plays next.
+                    if movie.playcount >= movie.repeats or self._live_mode == 'playlist':
                         movie.clear_playcount()
-                        movie = self._playlist.get_next(self._is_random, self._resume_playlist)
+                        movie = self._get_next_movie()
                     elif self._player.can_loop_count() and movie.playcount > 0:
                         movie.clear_playcount()
-                        movie = self._playlist.get_next(self._is_random, self._resume_playlist)
+                        movie = self._get_next_movie()
 
                     # Commented this out so the video restarts after finishing
                     # movie.was_played()
@@ -556,33 +846,305 @@ class VideoLooper:
                     # Start playing the first available movie.
                     self._print('Playing movie: {0} {1}'.format(movie, infotext))
                     # todo: maybe clear screen to black so that background (image/color) is not visible for videos with a resolution that is < screen resolution
-                    self._player.play(movie, loop=-1 if self._playlist.length()==1 else None, vol = self._sound_vol)
+                    self._metrics.mark('play')
+                    self._start_playback(movie)
+                    self._preroll_upcoming(movie)
+                    self._prefetch_upcoming()
 
             # Check for changes in the file search path (like USB drives added)
-            # and rebuild the playlist.
+            # and update or rebuild the playlist.
             if self._reader.is_changed() and not self._playbackStopped:
-                self._print("reader changed, stopping player")
-                self._player.stop(3)  # Up to 3 second delay waiting for old 
-                                      # player to stop.
-                self._print("player stopped")
-                # Rebuild playlist and show countdown again (if OSD enabled).
-                self._playlist = self._build_playlist()
-                #refresh background image
-                if self._copyloader:
-                    self._bgimage = self._load_bgimage()
-                self._prepare_to_run_playlist(self._playlist)
-                self._set_hardware_volume()
-                movie = self._playlist.get_next(self._is_random, self._resume_playlist)
-
-            # Give the CPU some time to do other tasks. low values increase "responsiveness to changes" and reduce the pause between files
-            # but increase CPU usage
-            # since keyboard commands are handled in a seperate thread this sleeptime mostly influences the pause between files
-                        
-            time.sleep(0.002)
+                movie = self._reader_changed(movie)
+
+            # Don't let the saved position run on while nothing plays.
+            if not self._player.is_playing():
+                self._freeze_position()
+
+            # Sleep until the player finishes, the file reader reports
+            # activity or a control input wakes us up.
+            self._wait_for_events()
 
         self._print("run ended")
+        self._durations.save()
+        self._state.close()
+        self._metrics.stop()
+        self._events.close()
         pygame.quit()
 
+    def _reader_changed(self, movie):
+        """Bring the playlist up to date with the file reader.  Returns the
+        movie the main loop continues with.
+        """
+        changes = self._reader.changes() if hasattr(self._reader, 'changes') else None
+        if changes is not None and self._apply_changes(changes):
+            if movie is None or movie.target in changes.removed:
+                # Nothing was playing or the current movie is gone, continue
+                # with the one after it.
+                self._player.stop(3)
+                movie = self._get_next_movie()
+                # Start it right away instead of waiting for the next event.
+                self._events.wake()
+            elif self._player.is_playing():
+                self._preroll_upcoming(movie)
+                self._prefetch_upcoming()
+            if self._playlist.length() == 0:
+                self._idle_message()
+            return movie
+        self._print("reader changed, stopping player")
+        self._player.stop(3)  # Up to 3 second delay waiting for old 
+                              # player to stop.
+        self._print("player stopped")
+        # Rebuild playlist and show countdown again (if OSD enabled).  Parsed
+        # playlists of removed drives are of no use anymore.
+        clear_playlist_cache()
+        self._load_schedule()
+        self._playlist = self._build_playlist()
+        self._restore_resume_point()
+        #refresh background image
+        if self._copyloader:
+            self._bgimage = self._load_bgimage()
+        self._prepare_to_run_playlist(self._playlist)
+        self._set_hardware_volume()
+        return self._get_next_movie()
+
+    def _get_next_movie(self):
+        """Advance the playlist and return the movie to play."""
+        if self._live_mode == 'playlist' and not self._navigated:
+            self._follow_timeline()
+        self._navigated = False
+        movie = self._playlist.get_next(self._is_random, self._resume_playlist)
+        self._metrics.mark('next')
+        if self._is_random:
+            self._state.set('shuffle', self._playlist.shuffle_state())
+        if self._resume_playlist and movie is not None:
+            self._state.set('playlist', {'index': self._playlist.get_index(),
+                                         'target': movie.target,
+                                         'playcount': movie.playcount})
+        return movie
+
+    def _follow_timeline(self):
+        """Point the playlist at the movie the live timeline is on right now
+        and remember how far into it playback has to start.
+        """
+        if self._timeline is None or self._timeline[0] is not self._playlist:
+            durations = [self._durations(movie) or 0 for movie in self._playlist.movies()]
+            unknown = durations.count(0)
+            if unknown:
+                self._print('Skipping {0} movie{1} of unknown duration on the live timeline.'.format(unknown, 's' if unknown > 1 else ''))
+            self._timeline = (self._playlist, Timeline(durations, self._live_epoch))
+            self._durations.save()
+        located = self._timeline[1].locate()
+        if located is None:
+            self._live_position = None
+            return
+        index, offset = located
+        self._playlist.set_next(index)
+        self._live_position = (self._playlist.movies()[index].target, offset)
+
+    def _start_playback(self, movie):
+        """Start playing movie at its position on the live timeline or at the
+        saved position if it is resumed.
+        """
+        kwargs = {}
+        if self._live_mode == 'playlist':
+            if self._live_position is not None and self._live_position[0] == movie.target:
+                kwargs['position'] = self._live_position[1]
+        elif self._live_mode == 'movie':
+            # Every movie is its own channel looping since the epoch.
+            duration = self._durations(movie)
+            self._durations.save()
+            if duration:
+                kwargs['position'] = Timeline([duration], self._live_epoch).locate()[1]
+        # The live position wins, the saved one is used where there is none
+        # (live_mode off or a movie of unknown duration).
+        if 'position' not in kwargs and self._resume_position is not None \
+                and self._resume_position[0] == movie.target:
+            kwargs['position'] = self._resume_position[1]
+            self._print('Resuming at {0:.0f} seconds'.format(kwargs['position']))
+        self._resume_position = None
+        self._live_position = None
+        self._player.play(self._playable(movie), loop=-1 if self._playlist.length()==1 else None,
+                          vol = self._sound_vol, **kwargs)
+        if hasattr(self._reader, 'stats'):
+            for name, value in self._reader.stats().items():
+                self._metrics.set(name, value)
+        self._playing_movie = movie
+        self._play_started = time.monotonic()
+        self._play_offset = kwargs.get('position', 0)
+        self._frozen_position = None
+        self._paused_at = None
+        self._paused_for = 0
+
+    def _current_position(self):
+        """Return how many seconds into the current movie playback is, not
+        counting the time spent paused.
+        """
+        get_position = getattr(self._player, 'get_position', None)
+        if get_position is not None:
+            seconds = get_position()
+        else:
+            seconds = self._play_offset + time.monotonic() - self._play_started
+        return seconds - self._paused_for
+
+    def _freeze_position(self):
+        """Keep reporting the current position until the next movie starts,
+        called when the player stopped.
+        """
+        if self._playing_movie is not None and self._frozen_position is None:
+            self._frozen_position = self._current_position()
+
+    def _toggle_pause_position(self):
+        """Stop or continue advancing the position with the player's pause
+        toggle.
+        """
+        if self._playing_movie is None or not self._player.is_playing():
+            return
+        now = time.monotonic()
+        if self._paused_at is None:
+            self._frozen_position = self._current_position()
+            self._paused_at = now
+        else:
+            self._paused_for += now - self._paused_at
+            self._paused_at = None
+            self._frozen_position = None
+
+    def _playback_position(self):
+        """Return the target and position of the movie being played for the
+        state store, so resume after a restart or power loss is exact.
+        """
+        movie = self._playing_movie
+        if movie is None:
+            return None
+        seconds = self._frozen_position
+        if seconds is None:
+            seconds = self._current_position()
+        return {'target': movie.target, 'seconds': round(seconds, 1)}
+
+    def _restore_resume_point(self):
+        """Make a freshly built playlist continue where playback was before
+        the last restart.
+        """
+        self._resume_position = None
+        if self._is_random and self._state.get('shuffle'):
+            self._playlist.restore_shuffle(self._state.get('shuffle'))
+        if not self._resume_playlist or self._playlist.length() == 0:
+            return
+        saved = self._state.get('playlist')
+        if not saved:
+            return
+        index = self._playlist.find(saved.get('target'))
+        if index is None:
+            index = saved.get('index', 0)
+            if not isinstance(index, int) or not 0 <= index < self._playlist.length():
+                return
+        self._playlist.resume_from(index)
+        playcount = saved.get('playcount')
+        if isinstance(playcount, int) and playcount > 0:
+            # So repeats continue instead of starting over.
+            self._playlist.movies()[index].playcount = playcount
+        position = self._state.get('position')
+        if position and position.get('target') == saved.get('target'):
+            self._resume_position = (position['target'], position['seconds'])
+
+    def _migrate_legacy_state(self):
+        """Import the resume point older versions wrote to the working
+        directory.
+        """
+        if self._state.get('playlist') is not None or not os.path.isfile('playlist_index.txt'):
+            return
+        try:
+            with open('playlist_index.txt', 'r') as f:
+                self._state.set('playlist', {'index': int(f.read())})
+        except (OSError, ValueError):
+            pass
+
+    def _preroll_upcoming(self, movie):
+        """Tell a player that supports pre-rolling which movies will most
+        likely play after movie, following the same rules as the main loop.
+        """
+        depth = getattr(self._player, 'standby_players', 0)
+        # Nothing to do if the player loops a single movie by itself or
+        # something is shown on screen in between.
+        if depth <= 0 or self._playlist.length() == 1 \
+                or self._one_shot_playback or self._wait_time > 0:
+            return
+        upcoming = []
+        ahead = self._playlist.peek(depth, self._is_random)
+        live = self._live_mode == 'playlist'
+        advance = movie.playcount >= movie.repeats or live
+        while len(upcoming) < depth:
+            if advance:
+                if not ahead:
+                    break
+                movie = ahead.pop(0)
+                advance = movie.repeats <= 0 or live
+            upcoming.append(movie)
+        self._player.preroll([self._playable(movie, record=False) for movie in upcoming], vol=self._sound_vol)
+
+    def _playable(self, movie, record=True):
+        """Return movie, or a copy of it pointing at the file the reader
+        wants it played from.  record tells the reader it is about to be
+        played rather than pre-rolled.
+        """
+        resolve = getattr(self._reader, 'resolve', None)
+        if resolve is None:
+            return movie
+        target = resolve(movie.target, record)
+        if target == movie.target:
+            return movie
+        return Movie(target, movie.title, movie.repeats, movie.weight, movie.duration, movie.attributes)
+
+    def _prefetch_upcoming(self):
+        """Tell a reader that caches movies which ones come next."""
+        depth = getattr(self._reader, 'prefetch_depth', 0)
+        if depth <= 0:
+            return
+        self._reader.prefetch([movie.target for movie in self._playlist.peek(depth, self._is_random)])
+
+    def _report_startup(self):
+        """Log how long it took from process start to the first frame."""
+        self._startup.phase('first_frame')
+        self._print(str(self._startup))
+        self._startup.export(self._metrics)
+        self._startup = None
+
+    def _wait_for_events(self):
+        """Block until the player or the file reader needs attention, a
+        control input calls wake() or a signal arrives.
+        """
+        if self._startup is not None and self._player.is_playing():
+            self._report_startup()
+        sources = [self._reader]
+        # Only wait on the player while it is playing, a finished player's
+        # fd would stay readable forever.  Also after a one shot movie, so
+        # its end freezes the saved position.
+        if self._player.is_playing():
+            sources.append(self._player)
+        fds = []
+        # Held back seeks and jumps, see ControlQueue.drain.
+        timeout = self._commands.poll_timeout()
+        for source in sources:
+            fileno = getattr(source, 'fileno', None)
+            poll_timeout = getattr(source, 'poll_timeout', None)
+            if fileno is None and poll_timeout is None:
+                source_timeout = LEGACY_POLL_INTERVAL
+            else:
+                if fileno is not None:
+                    fds.append(fileno())
+                source_timeout = poll_timeout() if poll_timeout is not None else None
+            if source_timeout is not None and (timeout is None or source_timeout < timeout):
+                timeout = source_timeout
+        # Wake up exactly at the next schedule deadline.
+        if self._schedule is not None:
+            deadline = self._schedule_check_at
+            prepare_at = self._schedule_prepare_at()
+            if prepare_at is not None:
+                deadline = min(deadline, prepare_at)
+            schedule_timeout = max(0, deadline - time.monotonic())
+            if timeout is None or schedule_timeout < timeout:
+                timeout = schedule_timeout
+        self._events.wait(fds, timeout)
+
     def quit(self, shutdown=False):
         """Shut down the program"""
         self._print("quitting Video Looper")
@@ -593,12 +1155,13 @@ class VideoLooper:
         self._playbackStopped = True
         self._running = False
         pygame.event.post(pygame.event.Event(pygame.QUIT))
+        self._events.wake()
 
         if self._player is not None:
             self._player.stop()
 
-        if self._pinMap:
-            GPIO.cleanup()
+        if self._gpio is not None:
+            self._gpio.cleanup()
 
 
     def signal_quit(self, signal, frame):
@@ -0,0 +1,282 @@
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import stat
+from time import monotonic
+
+from .inotify import (watch_directory, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE,
+                      IN_DELETE_SELF, IN_ISDIR, IN_MOVE_SELF, IN_MOVED_FROM,
+                      IN_MOVED_TO, IN_Q_OVERFLOW)
+
+WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO \
+             | IN_DELETE_SELF | IN_MOVE_SELF
+
+# How often the directory is listed when inotify isn't available.
+POLL_INTERVAL = 1.0
+
+
+class Changes:
+    """Paths added, removed and modified since the previous report."""
+
+    __slots__ = ('added', 'removed', 'modified')
+
+    def __init__(self, added=(), removed=(), modified=()):
+        self.added = sorted(added)
+        self.removed = sorted(removed)
+        self.modified = sorted(modified)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.modified)
+
+    def __repr__(self):
+        return 'Changes(added={0!r}, removed={1!r}, modified={2!r})'.format(self.added, self.removed, self.modified)
+
+
+def _stat_key(path):
+    """Return what identifies a version of the file at path, or None if it
+    isn't a regular file (anymore).
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class DirectoryWatcher:
+    """Tracks the files in a directory (optionally with its subdirectories)
+    and reports which were added, removed or modified.
+
+    With inotify only the paths named in events are looked at again, so the
+    cost follows the number of changes instead of the number of files.  A file
+    counts as changed only once it is complete: created files are held back
+    until they are closed after writing or moved in, or their size and mtime
+    stayed the same for the debounce time (a killed writer, a hard link
+    never send IN_CLOSE_WRITE).  Changes are reported
+    after the directory has been quiet for the debounce time, so copying a
+    batch of files is reported once.  Hidden files are ignored, which also
+    hides the temporary files of tools like rsync until they are renamed.
+
+    Without inotify (or after the event queue overflowed) the directory is
+    listed and compared with the known files instead.
+    """
+
+    def __init__(self, path, recursive=False, debounce=1.0):
+        self._path = path
+        self._recursive = recursive
+        self._debounce = debounce
+        self._pending = set()
+        # Path -> (deadline, stat key) of created files not closed yet.
+        self._writing = {}
+        self._rescan = False
+        self._settle_at = None
+        self._watch = None
+        self._files = self._list_files()
+        self._start_watch()
+
+    def _start_watch(self):
+        self._watch = watch_directory(self._path, WATCH_MASK)
+        if self._watch is None or not self._recursive:
+            return
+        for directory in self._list_directories(self._path):
+            try:
+                self._watch.add(directory)
+            except OSError:
+                # Probably the watch limit, fall back to listing.
+                self._watch.close()
+                self._watch = None
+                return
+
+    def _list_directories(self, path):
+        directories = []
+        pending = [path]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        if entry.name[0:1] != '.' and entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.path)
+                            pending.append(entry.path)
+            except OSError:
+                continue
+        return directories
+
+    def _list_files(self, path=None):
+        """Return a dict of all files below path (default: the watched
+        directory) with their stat key.
+        """
+        files = {}
+        pending = [path or self._path]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        if entry.name[0:1] == '.':
+                            continue
+                        try:
+                            if entry.is_file():
+                                st = entry.stat()
+                                files[entry.path] = (st.st_ino, st.st_size, st.st_mtime_ns)
+                            elif self._recursive and entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return files
+
+    def fileno(self):
+        """Return the inotify file descriptor, None if the directory is polled."""
+        return self._watch.fileno() if self._watch is not None else None
+
+    def poll_timeout(self):
+        """Return the seconds until pending changes settle or the directory has
+        to be listed again, None if only inotify events matter.
+        """
+        deadlines = [deadline for deadline, _ in self._writing.values()]
+        if self._settle_at is not None:
+            deadlines.append(self._settle_at)
+        elif self._watch is None:
+            return POLL_INTERVAL
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - monotonic())
+
+    def _handle(self, events, now):
+        for directory, name, mask in events:
+            if mask & IN_Q_OVERFLOW:
+                self._rescan = True
+                continue
+            if directory is None:
+                continue
+            if not name:
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and directory == self._path:
+                    # The directory itself is gone, keep looking for it.
+                    self._watch.close()
+                    self._watch = None
+                    self._rescan = True
+                    return
+                continue
+            if name[0] == '.':
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if not self._recursive:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files in a directory moved in don't cause events.
+                    for subdirectory in [path] + self._list_directories(path):
+                        try:
+                            self._watch.add(subdirectory)
+                        except OSError:
+                            self._rescan = True
+                    self._pending.update(self._list_files(path))
+                else:
+                    prefix = path + os.sep
+                    self._pending.update(known for known in self._files if known.startswith(prefix))
+                continue
+            if mask & IN_CREATE and self._being_written(path):
+                self._writing[path] = (now + self._debounce, _stat_key(path))
+            else:
+                # Closed after writing, moved in or out, deleted, or created
+                # complete (links, special files).
+                self._writing.pop(path, None)
+                self._pending.add(path)
+
+    @staticmethod
+    def _being_written(path):
+        """Return true if the file just created at path is probably still
+        being written, so not a symlink or a hard link to an existing file.
+        """
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return False
+        return stat.S_ISREG(st.st_mode) and st.st_nlink == 1
+
+    def _expire_writing(self, now):
+        """Stop waiting for created files that didn't change for the
+        debounce time.  Returns true if any did.
+        """
+        expired = False
+        for path, (deadline, key) in list(self._writing.items()):
+            if deadline > now:
+                continue
+            current = _stat_key(path)
+            if current == key:
+                del self._writing[path]
+                self._pending.add(path)
+                expired = True
+            else:
+                # Still growing.
+                self._writing[path] = (now + self._debounce, current)
+        return expired
+
+    def _collect(self):
+        """Compare the pending paths with the known files."""
+        added = []
+        removed = []
+        modified = []
+        if self._rescan:
+            current = self._list_files()
+            paths = set(current).union(self._files)
+        else:
+            current = None
+            paths = self._pending.difference(self._writing)
+        for path in paths:
+            key = current.get(path) if current is not None else _stat_key(path)
+            known = self._files.get(path)
+            if key is None:
+                if known is not None:
+                    removed.append(path)
+                    del self._files[path]
+            elif known is None:
+                added.append(path)
+                self._files[path] = key
+            elif known != key:
+                modified.append(path)
+                self._files[path] = key
+        if self._rescan:
+            self._pending.clear()
+            self._writing.clear()
+            self._rescan = False
+        else:
+            self._pending.intersection_update(self._writing)
+        return Changes(added, removed, modified)
+
+    def poll(self):
+        """Process what happened since the last call.  Returns the Changes
+        once they settled, None otherwise.
+        """
+        now = monotonic()
+        if self._watch is not None:
+            events = self._watch.read_events()
+            if events:
+                self._handle(events, now)
+                self._settle_at = now + self._debounce
+        elif self._settle_at is None:
+            # Polling: list the directory every POLL_INTERVAL seconds.
+            self._rescan = True
+            self._settle_at = now + POLL_INTERVAL
+            if os.path.isdir(self._path):
+                self._start_watch()
+        if self._writing and self._expire_writing(now) and self._settle_at is None:
+            self._settle_at = now
+        if self._settle_at is None or now < self._settle_at:
+            return None
+        self._settle_at = None
+        changes = self._collect()
+        return changes or None
+
+    def files(self):
+        """Return the paths of all known files."""
+        return list(self._files)
+
+    def close(self):
+        if self._watch is not None:
+            self._watch.close()
+            self._watch = None
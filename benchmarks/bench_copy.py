@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# License: GNU GPLv2, see LICENSE.txt
+"""Measure copy mode throughput: the old 16 KiB read/write loop that redrew
+the progress bar after every chunk against the copy engine with a rate
+limited progress bar, on a set of generated movie files.
+
+The progress bar is drawn with pygame's dummy video driver, so the numbers
+include the drawing cost but not the cost of pushing pixels to a real
+display, which makes the old implementation look better than it is on a Pi.
+Point --directory at the USB drive and --target at the SD card to measure
+real hardware, and drop the page cache in between runs for cold numbers.
+
+Example:
+    python3 benchmarks/bench_copy.py --files 8 --size-mb 256
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from Adafruit_Video_Looper.copier import Copier, Progress, format_eta, format_rate
+
+
+class ProgressBar:
+    """The drawing done by USBDriveReaderCopy._draw_copy_progress."""
+
+    def __init__(self):
+        pygame.display.init()
+        pygame.font.init()
+        self.screen = pygame.display.set_mode((1280, 720))
+        self.font = pygame.font.Font(None, 40)
+        self.rect = pygame.Rect(128, 342, 1024, 36)
+        self.draws = 0
+
+    def draw(self, copied, total, rate=None, eta=None):
+        self.draws += 1
+        perc = 100 * copied / total if total else 100.
+        pygame.draw.rect(self.screen, (255, 255, 255), self.rect, 2)
+        pygame.draw.rect(self.screen, (149, 193, 26), pygame.Rect(130, 344, 1020 * perc / 100, 32))
+        label = self.font.render(str(int(round(perc))) + "%", True, (52, 52, 52), (149, 193, 26))
+        self.screen.blit(label, (640 - label.get_width() / 2, 350))
+        if rate:
+            stats = format_rate(rate) + (", " + format_eta(eta) + " left" if eta is not None else "")
+            self.screen.blit(self.font.render(stats, True, (255, 255, 255), (52, 52, 52)), (500, 390))
+        pygame.display.update(self.rect)
+
+
+def old_copy(src, dst, bar, length=16 * 1024):
+    size = os.stat(src).st_size
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        copied = 0
+        while True:
+            buf = fsrc.read(length)
+            if not buf:
+                break
+            fdst.write(buf)
+            copied += len(buf)
+            bar.draw(copied, size)
+
+
+def new_copy(copier, src, dst, bar):
+    progress = Progress(os.stat(src).st_size, bar.draw, 10)
+    copier.copy(src, dst, progress=progress.update)
+
+
+def run(name, copy, sources, target, bar):
+    bar.draws = 0
+    os.makedirs(target, exist_ok=True)
+    start = time.perf_counter()
+    for src in sources:
+        dst = os.path.join(target, os.path.basename(src))
+        copy(src, dst)
+        # Include getting the data onto the disk, like a real copy has to.
+        with open(dst, 'rb') as f:
+            os.fsync(f.fileno())
+    elapsed = time.perf_counter() - start
+    total = sum(os.path.getsize(src) for src in sources)
+    shutil.rmtree(target)
+    return {'method': name, 'seconds': round(elapsed, 2), 'mb_per_s': round(total / elapsed / 1e6, 1), 'draws': bar.draws}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=8, help='number of files')
+    parser.add_argument('--size-mb', type=int, default=256, help='size of each file in MB')
+    parser.add_argument('--directory', help='existing directory with the source files (default: generate them)')
+    parser.add_argument('--target', help='directory to copy to (default: a temporary directory)')
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='video_looper_bench_')
+    try:
+        if args.directory:
+            sources = sorted(os.path.join(args.directory, name) for name in os.listdir(args.directory)
+                             if os.path.isfile(os.path.join(args.directory, name)))
+        else:
+            sources = []
+            block = os.urandom(1 << 20)
+            for i in range(args.files):
+                path = os.path.join(work, 'movie{0:03d}.mp4'.format(i))
+                with open(path, 'wb') as f:
+                    for _ in range(args.size_mb):
+                        f.write(block)
+                sources.append(path)
+        target = os.path.join(args.target or work, 'copy')
+        bar = ProgressBar()
+        copier = Copier()
+        buffered = Copier()
+        # Force the buffered path, e.g. when hashing on the way.
+        buffered._copy_file_range = buffered._sendfile = False
+        results = [
+            run('old 16 KiB + draw per chunk', lambda src, dst: old_copy(src, dst, bar), sources, target, bar),
+            run('engine buffered', lambda src, dst: new_copy(buffered, src, dst, bar), sources, target, bar),
+            run('engine kernel', lambda src, dst: new_copy(copier, src, dst, bar), sources, target, bar),
+        ]
+        print(json.dumps({'files': len(sources),
+                          'total_mb': round(sum(os.path.getsize(src) for src in sources) / 1e6),
+                          'results': results}, indent=2))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
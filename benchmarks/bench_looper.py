@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# License: GNU GPLv2, see LICENSE.txt
+"""Run the video looper headless against a large simulated playlist and
+report loop overhead, transition throughput and control latency.
+
+Example:
+    python3 benchmarks/bench_looper.py --items 10000 --duration 10
+"""
+import argparse
+import configparser
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Adafruit_Video_Looper import simulation
+simulation.install()
+
+import pygame
+from Adafruit_Video_Looper.video_looper import VideoLooper
+
+ASSETS_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'video_looper.ini')
+
+
+def write_config(args):
+    config = configparser.ConfigParser()
+    config.read(ASSETS_INI)
+    config.set('video_looper', 'video_player', 'simulation')
+    config.set('video_looper', 'file_reader', 'simulation')
+    config.set('video_looper', 'osd', 'false')
+    config.set('video_looper', 'countdown_time', '0')
+    config.set('video_looper', 'wait_time', '0')
+    config.set('video_looper', 'console_output', 'false')
+    config.set('video_looper', 'state_dir', tempfile.mkdtemp(prefix='video_looper_state_'))
+    config.set('control', 'keyboard_control', 'true')
+    config.set('playlist', 'path', '')
+    config['simulation'] = {
+        'extensions': 'mp4',
+        'file_count': str(args.items),
+        'startup_time': str(args.startup),
+        'duration': str(args.clip),
+        'exit_time': str(args.exit),
+        'change_interval': str(args.change_interval),
+    }
+    fd, path = tempfile.mkstemp(suffix='.ini')
+    with os.fdopen(fd, 'w') as f:
+        config.write(f)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=10000, help='number of movies in the playlist')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run the looper')
+    parser.add_argument('--clip', type=float, default=0.1, help='seconds each simulated movie plays')
+    parser.add_argument('--startup', type=float, default=0.02, help='simulated player startup latency')
+    parser.add_argument('--exit', type=float, default=0.01, help='simulated player exit latency')
+    parser.add_argument('--control-interval', type=float, default=0.5, help='seconds between simulated skip keypresses (0 disables)')
+    parser.add_argument('--change-interval', type=float, default=0, help='seconds between simulated file reader changes (0 disables)')
+    args = parser.parse_args()
+
+    config_path = write_config(args)
+    start = time.monotonic()
+    looper = VideoLooper(config_path)
+    init_time = time.monotonic() - start
+
+    # Count how often the main loop wakes up.
+    wakeups = [0]
+    wait = looper._events.wait
+
+    def counting_wait(*wait_args, **wait_kwargs):
+        wakeups[0] += 1
+        return wait(*wait_args, **wait_kwargs)
+    looper._events.wait = counting_wait
+
+    def controller():
+        deadline = time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            time.sleep(args.control_interval if args.control_interval > 0 else deadline - time.monotonic())
+            if args.control_interval > 0:
+                pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_k))
+        looper.quit()
+
+    threading.Thread(target=controller, daemon=True).start()
+    cpu_start = time.process_time()
+    start = time.monotonic()
+    looper.run()
+    wall = time.monotonic() - start
+    cpu = time.process_time() - cpu_start
+    os.remove(config_path)
+
+    report = {
+        'items': args.items,
+        'init_seconds': round(init_time, 4),
+        'wall_seconds': round(wall, 3),
+        'cpu_seconds': round(cpu, 3),
+        'cpu_percent': round(100 * cpu / wall, 2),
+        'loop_wakeups': wakeups[0],
+        'transitions': looper._player.play_count,
+        'transitions_per_second': round(looper._player.play_count / wall, 2),
+        'stages': looper._metrics.summary(),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
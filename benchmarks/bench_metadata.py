@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# License: GNU GPLv2, see LICENSE.txt
+"""Measure probing a drive full of videos with an empty and with a warm
+metadata cache.  Generates minimal MP4 and MKV files with the given amount of
+media data so the prober has to seek past it.
+
+Example:
+    python3 benchmarks/bench_metadata.py --files 2000
+"""
+import argparse
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Adafruit_Video_Looper.metadata import MetadataCache
+
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def make_mp4(path, duration, width, height, media_size, moov_at_end):
+    timescale = 1000
+    mvhd = box(b'mvhd', bytes(12) + struct.pack('>II', timescale, int(duration * timescale)) + bytes(80))
+    tkhd = box(b'tkhd', bytes(76) + struct.pack('>II', width << 16, height << 16))
+    hdlr = box(b'hdlr', bytes(8) + b'vide' + bytes(13))
+    stsd = box(b'stsd', struct.pack('>II', 0, 1) + box(b'avc1', bytes(78)))
+    trak = box(b'trak', tkhd + box(b'mdia', hdlr + box(b'minf', box(b'stbl', stsd))))
+    moov = box(b'moov', mvhd + trak)
+    ftyp = box(b'ftyp', b'isom' + bytes(4) + b'isomavc1')
+    with open(path, 'wb') as f:
+        f.write(ftyp)
+        if not moov_at_end:
+            f.write(moov)
+        f.write(struct.pack('>I4s', 8 + media_size, b'mdat'))
+        f.truncate(f.tell() + media_size)
+        f.seek(0, os.SEEK_END)
+        if moov_at_end:
+            f.write(moov)
+
+
+def ebml(element, payload):
+    size = len(payload)
+    return element + bytes([0x01]) + size.to_bytes(7, 'big') + payload
+
+
+def make_mkv(path, duration, width, height, media_size):
+    header = ebml(b'\x1a\x45\xdf\xa3', ebml(b'\x42\x82', b'matroska'))
+    info = ebml(b'\x15\x49\xa9\x66', ebml(b'\x2a\xd7\xb1', (1000000).to_bytes(3, 'big'))
+                + ebml(b'\x44\x89', struct.pack('>d', duration * 1000)))
+    video = ebml(b'\xe0', ebml(b'\xb0', width.to_bytes(2, 'big')) + ebml(b'\xba', height.to_bytes(2, 'big')))
+    tracks = ebml(b'\x16\x54\xae\x6b', ebml(b'\xae', ebml(b'\x83', b'\x01') + ebml(b'\x86', b'V_MPEG4/ISO/AVC') + video))
+    cluster = b'\x1f\x43\xb6\x75' + bytes([0x01]) + media_size.to_bytes(7, 'big')
+    segment_size = len(info) + len(tracks) + len(cluster) + media_size
+    with open(path, 'wb') as f:
+        f.write(header + b'\x18\x53\x80\x67' + bytes([0x01]) + segment_size.to_bytes(7, 'big'))
+        f.write(info + tracks + cluster)
+        f.truncate(f.tell() + media_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2000, help='number of video files')
+    parser.add_argument('--media-size', type=int, default=1 << 20, help='bytes of (sparse) media data per file')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='video_looper_bench_')
+    try:
+        paths = []
+        for i in range(args.files):
+            if i % 3 == 2:
+                path = os.path.join(directory, 'movie{0:05d}.mkv'.format(i))
+                make_mkv(path, 60 + i, 1920, 1080, args.media_size)
+            else:
+                path = os.path.join(directory, 'movie{0:05d}.mp4'.format(i))
+                make_mp4(path, 60 + i, 1920, 1080, args.media_size, moov_at_end=i % 3 == 1)
+            paths.append(path)
+        cache_path = os.path.join(directory, 'metadata.json')
+
+        def scan():
+            start = time.perf_counter()
+            cache = MetadataCache(cache_path)
+            infos = [cache.get(path) for path in paths]
+            cache.save()
+            return time.perf_counter() - start, infos
+
+        cold, infos = scan()
+        warm, _ = scan()
+        # Touch a few files, only those are probed again.
+        for path in paths[::100]:
+            os.utime(path, ns=(0, time.time_ns()))
+        changed, _ = scan()
+        report = {
+            'files': args.files,
+            'cold_ms': round(cold * 1000, 1),
+            'warm_ms': round(warm * 1000, 1),
+            'one_percent_changed_ms': round(changed * 1000, 1),
+            'wrong_duration': sum(1 for i, info in enumerate(infos) if info is None or info['duration'] != 60 + i),
+            'sample': infos[:3],
+        }
+        print(json.dumps(report, indent=2))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
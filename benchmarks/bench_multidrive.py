@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# License: GNU GPLv2, see LICENSE.txt
+"""Measure the total copy mode throughput with 1, 2 and 4 drives attached,
+copying the drives one after another (the old behaviour) and with one worker
+per drive.
+
+By default every "drive" is a generated directory on the same disk as the
+target, so the source data comes from the page cache and the numbers show
+the cost of the copy itself rather than the USB bus.  --drive-mb-s emulates
+USB sticks by limiting how fast each drive can be read, which shows how the
+workers overlap slow sources (with --writers below the number of drives the
+target write limit caps it).  Pass the mount points of real drives with
+--drive (once per drive, the first 1, 2 and 4 are used) and point --target at
+the SD card to measure hardware; drop the page cache
+(echo 3 > /proc/sys/vm/drop_caches) between runs for cold numbers.
+
+Example:
+    python3 benchmarks/bench_multidrive.py --files 4 --size-mb 128
+    python3 benchmarks/bench_multidrive.py --files 2 --size-mb 64 --drive-mb-s 30
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Adafruit_Video_Looper.copier import BUFFER_SIZE, Copier, Throttle
+from Adafruit_Video_Looper.sync import SyncManifest, Synchronizer, Tally, update_parallel
+
+
+class SlowDriveCopier(Copier):
+    """A Copier reading at most rate bytes per second, like a USB stick.  One
+    is made per worker, so every drive has its own limit."""
+
+    def __init__(self, rate):
+        super().__init__(kernel_chunk=BUFFER_SIZE)
+        self._throttle = Throttle(rate)
+
+    def copy_data(self, fsrc, fdst, position, size, progress=None, hasher=None):
+        last = [position]
+
+        def throttled(copied):
+            self._throttle.consume(copied - last[0])
+            last[0] = copied
+            if progress is not None:
+                progress(copied)
+        return super().copy_data(fsrc, fdst, position, size, throttled, hasher)
+
+
+def make_drive(path, files, size_mb, block):
+    os.makedirs(path)
+    for i in range(files):
+        with open(os.path.join(path, 'movie{0:03d}.mp4'.format(i)), 'wb') as f:
+            for _ in range(size_mb):
+                f.write(block)
+
+
+def groups_of(drives):
+    """One group of (source path, rel, size, checksum) per drive, file names
+    prefixed with the drive number so they don't collide."""
+    groups = []
+    for number, drive in enumerate(drives):
+        group = []
+        for name in sorted(os.listdir(drive)):
+            path = os.path.join(drive, name)
+            if os.path.isfile(path):
+                group.append((path, '{0}-{1}'.format(number, name), os.path.getsize(path), None))
+        groups.append(group)
+    return groups
+
+
+def run(drives, threads, writers, target, copier_factory):
+    os.makedirs(target)
+    groups = groups_of(drives)
+    synchronizer = Synchronizer(target, SyncManifest(os.path.join(target, '.sync.json'), target))
+    tally = Tally(sum(len(group) for group in groups), sum(size for group in groups for _, _, size, _ in group))
+    start = time.perf_counter()
+    results = update_parallel(synchronizer, groups, threads, writers, tally, copier_factory=copier_factory)
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(target)
+    assert all(result is True for result in results.values()), results
+    return {'drives': len(drives), 'threads': threads, 'seconds': round(elapsed, 2),
+            'total_mb_per_s': round(tally.total / elapsed / 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=4, help='number of files per generated drive')
+    parser.add_argument('--size-mb', type=int, default=128, help='size of each generated file in MB')
+    parser.add_argument('--drive', action='append', default=[], help='mount point of a real drive (repeatable)')
+    parser.add_argument('--target', help='directory to copy to (default: a temporary directory)')
+    parser.add_argument('--writers', type=int, default=2, help='files written to the target at once')
+    parser.add_argument('--drive-mb-s', type=float, default=0, help='emulated read speed of every drive in MB/s')
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='video_looper_bench_')
+    try:
+        drives = list(args.drive)
+        if not drives:
+            block = os.urandom(1 << 20)
+            for number in range(4):
+                drives.append(os.path.join(work, 'usbdrive{0}'.format(number)))
+                make_drive(drives[-1], args.files, args.size_mb, block)
+        target = os.path.join(args.target or work, 'copy')
+        if args.drive_mb_s:
+            copier_factory = lambda: SlowDriveCopier(args.drive_mb_s * 1e6)
+        else:
+            copier_factory = Copier
+        results = []
+        for count in (1, 2, 4):
+            if count > len(drives):
+                break
+            results.append(run(drives[:count], 1, args.writers, target, copier_factory))
+            if count > 1:
+                results.append(run(drives[:count], count, args.writers, target, copier_factory))
+        print(json.dumps({'files_per_drive': args.files, 'writers': args.writers,
+                          'drive_mb_per_s': args.drive_mb_s or None, 'results': results}, indent=2))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# License: GNU GPLv2, see LICENSE.txt
+"""Measure memory per playlist entry and the cost of jumps, seeks and
+playcount resets on a large playlist.
+
+Example:
+    python3 benchmarks/bench_playlist.py --items 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Adafruit_Video_Looper.model import Movie, Playlist
+
+
+def timed(operation, rounds):
+    """Return the mean microseconds per call of operation."""
+    start = time.perf_counter()
+    for i in range(rounds):
+        operation(i)
+    return round(1e6 * (time.perf_counter() - start) / rounds, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=100000, help='number of movies in the playlist')
+    parser.add_argument('--rounds', type=int, default=10000, help='operations timed per measurement')
+    args = parser.parse_args()
+
+    paths = ['/media/usb{0}/archive/movie{1:06d}.mp4'.format(i % 4, i) for i in range(args.items)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    movies = sorted(Movie(path, None, 1) for path in paths)
+    playlist = Playlist(movies)
+    build = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    playlist.get_next(False)
+    rng = random.Random(0)
+    picks = [rng.randrange(args.items) for _ in range(args.rounds)]
+
+    report = {
+        'items': args.items,
+        'build_seconds': round(build, 3),
+        'bytes_per_entry': round(memory / args.items, 1),
+        'usec_find_target': timed(lambda i: playlist.find(paths[picks[i]]), args.rounds),
+        'usec_set_next_filename': timed(lambda i: playlist.set_next(movies[picks[i]].filename), args.rounds),
+        'usec_set_next_movie': timed(lambda i: playlist.set_next(movies[picks[i]]), args.rounds),
+        'usec_seek': timed(lambda i: playlist.seek(1 if i % 2 else -1), args.rounds),
+        'usec_get_next': timed(lambda i: playlist.get_next(False), args.rounds),
+        'usec_peek_5': timed(lambda i: playlist.peek(5), args.rounds),
+        'usec_clear_all_playcounts': timed(lambda i: playlist.clear_all_playcounts(), args.rounds),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
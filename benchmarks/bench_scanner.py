@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# License: GNU GPLv2, see LICENSE.txt
+"""Measure finding the movies on several drives: the old listdir and regex
+per file approach against the scandir based scanner, sequential and with one
+thread per drive, flat and recursive.
+
+Example:
+    python3 benchmarks/bench_scanner.py --drives 4 --files 25000
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Adafruit_Video_Looper.scanner import MediaScanner
+
+EXTENSIONS = ['avi', 'mov', 'mkv', 'mp4', 'm4v']
+
+
+def listdir_regex(paths):
+    """What the looper did before: one regex search per file."""
+    extensions = '|'.join(EXTENSIONS)
+    found = []
+    for path in paths:
+        for x in os.listdir(path):
+            if x[0] != '.' and re.search(r'\.({0})$'.format(extensions), x, flags=re.IGNORECASE):
+                found.append(os.path.join(path, x))
+    return found
+
+
+def make_tree(directory, drives, files, subfolders):
+    paths = []
+    for drive in range(drives):
+        path = os.path.join(directory, 'drive{0}'.format(drive))
+        paths.append(path)
+        for folder in range(subfolders + 1):
+            folder_path = path if folder == 0 else os.path.join(path, 'folder{0:03d}'.format(folder))
+            os.makedirs(folder_path, exist_ok=True)
+            for i in range(files // (subfolders + 1)):
+                # Every fourth file isn't a movie.
+                extension = 'txt' if i % 4 == 3 else EXTENSIONS[i % len(EXTENSIONS)]
+                open(os.path.join(folder_path, 'movie{0:06d}.{1}'.format(i, extension)), 'w').close()
+    return paths
+
+
+def timed(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 1), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drives', type=int, default=4, help='number of drives')
+    parser.add_argument('--files', type=int, default=25000, help='files per drive')
+    parser.add_argument('--subfolders', type=int, default=50, help='subfolders per drive for the recursive scan')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best is reported')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='video_looper_bench_')
+    try:
+        flat = make_tree(os.path.join(directory, 'flat'), args.drives, args.files, 0)
+        nested = make_tree(os.path.join(directory, 'nested'), args.drives, args.files, args.subfolders)
+        sequential = MediaScanner(EXTENSIONS, threads=1)
+        threaded = MediaScanner(EXTENSIONS, threads=args.drives)
+        recursive = MediaScanner(EXTENSIONS, recursive=True, threads=args.drives)
+
+        old_ms, old = timed(lambda: listdir_regex(flat), args.repeat)
+        sequential_ms, new = timed(lambda: sequential.scan_all(flat), args.repeat)
+        threaded_ms, _ = timed(lambda: threaded.scan_all(flat), args.repeat)
+        recursive_ms, nested_found = timed(lambda: recursive.scan_all(nested), args.repeat)
+        report = {
+            'drives': args.drives,
+            'files': args.drives * args.files,
+            'listdir_regex_ms': old_ms,
+            'scandir_sequential_ms': sequential_ms,
+            'scandir_threaded_ms': threaded_ms,
+            'scandir_recursive_ms': recursive_ms,
+            'same_result': sorted(old) == sorted(entry.path for entries in new for entry in entries),
+            'recursive_found': sum(len(entries) for entries in nested_found),
+        }
+        print(json.dumps(report, indent=2))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
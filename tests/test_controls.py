@@ -0,0 +1,62 @@
+# License: GNU GPLv2, see LICENSE.txt
+import unittest
+from unittest import mock
+
+from Adafruit_Video_Looper import controls
+from Adafruit_Video_Looper.controls import ControlQueue, JUMP, NAVIGATE, PAUSE, SEEK, SEND_KEY
+
+
+class ControlQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch.object(controls, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_without_delay(self):
+        queue = ControlQueue()
+        queue.put(SEEK, 1)
+        queue.put(SEEK, 1)
+        self.assertEqual(queue.drain(), [(NAVIGATE, (None, 2))])
+        self.assertIsNone(queue.poll_timeout())
+
+    def test_taps_rearm_the_delay(self):
+        queue = ControlQueue(navigate_delay=0.5)
+        queue.put(SEEK, 1)
+        self.assertEqual(queue.drain(), [])
+        self.assertEqual(queue.poll_timeout(), 0.5)
+        self.now += 0.25
+        queue.put(SEEK, 1)
+        self.now += 0.375
+        self.assertEqual(queue.drain(), [])
+        self.assertEqual(queue.poll_timeout(), 0.125)
+        self.now += 0.125
+        self.assertEqual(queue.drain(), [(NAVIGATE, (None, 2))])
+        self.assertIsNone(queue.poll_timeout())
+
+    def test_other_commands_pass_a_held_navigate(self):
+        queue = ControlQueue(navigate_delay=0.5)
+        queue.put(SEEK, 1)
+        self.now += 0.25
+        queue.put(PAUSE)
+        self.assertEqual(queue.drain(), [(PAUSE, None)])
+        self.now += 0.25
+        queue.put(SEEK, 1)
+        queue.put(SEND_KEY, 'o')
+        self.assertEqual(queue.drain(), [(SEND_KEY, 'o')])
+        self.now += 0.5
+        self.assertEqual(queue.drain(), [(NAVIGATE, (None, 2))])
+
+    def test_jump_resets_the_offset(self):
+        queue = ControlQueue()
+        queue.put(SEEK, -1)
+        queue.put(JUMP, 'video.mp4')
+        queue.put(SEEK, 2)
+        queue.put(PAUSE)
+        # The due NAVIGATE comes after the other commands.
+        self.assertEqual(queue.drain(), [(PAUSE, None), (NAVIGATE, ('video.mp4', 2))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# License: GNU GPLv2, see LICENSE.txt
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from Adafruit_Video_Looper import metadata
+from Adafruit_Video_Looper.metadata import MetadataCache
+
+
+class MetadataCacheRetainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.path = os.path.join(self.work, 'metadata.json')
+        self.movies = []
+        for name in ('a.mp4', 'b.mp4'):
+            movie = os.path.join(self.work, name)
+            with open(movie, 'w') as f:
+                f.write(name)
+            self.movies.append(movie)
+        patcher = mock.patch.object(metadata, 'probe', return_value={'duration': 10.0})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def _saved(self):
+        with open(self.path) as f:
+            return sorted(json.load(f))
+
+    def test_entries_of_unscanned_files_are_dropped(self):
+        cache = MetadataCache(self.path)
+        for movie in self.movies:
+            cache.get(movie)
+        cache.save()
+        self.assertEqual(self._saved(), self.movies)
+        cache = MetadataCache(self.path)
+        cache.retain(self.movies[:1])
+        cache.save()
+        self.assertEqual(self._saved(), self.movies[:1])
+
+    def test_nothing_to_drop(self):
+        cache = MetadataCache(self.path)
+        cache.get(self.movies[0])
+        cache.save()
+        os.remove(self.path)
+        cache.retain(self.movies)
+        cache.save()
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# License: GNU GPLv2, see LICENSE.txt
+import random
+import unittest
+
+from Adafruit_Video_Looper.model import Movie, Playlist, ShuffleBag
+
+
+def sorted_playlist(*targets):
+    return Playlist([Movie(target) for target in targets], sorted_by_target=True)
+
+
+def targets(movies):
+    return [movie.target for movie in movies]
+
+
+class PlaylistUpdateTest(unittest.TestCase):
+
+    def test_current_removed_and_added_in_its_place(self):
+        playlist = sorted_playlist('a', 'c', 'e', 'g')
+        playlist.get_next(False)
+        playlist.get_next(False)
+        self.assertEqual(playlist.movies()[playlist.get_index()].target, 'c')
+        # b sorts before the removed movie and was passed, d follows it.
+        playlist.update(removed=['c'], added=[Movie('d'), Movie('b')])
+        self.assertEqual(targets(playlist.peek(2)), ['d', 'e'])
+        self.assertEqual(playlist.get_next(False).target, 'd')
+
+    def test_current_removed_and_only_earlier_movies_added(self):
+        playlist = sorted_playlist('a', 'c', 'e')
+        playlist.get_next(False)
+        playlist.get_next(False)
+        playlist.update(removed=['c'], added=[Movie('b')])
+        self.assertEqual(playlist.get_next(False).target, 'e')
+
+    def test_first_movie_removed_keeps_peeking(self):
+        playlist = sorted_playlist('b', 'c', 'd')
+        playlist.get_next(False)
+        playlist.update(removed=['b'], added=[Movie('a')])
+        self.assertEqual(targets(playlist.peek(1)), ['c'])
+        self.assertEqual(playlist.get_next(False).target, 'c')
+
+    def test_current_removed_wraps_around(self):
+        playlist = sorted_playlist('a', 'b', 'c')
+        for _ in range(3):
+            playlist.get_next(False)
+        playlist.update(removed=['c'])
+        self.assertEqual(targets(playlist.peek(1)), ['a'])
+        self.assertEqual(playlist.get_next(False).target, 'a')
+
+    def test_everything_removed(self):
+        playlist = sorted_playlist('a', 'b')
+        playlist.get_next(False)
+        playlist.update(removed=['a', 'b'])
+        self.assertEqual(playlist.peek(1), [])
+        self.assertIsNone(playlist.get_next(False))
+
+
+def repeats(order, last=None):
+    return sum(1 for previous, index in zip([last] + order, order) if previous == index)
+
+
+class ShuffleBagTest(unittest.TestCase):
+
+    def test_examples(self):
+        for weights in ([1, 1, 3], [1, 2], [2, 3]):
+            for seed in range(20):
+                order = list(ShuffleBag(weights, seed=seed)._order)
+                self.assertEqual(sorted(order), sorted(i for i, w in enumerate(weights) for _ in range(w)))
+                self.assertEqual(repeats(order), 0, (weights, order))
+
+    def test_no_repeats_when_avoidable(self):
+        rng = random.Random(1)
+        for _ in range(2000):
+            weights = [rng.randint(1, 6) for _ in range(rng.randint(1, 6))]
+            if max(weights) > sum(weights) - max(weights) + 1:
+                continue
+            order = list(ShuffleBag(weights, seed=rng.randrange(2**32))._order)
+            self.assertEqual(repeats(order), 0, (weights, order))
+
+    def test_no_repeat_across_cycles_when_avoidable(self):
+        rng = random.Random(2)
+        for _ in range(500):
+            weights = [rng.randint(1, 4) for _ in range(rng.randint(2, 5))]
+            bag = ShuffleBag(weights, seed=rng.randrange(2**32))
+            last = bag._order[-1]
+            bag._shuffle(rng.randrange(2**32), last=last)
+            order = list(bag._order)
+            others = sum(weights) - weights[last]
+            if weights[last] <= others and max(weights) <= sum(weights) - max(weights) + 1:
+                self.assertEqual(repeats(order, last), 0, (weights, last, order))
+
+    def test_fewest_repeats_when_unavoidable(self):
+        order = list(ShuffleBag([1, 4], seed=3)._order)
+        self.assertEqual(order, [1, 0, 1, 1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from Adafruit_Video_Looper import sync
+
+
+class SwapDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.link = os.path.join(self.work, 'videos')
+        self.staging = self.link + '.staging'
+        self._write(self.link, 'old.mp4')
+        self._write(self.staging, 'new.mp4')
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def _write(self, directory, name):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(name)
+
+    def test_swap(self):
+        previous = sync.swap_directory(self.link, self.staging)
+        self.assertEqual(os.listdir(self.link), ['new.mp4'])
+        self.assertEqual(os.listdir(previous), ['old.mp4'])
+        self.assertTrue(os.path.islink(self.link))
+
+    def test_crash_after_moving_the_live_directory(self):
+        # The process dies right after the real directory was renamed to a
+        # set, before any symlink exists at link.
+        with mock.patch.object(sync, '_point_link', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                sync.swap_directory(self.link, self.staging)
+        self.assertFalse(os.path.lexists(self.link))
+        self.assertTrue(sync.recover_link(self.link))
+        self.assertEqual(os.listdir(self.link), ['old.mp4'])
+        # Startup cleanup keeps the live set, the next swap still works.
+        live = os.path.realpath(self.link)
+        self.assertEqual([path for path in sync.set_directories(self.link) if path != live], [])
+        sync.swap_directory(self.link, self.staging)
+        self.assertEqual(os.listdir(self.link), ['new.mp4'])
+
+    def test_crash_after_moving_the_staging_directory(self):
+        sync.swap_directory(self.link, self.staging)
+        self._write(self.staging, 'newer.mp4')
+        with mock.patch.object(sync, '_point_link', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                sync.swap_directory(self.link, self.staging)
+        # The link still points at the complete previous set.
+        self.assertEqual(os.listdir(self.link), ['new.mp4'])
+        self.assertFalse(sync.recover_link(self.link))
+        os.remove(self.link)
+        self.assertTrue(sync.recover_link(self.link))
+        self.assertEqual(os.listdir(self.link), ['newer.mp4'])
+
+    def test_recover_dangling_link(self):
+        sync.swap_directory(self.link, self.staging)
+        for path in sync.set_directories(self.link):
+            shutil.rmtree(path)
+        self.assertFalse(sync.recover_link(self.link))
+        self._write(self.link + '.7', 'kept.mp4')
+        self.assertTrue(sync.recover_link(self.link))
+        self.assertEqual(os.listdir(self.link), ['kept.mp4'])
+
+
+class StagedRemovalTest(unittest.TestCase):
+    """A drive that only drops movies must still replace the live set, like
+    USBDriveReaderCopy._stage_files does it.
+    """
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.drive = os.path.join(self.work, 'usbdrive0')
+        self.link = os.path.join(self.work, 'videos')
+        os.makedirs(self.drive)
+        for name in ('a.mp4', 'b.mp4'):
+            with open(os.path.join(self.drive, name), 'w') as f:
+                f.write(name)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def _stage(self):
+        """Stage the drive's files, return true if the set was swapped."""
+        staging = self.link + '.staging'
+        os.makedirs(staging)
+        live = os.path.realpath(self.link)
+        synchronizer = sync.Synchronizer(staging, sync.SyncManifest(os.path.join(staging, '.sync.json'), self.link))
+        changed = 0
+        for name in sorted(os.listdir(self.drive)):
+            synchronizer.link(name, live)
+            changed += synchronizer.update(os.path.join(self.drive, name), name)
+        synchronizer.save()
+        if not changed and not sync.files_missing_from(live, staging):
+            shutil.rmtree(staging)
+            return False
+        sync.swap_directory(self.link, staging)
+        return True
+
+    def test_removal_only(self):
+        os.makedirs(self.link)
+        self.assertTrue(self._stage())
+        self.assertEqual(sorted(os.listdir(self.link)), ['.sync.json', 'a.mp4', 'b.mp4'])
+        self.assertFalse(self._stage())
+        os.remove(os.path.join(self.drive, 'b.mp4'))
+        self.assertEqual(sync.files_missing_from(os.path.realpath(self.link), self.drive), ['b.mp4'])
+        self.assertTrue(self._stage())
+        self.assertEqual(sorted(os.listdir(self.link)), ['.sync.json', 'a.mp4'])
+
+
+if __name__ == '__main__':
+    unittest.main()